@@ -7,30 +7,35 @@ allowing integration with the main backend service.
 """
 
 import os
-import sys
 import json
 import logging
+import uuid
 from datetime import datetime, timedelta
-import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 from pymongo import MongoClient
+from bson import ObjectId
 import requests
 from dotenv import load_dotenv
 from meal_forecast_model import MealForecastModel
+from factor_calendar import FactorCalendar
+from weather_provider import location_key
+from drift_monitor import DriftStore
+from forecast_materializer import read_forecasts, input_versions
+from intraday_profiles import SLOT_MINUTES
+from unit_similarity import UnitSimilarityIndex, demand_profile
+from forecast_service import (
+    MODEL_DIR, UNIT_INDEX_PATH, MIN_TRAINING_ROWS, MIN_FIT_ROWS, FORECAST_MEAL_TYPES, PLACEHOLDER_ACCURACY,
+    get_model_path, get_model, get_arrival_profiles, get_trained_unit_ids, neighbor_forecast,
+    historical_data_pipeline, historical_frame, forecast_frame, train_and_save_model,
+    drift_since, update_drift_monitor
+)
+from single_flight import SingleFlight
+from log_config import configure_logging, log_stage, request_id_var
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("api.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger("forecast_api")
 
 # Initialize Flask app
@@ -41,10 +46,6 @@ CORS(app)
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/kanteeno')
 API_URL = os.getenv('API_URL', 'http://localhost:5000')
 PORT = int(os.getenv('PORT', 5001))
-MODEL_DIR = os.getenv('MODEL_DIR', './models')
-
-# Ensure model directory exists
-os.makedirs(MODEL_DIR, exist_ok=True)
 
 # Connect to MongoDB
 try:
@@ -52,120 +53,214 @@ try:
     db = mongo_client.kanteeno
     logger.info("Connected to MongoDB")
 except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {e}")
+    logger.error("Failed to connect to MongoDB: %s", e)
     mongo_client = None
     db = None
 
+# Holiday and special event calendar
+factor_calendar = FactorCalendar(db) if db is not None else None
+
+# Weather location key per business unit
+business_unit_locations = {}
+
+# Drift monitoring state and retrain trigger log
+drift_store = DriftStore(MODEL_DIR, db)
+
+# Concurrent identical requests share one training run or forecast
+training_flight = SingleFlight('training')
+forecast_flight = SingleFlight('forecast')
+
 # Helper functions
-def get_model_path(business_unit_id):
-    """Get path to model file for a business unit"""
-    return os.path.join(MODEL_DIR, f"model_{business_unit_id}.joblib")
+def get_business_unit_location(business_unit_id):
+    """Get the weather location key for a business unit"""
+    if business_unit_id not in business_unit_locations:
+        address = None
+        if db is not None and ObjectId.is_valid(business_unit_id):
+            business_unit = db.businessunits.find_one({'_id': ObjectId(business_unit_id)}, {'address': 1})
+            address = business_unit.get('address') if business_unit else None
+        business_unit_locations[business_unit_id] = location_key(address)
+    return business_unit_locations[business_unit_id]
+
+def get_business_unit(business_unit_id):
+    """Get the business unit document (None if unknown)"""
+    if db is None or not ObjectId.is_valid(business_unit_id):
+        return None
+    return db.businessunits.find_one({'_id': ObjectId(business_unit_id)})
+
+def rebuild_unit_index():
+    """Rebuild and save the similarity index over all trained units (offline, see retrain_scheduler)"""
+    trained_unit_ids = get_trained_unit_ids()
+    business_units = {}
+    profiles = {}
+    for business_unit_id in trained_unit_ids:
+        business_units[business_unit_id] = get_business_unit(business_unit_id)
+        if db is not None:
+            profiles[business_unit_id] = demand_profile(fetch_historical_data(business_unit_id))
+    
+    unit_index = UnitSimilarityIndex.build(business_units, trained_unit_ids, profiles)
+    unit_index.save(UNIT_INDEX_PATH)
+    logger.info("Rebuilt unit similarity index with %d business units", len(unit_index))
+    return unit_index
+
+def cold_start_forecast(business_unit_id, forecast_data, historical_data):
+    """Forecast a unit without its own model from its nearest trained units"""
+    return neighbor_forecast(business_unit_id, get_business_unit(business_unit_id), forecast_data, historical_data)
 
 def fetch_historical_data(business_unit_id, start_date=None, end_date=None):
     """Fetch historical meal data from MongoDB"""
-    if not db:
+    if db is None:
         raise Exception("Database connection not available")
     
-    # Default to last 90 days if dates not provided
-    if not end_date:
-        end_date = datetime.now()
-    if not start_date:
-        start_date = end_date - timedelta(days=90)
-    
-    # Query MongoDB for historical data
-    pipeline = [
-        {
-            "$match": {
-                "businessUnitId": business_unit_id,
-                "date": {"$gte": start_date, "$lte": end_date}
-            }
-        },
-        {
-            "$lookup": {
-                "from": "menus",
-                "localField": "menuId",
-                "foreignField": "_id",
-                "as": "menu"
-            }
-        },
-        {
-            "$unwind": "$menu"
-        },
-        {
-            "$project": {
-                "date": 1,
-                "mealType": 1,
-                "actualMeals": "$guestCount",
-                "temperature": "$weather.temperature",
-                "is_holiday": "$isHoliday",
-                "is_special_event": "$isSpecialEvent",
-                "previous_week_avg": 1,
-                "previous_day": 1,
-                "registered_guests": "$registeredGuests"
-            }
-        }
-    ]
-    
-    results = list(db.meals.aggregate(pipeline))
+    results = list(db.meals.aggregate(historical_data_pipeline(business_unit_id, start_date, end_date)))
+    return historical_frame(results)
+
+def prepare_forecast_data(business_unit_id, start_date, end_date):
+    """Prepare data for forecasting (weather and the unit's factors, no history aggregation)"""
+    df = forecast_frame(start_date, end_date, get_business_unit_location(business_unit_id))
     
-    # Convert to DataFrame
-    if results:
-        df = pd.DataFrame(results)
-        return df
+    # Apply holidays and special events from the factor calendar
+    if factor_calendar is not None:
+        df = factor_calendar.apply(business_unit_id, df)
     else:
-        # If no data, return empty DataFrame with expected columns
-        return pd.DataFrame(columns=[
-            'date', 'mealType', 'actualMeals', 'temperature',
-            'is_holiday', 'is_special_event', 'previous_week_avg',
-            'previous_day', 'registered_guests'
-        ])
+        df['factor_impact'] = 0.0
+    
+    return df
 
-def prepare_forecast_data(business_unit_id, start_date, end_date):
-    """Prepare data for forecasting"""
-    # Get dates for the forecast period
-    dates = pd.date_range(start=start_date, end=end_date)
-    meal_types = ['breakfast', 'lunch', 'dinner']
+def train_missing_model(business_unit_id, historical_data):
+    """Train a unit's model unless a concurrent request saved one meanwhile (then without metrics)"""
+    model = get_model(business_unit_id)
+    if model is not None:
+        return model, None
+    return train_and_save_model(business_unit_id, historical_data)
+
+def train_unit(business_unit_id, historical_data):
+    """Train and save a unit's model, sharing the run with concurrent training of the unit"""
+    model, metrics = training_flight.do(business_unit_id, train_and_save_model, business_unit_id, historical_data)
+    if metrics is None:
+        # Joined a forecast request that found a saved model: train on this data
+        model, metrics = training_flight.do(business_unit_id, train_and_save_model,
+                                            business_unit_id, historical_data)
+    return model, metrics
+
+def check_model_drift(business_unit_id, retrain=True):
+    """Update a unit's drift monitor with new actuals and retrain if drifted"""
+    status, since = drift_since(business_unit_id)
+    if status != 'ok':
+        return {'status': status}
     
-    # Create DataFrame with all combinations of dates and meal types
-    forecast_data = []
-    for date in dates:
-        for meal_type in meal_types:
-            forecast_data.append({
-                'date': date,
-                'meal_type': meal_type,
-                'temperature': None,  # Will be filled with weather API data
-                'is_holiday': False,  # Will be determined
-                'is_special_event': False,  # Will be determined
-                'previous_week_avg': None,  # Will be calculated
-                'previous_day': None,  # Will be calculated
-                'registered_guests': None  # Will be fetched from reservations
-            })
+    # Only observations newer than the last update (or the training run)
+    new_data = fetch_historical_data(business_unit_id, since + timedelta(seconds=1), datetime.now())
+    result = update_drift_monitor(business_unit_id, new_data)
     
-    df = pd.DataFrame(forecast_data)
+    if result['reasons']:
+        drift_store.record_trigger(business_unit_id, result)
+        if retrain:
+            historical_data = fetch_historical_data(business_unit_id)
+            if len(historical_data) >= MIN_FIT_ROWS:
+                _, result['metrics'] = train_unit(business_unit_id, historical_data)
+                drift_store.reset(business_unit_id)
+                result['status'] = 'retrained'
     
-    # Fetch historical data to calculate previous averages
-    historical_data = fetch_historical_data(business_unit_id, 
-                                           start_date - timedelta(days=30), 
-                                           start_date - timedelta(days=1))
+    return result
+
+def compute_forecast(business_unit_id, start_date, end_date, explain=False):
+    """Generate (and store) a forecast, returning the response body and status"""
+    # Check if model exists, otherwise train a new one
+    model = get_model(business_unit_id)
+    if model is None:
+        # Fetch historical data for training
+        historical_data = fetch_historical_data(business_unit_id)
+        if len(historical_data) < MIN_TRAINING_ROWS:
+            # Too little history for an own model: borrow from similar units
+            forecast_data = prepare_forecast_data(business_unit_id, start_date, end_date)
+            forecast_results, neighbors = cold_start_forecast(business_unit_id, forecast_data, historical_data)
+            if forecast_results is None:
+                return {'error': 'Not enough historical data for training'}, 400
+            
+            forecast_json = forecast_results.to_dict(orient='records')
+            if db is not None:
+                db.forecasts.insert_one({
+                    'businessUnitId': business_unit_id,
+                    'startDate': start_date,
+                    'endDate': end_date,
+                    'createdAt': datetime.now(),
+                    'items': forecast_json,
+                    'modelVersion': 'cold-start',
+                    'neighbors': neighbors
+                })
+            
+            return {
+                'success': True,
+                'forecast': forecast_json,
+                'coldStart': {'neighbors': neighbors}
+            }, 200
+        
+        # Train new model (concurrent requests for the unit share one run, and
+        # a request arriving after it finished uses the saved model)
+        model, _ = training_flight.do(business_unit_id, train_missing_model, business_unit_id, historical_data)
+        logger.info("Trained new model for business unit %s", business_unit_id,
+                    extra={'business_unit_id': business_unit_id})
     
-    # TODO: Enhance with actual calculations based on historical data
-    # For now, use simple placeholders
-    df['temperature'] = 20.0  # Placeholder
-    df['previous_week_avg'] = 100  # Placeholder
-    df['previous_day'] = 100  # Placeholder
-    df['registered_guests'] = 0  # Placeholder
+    # Prepare forecast data
+    with log_stage(logger, 'prepare', business_unit_id):
+        forecast_data = prepare_forecast_data(business_unit_id, start_date, end_date)
     
-    # Check for holidays (simplified)
-    # TODO: Integrate with actual holiday API
-    holidays = []  # Placeholder for holiday dates
-    df['is_holiday'] = df['date'].dt.date.isin(holidays)
+    # Serve precomputed forecasts when they were made by the current model from
+    # the current factors and weather (explanations need the forecast
+    # features, so they always run live)
+    forecast_json = None
+    if db is not None and not explain:
+        forecast_json = read_forecasts(db, business_unit_id, start_date, end_date,
+                                       model.model_version, FORECAST_MEAL_TYPES, input_versions(forecast_data))
     
-    # Check for special events (simplified)
-    # TODO: Fetch from events collection
-    special_events = []  # Placeholder for special event dates
-    df['is_special_event'] = df['date'].dt.date.isin(special_events)
+    if forecast_json is None:
+        # Generate forecast
+        with log_stage(logger, 'predict', business_unit_id):
+            forecast_results = model.predict(forecast_data)
+        
+        # Convert to JSON-serializable format
+        forecast_json = forecast_results.to_dict(orient='records')
+        
+        if explain:
+            contributions = model.explain(forecast_data)
+            for item, (_, row) in zip(forecast_json, contributions.iterrows()):
+                item['explanation'] = {
+                    'bias': float(row['bias']),
+                    'contributions': {feature: float(row[feature]) for feature in model.features}
+                }
     
-    return df
+    # Save forecast to database
+    if db is not None:
+        forecast_doc = {
+            'businessUnitId': business_unit_id,
+            'startDate': start_date,
+            'endDate': end_date,
+            'createdAt': datetime.now(),
+            'items': forecast_json,
+            'modelVersion': getattr(model, 'model_version', '1.0.0')
+        }
+        db.forecasts.insert_one(forecast_doc)
+    
+    return {
+        'success': True,
+        'forecast': forecast_json
+    }, 200
+
+# Request IDs, attached to every log event emitted while handling a request
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = request_id_var.set(g.request_id)
+
+@app.after_request
+def return_request_id(response):
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def clear_request_id(exc):
+    if 'request_id_token' in g:
+        request_id_var.reset(g.request_id_token)
 
 # API routes
 @app.route('/health', methods=['GET'])
@@ -175,7 +270,7 @@ def health_check():
         'status': 'ok',
         'timestamp': datetime.now().isoformat(),
         'service': 'forecast-api',
-        'mongodb': 'connected' if db else 'disconnected'
+        'mongodb': 'connected' if db is not None else 'disconnected'
     })
 
 @app.route('/api/forecasts/generate', methods=['POST'])
@@ -190,51 +285,47 @@ def generate_forecast():
         if not business_unit_id:
             return jsonify({'error': 'Business unit ID is required'}), 400
         
-        # Check if model exists, otherwise train a new one
-        model_path = get_model_path(business_unit_id)
-        if os.path.exists(model_path):
-            model = MealForecastModel(business_unit_id, model_path)
-            logger.info(f"Loaded existing model for business unit {business_unit_id}")
-        else:
-            # Fetch historical data for training
-            historical_data = fetch_historical_data(business_unit_id)
-            if historical_data.empty:
-                return jsonify({'error': 'Not enough historical data for training'}), 400
-            
-            # Train new model
-            model = MealForecastModel(business_unit_id)
-            metrics = model.train(historical_data)
-            model.save_model(model_path)
-            logger.info(f"Trained new model for business unit {business_unit_id}")
-        
-        # Prepare forecast data
-        forecast_data = prepare_forecast_data(business_unit_id, start_date, end_date)
+        # Identical concurrent requests share one computation
+        explain = str(data.get('explain', False)).lower() == 'true'
+        body, status = forecast_flight.do((business_unit_id, start_date, end_date, explain), compute_forecast,
+                                          business_unit_id, start_date, end_date, explain)
+        return jsonify(body), status
+    
+    except Exception as e:
+        logger.error("Error generating forecast: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/forecasts/intraday', methods=['POST'])
+def generate_intraday_forecast():
+    """Generate 15-minute slot forecasts for a business unit"""
+    try:
+        data = request.json
+        business_unit_id = data.get('businessUnitId')
+        start_date = datetime.fromisoformat(data.get('startDate').replace('Z', '+00:00'))
+        end_date = datetime.fromisoformat(data.get('endDate').replace('Z', '+00:00'))
         
-        # Generate forecast
-        forecast_results = model.predict(forecast_data)
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
         
-        # Convert to JSON-serializable format
-        forecast_json = forecast_results.to_dict(orient='records')
+        model = get_model(business_unit_id)
+        if model is None:
+            return jsonify({'error': 'No trained model for business unit'}), 400
         
-        # Save forecast to database
-        if db:
-            forecast_doc = {
-                'businessUnitId': business_unit_id,
-                'startDate': start_date,
-                'endDate': end_date,
-                'createdAt': datetime.now(),
-                'items': forecast_json,
-                'modelVersion': getattr(model, 'model_version', '1.0.0')
-            }
-            db.forecasts.insert_one(forecast_doc)
+        # Split the daily forecast with the unit's arrival profiles
+        forecast_results = model.predict(prepare_forecast_data(business_unit_id, start_date, end_date))
+        meal_types = data.get('mealTypes')
+        if meal_types:
+            forecast_results = forecast_results[forecast_results['meal_type'].isin(meal_types)]
+        slot_results = get_arrival_profiles().disaggregate(forecast_results, business_unit_id)
         
         return jsonify({
             'success': True,
-            'forecast': forecast_json
+            'slotMinutes': SLOT_MINUTES,
+            'forecast': slot_results.to_dict(orient='records')
         })
     
     except Exception as e:
-        logger.error(f"Error generating forecast: {e}")
+        logger.error("Error generating intraday forecast: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/forecasts/train', methods=['POST'])
@@ -251,16 +342,11 @@ def train_model():
         
         # Fetch historical data
         historical_data = fetch_historical_data(business_unit_id, start_date, end_date)
-        if historical_data.empty:
+        if len(historical_data) < MIN_FIT_ROWS:
             return jsonify({'error': 'Not enough historical data for training'}), 400
         
-        # Train model
-        model = MealForecastModel(business_unit_id)
-        metrics = model.train(historical_data)
-        
-        # Save model
-        model_path = get_model_path(business_unit_id)
-        model.save_model(model_path)
+        # Train and save model (concurrent training of the unit shares one run)
+        _, metrics = train_unit(business_unit_id, historical_data)
         
         return jsonify({
             'success': True,
@@ -268,7 +354,7 @@ def train_model():
         })
     
     except Exception as e:
-        logger.error(f"Error training model: {e}")
+        logger.error("Error training model: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/forecasts/accuracy', methods=['GET'])
@@ -291,30 +377,12 @@ def get_accuracy():
         # Fetch historical data with actual and predicted values
         # In a real implementation, this would come from the database
         # For now, we'll return placeholder data
-        accuracy_data = {
-            'accuracy': 92.5,
-            'mae': 3.2,
-            'rmse': 4.1,
-            'by_day': {
-                'monday': 94.2,
-                'tuesday': 93.1,
-                'wednesday': 91.8,
-                'thursday': 92.5,
-                'friday': 90.9,
-                'saturday': 95.0,
-                'sunday': 94.8
-            },
-            'by_meal_type': {
-                'breakfast': 93.5,
-                'lunch': 91.2,
-                'dinner': 94.1
-            }
-        }
+        accuracy_data = PLACEHOLDER_ACCURACY
         
         return jsonify(accuracy_data)
     
     except Exception as e:
-        logger.error(f"Error getting accuracy: {e}")
+        logger.error("Error getting accuracy: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/forecasts/factors', methods=['GET'])
@@ -326,33 +394,21 @@ def get_factors():
         if not business_unit_id:
             return jsonify({'error': 'Business unit ID is required'}), 400
         
-        # In a real implementation, fetch from database
-        # For now, return placeholder data
-        factors = [
-            {
-                'name': 'Summer Holiday',
-                'date': '2025-07-15',
-                'impact': 30,
-                'description': 'Reduced attendance due to summer holidays'
-            },
-            {
-                'name': 'Company Event',
-                'date': '2025-04-10',
-                'impact': 50,
-                'description': 'Increased attendance due to company-wide event'
-            },
-            {
-                'name': 'Public Holiday',
-                'date': '2025-05-01',
-                'impact': -80,
-                'description': 'Closed for public holiday'
-            }
-        ]
+        if factor_calendar is None:
+            raise Exception("Database connection not available")
+        
+        start_date = request.args.get('startDate')
+        end_date = request.args.get('endDate')
+        factors = factor_calendar.get_factors(
+            business_unit_id,
+            datetime.fromisoformat(start_date.replace('Z', '+00:00')) if start_date else None,
+            datetime.fromisoformat(end_date.replace('Z', '+00:00')) if end_date else None
+        )
         
         return jsonify(factors)
     
     except Exception as e:
-        logger.error(f"Error getting factors: {e}")
+        logger.error("Error getting factors: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/forecasts/factors', methods=['POST'])
@@ -370,17 +426,59 @@ def add_factor():
             if field not in data:
                 return jsonify({'error': f'{field} is required'}), 400
         
-        # In a real implementation, save to database
-        # For now, just return success
+        if factor_calendar is None:
+            raise Exception("Database connection not available")
+        
+        try:
+            factor_id = factor_calendar.add_factor(business_unit_id, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
             'success': True,
-            'message': 'Factor added successfully'
+            'message': 'Factor added successfully',
+            'id': factor_id
         })
     
     except Exception as e:
-        logger.error(f"Error adding factor: {e}")
+        logger.error("Error adding factor: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/forecasts/drift/check', methods=['POST'])
+def check_drift():
+    """Check a model for drift and retrain it if thresholds are crossed"""
+    try:
+        data = request.json
+        business_unit_id = data.get('businessUnitId')
+        
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+        
+        result = check_model_drift(business_unit_id, retrain=data.get('retrain', True))
+        if result['status'] == 'no_model':
+            return jsonify({'error': 'No model found for this business unit'}), 404
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error("Error checking drift: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/forecasts/drift/triggers', methods=['GET'])
+def get_drift_triggers():
+    """Get recorded retrain triggers for a business unit"""
+    try:
+        business_unit_id = request.args.get('businessUnitId')
+        
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+        
+        return jsonify(drift_store.get_triggers(business_unit_id))
+    
+    except Exception as e:
+        logger.error("Error getting drift triggers: %s", e)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    configure_logging(os.getenv('LOG_FILE', 'api.log'))
     app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+Async Forecast API Service for Kanteeno
+
+This is an ASGI variant of api.py with the same routes. Database access goes
+through the Motor async driver on one shared connection pool, and CPU-bound
+training and inference run in a process pool, so concurrent dashboard
+requests do not queue behind slow queries or model fits. All data is loaded
+through Motor in the event loop; the workers only get plain frames and run
+the database-free functions of forecast_service.
+
+Usage:
+hypercorn async_api:app --bind 0.0.0.0:5001
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from quart import Quart, request, jsonify, g
+from quart_cors import cors
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from factor_calendar import FactorIntervalIndex, apply_factor_index, factor_document
+from drift_monitor import trigger_document
+from forecast_materializer import (
+    COLLECTION_NAME as MATERIALIZED_COLLECTION, materialized_query, forecast_records, input_versions
+)
+from weather_provider import location_key
+from intraday_profiles import SLOT_MINUTES
+from single_flight import AsyncSingleFlight
+from forecast_service import (
+    MIN_TRAINING_ROWS, MIN_FIT_ROWS, FORECAST_MEAL_TYPES, PLACEHOLDER_ACCURACY, monitor_store,
+    get_model_path, get_model, get_arrival_profiles, neighbor_forecast, historical_data_pipeline,
+    historical_frame, forecast_frame, train_and_save_model, drift_since, update_drift_monitor
+)
+from log_config import configure_logging, log_stage, request_id_var
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger("async_forecast_api")
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/kanteeno')
+PORT = int(os.getenv('PORT', 5001))
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+FORECAST_WORKERS = int(os.getenv('FORECAST_WORKERS', os.cpu_count() or 1))
+
+# Initialize Quart app
+app = cors(Quart(__name__))
+
+# Async database handle and worker pool, created when serving starts (tests
+# may assign an in-memory stand-in such as mongomock_motor beforehand)
+db = None
+executor = None
+
+# Per-unit caches filled from the database
+factor_indexes = {}
+factor_generations = {}  # Bumped when a unit's factors change, see get_factor_index
+business_unit_locations = {}
+model_versions = {}
+
+# Concurrent identical requests share one training run or forecast
+training_flight = AsyncSingleFlight('training')
+forecast_flight = AsyncSingleFlight('forecast')
+
+
+# Worker functions (run in the process pool on data loaded by the event loop)
+def train_worker(business_unit_id, historical_data):
+    """Train and save a model, returning its metrics"""
+    return train_and_save_model(business_unit_id, historical_data)[1]
+
+
+def model_version_worker(business_unit_id):
+    """Get the version of a unit's saved model (None if not trained)"""
+    model = get_model(business_unit_id)
+    return model.model_version if model is not None else None
+
+
+def predict_worker(business_unit_id, forecast_data, explain=False):
+    """Predict with a unit's saved model, returning forecast records"""
+    model = get_model(business_unit_id)
+    forecast_json = model.predict(forecast_data).to_dict(orient='records')
+
+    if explain:
+        contributions = model.explain(forecast_data)
+        for item, (_, row) in zip(forecast_json, contributions.iterrows()):
+            item['explanation'] = {
+                'bias': float(row['bias']),
+                'contributions': {feature: float(row[feature]) for feature in model.features}
+            }
+    return forecast_json
+
+
+def intraday_worker(business_unit_id, forecast_data, meal_types=None):
+    """Predict with a unit's saved model and split the forecast into slots"""
+    forecast_results = get_model(business_unit_id).predict(forecast_data)
+    if meal_types:
+        forecast_results = forecast_results[forecast_results['meal_type'].isin(meal_types)]
+    return get_arrival_profiles().disaggregate(forecast_results, business_unit_id).to_dict(orient='records')
+
+
+def cold_start_worker(business_unit_id, business_unit, forecast_data, historical_data):
+    """Forecast a unit without a model from similar units"""
+    forecast_results, neighbors = neighbor_forecast(business_unit_id, business_unit, forecast_data, historical_data)
+    if forecast_results is None:
+        return None, []
+    return forecast_results.to_dict(orient='records'), neighbors
+
+
+# Helper functions
+async def run_cpu(function, *args):
+    """Run a CPU-bound function in the process pool"""
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+async def get_model_version(business_unit_id):
+    """Get the current model version of a unit, cached by model file modification time"""
+    model_path = get_model_path(business_unit_id)
+    if not os.path.exists(model_path):
+        return None
+
+    modified = os.path.getmtime(model_path)
+    cached = model_versions.get(business_unit_id)
+    if cached is None or cached[0] != modified:
+        cached = (modified, await run_cpu(model_version_worker, business_unit_id))
+        model_versions[business_unit_id] = cached
+    return cached[1]
+
+
+async def get_business_unit_location(business_unit_id):
+    """Get the weather location key for a business unit"""
+    if business_unit_id not in business_unit_locations:
+        address = None
+        if ObjectId.is_valid(business_unit_id):
+            business_unit = await db.businessunits.find_one({'_id': ObjectId(business_unit_id)}, {'address': 1})
+            address = business_unit.get('address') if business_unit else None
+        business_unit_locations[business_unit_id] = location_key(address)
+    return business_unit_locations[business_unit_id]
+
+
+async def get_business_unit(business_unit_id):
+    """Get the business unit document (None if unknown)"""
+    if not ObjectId.is_valid(business_unit_id):
+        return None
+    return await db.businessunits.find_one({'_id': ObjectId(business_unit_id)})
+
+
+async def get_factor_index(business_unit_id):
+    """Get the cached factor interval index for a business unit"""
+    index = factor_indexes.get(business_unit_id)
+    if index is None:
+        generation = factor_generations.get(business_unit_id, 0)
+        factors = await db.forecastfactors.find({'businessUnitId': business_unit_id}).to_list(None)
+        index = FactorIntervalIndex(factors)
+        # Do not cache factors loaded while a factor was added
+        if factor_generations.get(business_unit_id, 0) == generation:
+            factor_indexes[business_unit_id] = index
+    return index
+
+
+async def fetch_historical_data(business_unit_id, start_date=None, end_date=None):
+    """Fetch historical meal data from MongoDB"""
+    pipeline = historical_data_pipeline(business_unit_id, start_date, end_date)
+    results = await db.meals.aggregate(pipeline).to_list(None)
+    return historical_frame(results)
+
+
+async def prepare_forecast_data(business_unit_id, start_date, end_date):
+    """Prepare data for forecasting"""
+    location = await get_business_unit_location(business_unit_id)
+    # Weather lookups may read cache files, so keep them off the event loop
+    df = await asyncio.to_thread(forecast_frame, start_date, end_date, location)
+    return apply_factor_index(await get_factor_index(business_unit_id), df)
+
+
+async def train_model_async(business_unit_id, historical_data):
+    """Train and save a unit's model in the process pool"""
+    with log_stage(logger, 'train', business_unit_id):
+        return await run_cpu(train_worker, business_unit_id, historical_data)
+
+
+async def train_missing_model(business_unit_id, historical_data):
+    """Train a unit's model unless a concurrent request saved one meanwhile (None if it did)"""
+    if await get_model_version(business_unit_id) is not None:
+        return None
+    return await train_model_async(business_unit_id, historical_data)
+
+
+async def train_unit(business_unit_id, historical_data):
+    """Train and save a unit's model, sharing the run with concurrent training of the unit"""
+    metrics = await training_flight.do(business_unit_id, train_model_async, business_unit_id, historical_data)
+    if metrics is None:
+        # Joined a forecast request that found a saved model: train on this data
+        metrics = await training_flight.do(business_unit_id, train_model_async, business_unit_id, historical_data)
+    return metrics
+
+
+async def check_model_drift(business_unit_id, retrain=True):
+    """Update a unit's drift monitor with new actuals and retrain if drifted"""
+    status, since = await run_cpu(drift_since, business_unit_id)
+    if status != 'ok':
+        return {'status': status}
+
+    # Only observations newer than the last update (or the training run)
+    new_data = await fetch_historical_data(business_unit_id, since + timedelta(seconds=1), datetime.now())
+    result = await run_cpu(update_drift_monitor, business_unit_id, new_data)
+
+    if result['reasons']:
+        logger.info("Retrain triggered for business unit %s: %s", business_unit_id,
+                    '; '.join(result['reasons']), extra={'business_unit_id': business_unit_id})
+        await db.retraintriggers.insert_one(trigger_document(business_unit_id, result))
+        if retrain:
+            historical_data = await fetch_historical_data(business_unit_id)
+            if len(historical_data) >= MIN_FIT_ROWS:
+                result['metrics'] = await train_unit(business_unit_id, historical_data)
+                await asyncio.to_thread(monitor_store.reset, business_unit_id)
+                result['status'] = 'retrained'
+
+    return result
+
+
+async def compute_forecast(business_unit_id, start_date, end_date, explain=False):
+    """Generate (and store) a forecast, returning the response body and status"""
+    # Check if model exists, otherwise train a new one
+    model_version = await get_model_version(business_unit_id)
+    if model_version is None:
+        historical_data = await fetch_historical_data(business_unit_id)
+        if len(historical_data) < MIN_TRAINING_ROWS:
+            # Too little history for an own model: borrow from similar units
+            forecast_data = await prepare_forecast_data(business_unit_id, start_date, end_date)
+            forecast_json, neighbors = await run_cpu(
+                cold_start_worker, business_unit_id, await get_business_unit(business_unit_id),
+                forecast_data, historical_data)
+            if forecast_json is None:
+                return {'error': 'Not enough historical data for training'}, 400
+
+            await db.forecasts.insert_one({
+                'businessUnitId': business_unit_id,
+                'startDate': start_date,
+                'endDate': end_date,
+                'createdAt': datetime.now(),
+                'items': forecast_json,
+                'modelVersion': 'cold-start',
+                'neighbors': neighbors
+            })
+            return {
+                'success': True,
+                'forecast': forecast_json,
+                'coldStart': {'neighbors': neighbors}
+            }, 200
+
+        # Concurrent requests for the unit share one training run, and a
+        # request arriving after it finished uses the saved model
+        await training_flight.do(business_unit_id, train_missing_model, business_unit_id, historical_data)
+        model_version = await get_model_version(business_unit_id)
+        logger.info("Trained new model for business unit %s", business_unit_id,
+                    extra={'business_unit_id': business_unit_id})
+
+    with log_stage(logger, 'prepare', business_unit_id):
+        forecast_data = await prepare_forecast_data(business_unit_id, start_date, end_date)
+
+    # Serve precomputed forecasts when they were made by the current model from
+    # the current factors and weather (explanations need the forecast
+    # features, so they always run live)
+    forecast_json = None
+    if not explain:
+        query, expected = materialized_query(business_unit_id, start_date, end_date,
+                                             model_version, FORECAST_MEAL_TYPES)
+        documents = await db[MATERIALIZED_COLLECTION].find(query, {'_id': 0}).to_list(None)
+        forecast_json = forecast_records(documents, expected, FORECAST_MEAL_TYPES,
+                                         input_versions(forecast_data))
+
+    if forecast_json is None:
+        with log_stage(logger, 'predict', business_unit_id):
+            forecast_json = await run_cpu(predict_worker, business_unit_id, forecast_data, explain)
+
+    # Save forecast to database
+    await db.forecasts.insert_one({
+        'businessUnitId': business_unit_id,
+        'startDate': start_date,
+        'endDate': end_date,
+        'createdAt': datetime.now(),
+        'items': forecast_json,
+        'modelVersion': model_version
+    })
+
+    return {
+        'success': True,
+        'forecast': forecast_json
+    }, 200
+
+
+def parse_date(value):
+    """Parse an ISO date from a request body"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+# Request lifecycle
+@app.before_serving
+async def startup():
+    global db, executor
+    if db is None:
+        db = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE).kanteeno
+        logger.info("Connected to MongoDB (pool size %d)", MONGO_MAX_POOL_SIZE)
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=FORECAST_WORKERS)
+
+
+@app.after_serving
+async def shutdown():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+@app.before_request
+async def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = request_id_var.set(g.request_id)
+
+
+@app.after_request
+async def return_request_id(response):
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+# API routes
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint"""
+    try:
+        await db.command('ping')
+        mongodb = 'connected'
+    except Exception:
+        mongodb = 'disconnected'
+    return jsonify({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat(),
+        'service': 'forecast-api-async',
+        'mongodb': mongodb
+    })
+
+
+@app.route('/api/forecasts/generate', methods=['POST'])
+async def generate_forecast():
+    """Generate a forecast for a business unit"""
+    try:
+        data = await request.get_json()
+        business_unit_id = data.get('businessUnitId')
+        start_date = parse_date(data.get('startDate'))
+        end_date = parse_date(data.get('endDate'))
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        # Identical concurrent requests share one computation
+        explain = str(data.get('explain', False)).lower() == 'true'
+        body, status = await forecast_flight.do((business_unit_id, start_date, end_date, explain),
+                                                compute_forecast, business_unit_id, start_date, end_date, explain)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.error("Error generating forecast: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/intraday', methods=['POST'])
+async def generate_intraday_forecast():
+    """Generate 15-minute slot forecasts for a business unit"""
+    try:
+        data = await request.get_json()
+        business_unit_id = data.get('businessUnitId')
+        start_date = parse_date(data.get('startDate'))
+        end_date = parse_date(data.get('endDate'))
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        if await get_model_version(business_unit_id) is None:
+            return jsonify({'error': 'No trained model for business unit'}), 400
+
+        forecast_data = await prepare_forecast_data(business_unit_id, start_date, end_date)
+        slot_json = await run_cpu(intraday_worker, business_unit_id, forecast_data, data.get('mealTypes'))
+
+        return jsonify({
+            'success': True,
+            'slotMinutes': SLOT_MINUTES,
+            'forecast': slot_json
+        })
+
+    except Exception as e:
+        logger.error("Error generating intraday forecast: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/train', methods=['POST'])
+async def train_model():
+    """Train a new forecast model"""
+    try:
+        data = await request.get_json()
+        business_unit_id = data.get('businessUnitId')
+        start_date = parse_date(data.get('startDate'))
+        end_date = parse_date(data.get('endDate'))
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        historical_data = await fetch_historical_data(business_unit_id, start_date, end_date)
+        if len(historical_data) < MIN_FIT_ROWS:
+            return jsonify({'error': 'Not enough historical data for training'}), 400
+
+        # Concurrent training of the unit shares one run
+        metrics = await train_unit(business_unit_id, historical_data)
+
+        return jsonify({
+            'success': True,
+            'metrics': metrics
+        })
+
+    except Exception as e:
+        logger.error("Error training model: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/accuracy', methods=['GET'])
+async def get_accuracy():
+    """Get forecast accuracy metrics"""
+    try:
+        business_unit_id = request.args.get('businessUnitId')
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        if not os.path.exists(get_model_path(business_unit_id)):
+            return jsonify({'error': 'No model found for this business unit'}), 404
+
+        return jsonify(PLACEHOLDER_ACCURACY)
+
+    except Exception as e:
+        logger.error("Error getting accuracy: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/factors', methods=['GET'])
+async def get_factors():
+    """Get external factors affecting forecasts"""
+    try:
+        business_unit_id = request.args.get('businessUnitId')
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        start_date = request.args.get('startDate')
+        end_date = request.args.get('endDate')
+        index = await get_factor_index(business_unit_id)
+
+        return jsonify(index.in_range(
+            parse_date(start_date) if start_date else None,
+            parse_date(end_date) if end_date else None
+        ))
+
+    except Exception as e:
+        logger.error("Error getting factors: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/factors', methods=['POST'])
+async def add_factor():
+    """Add external factor"""
+    try:
+        data = await request.get_json()
+        business_unit_id = data.get('businessUnitId')
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        required_fields = ['name', 'date', 'impact', 'description']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({'error': f'{field} is required'}), 400
+
+        try:
+            document = factor_document(business_unit_id, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        result = await db.forecastfactors.insert_one(document)
+        factor_indexes.pop(business_unit_id, None)
+        factor_generations[business_unit_id] = factor_generations.get(business_unit_id, 0) + 1
+
+        return jsonify({
+            'success': True,
+            'message': 'Factor added successfully',
+            'id': str(result.inserted_id)
+        })
+
+    except Exception as e:
+        logger.error("Error adding factor: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/drift/check', methods=['POST'])
+async def check_drift():
+    """Check a model for drift and retrain it if thresholds are crossed"""
+    try:
+        data = await request.get_json()
+        business_unit_id = data.get('businessUnitId')
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        result = await check_model_drift(business_unit_id, retrain=data.get('retrain', True))
+        if result['status'] == 'no_model':
+            return jsonify({'error': 'No model found for this business unit'}), 404
+
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error("Error checking drift: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/forecasts/drift/triggers', methods=['GET'])
+async def get_drift_triggers():
+    """Get recorded retrain triggers for a business unit"""
+    try:
+        business_unit_id = request.args.get('businessUnitId')
+
+        if not business_unit_id:
+            return jsonify({'error': 'Business unit ID is required'}), 400
+
+        triggers = await db.retraintriggers.find({'businessUnitId': business_unit_id}, {'_id': 0}) \
+            .sort('createdAt', -1).limit(50).to_list(None)
+        return jsonify([{**trigger, 'createdAt': trigger['createdAt'].isoformat()} for trigger in triggers])
+
+    except Exception as e:
+        logger.error("Error getting drift triggers: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+if __name__ == '__main__':
+    configure_logging(os.getenv('LOG_FILE', 'api.log'))
+    app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Drift Monitor for Kanteeno Forecasting
+
+This module tracks, per business unit, how recent feature distributions and
+forecast residuals compare with the training snapshot stored in the
+MealForecastModel artifact, and decides when a retrain is worth the compute.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pymongo
+
+logger = logging.getLogger("drift_monitor")
+
+# Continuous features whose distribution is compared against training
+DRIFT_FEATURES = ['temperature', 'previous_week_avg', 'previous_day', 'registered_guests']
+
+DEFAULT_THRESHOLDS = {
+    'psi': 0.25,           # Population stability index per feature
+    'mae_ratio': 1.5,      # Rolling MAE relative to validation MAE
+    'min_samples': 30,     # Observations needed before drift is judged
+    'residual_window': 90  # Number of recent residuals kept
+}
+
+# Floor for bin proportions so empty bins don't make the PSI infinite
+PSI_EPSILON = 1e-4
+
+# Upper bound on waiting for MongoDB when creating indexes
+INDEX_TIMEOUT_SECONDS = 5
+
+
+def build_training_snapshot(feature_frame, residuals, features=None, bins=10):
+    """
+    Summarize training features and validation residuals.
+
+    Args:
+        feature_frame (pandas.DataFrame): Unscaled training features
+        residuals (numpy.ndarray): Validation residuals (actual - predicted)
+        features (list, optional): Features to summarize
+        bins (int): Number of quantile bins per feature
+
+    Returns:
+        dict: Snapshot stored with the model artifact
+    """
+    features = features or DRIFT_FEATURES
+    residuals = np.asarray(residuals, dtype=float)
+    snapshot = {
+        'features': {},
+        'residual_mae': float(np.mean(np.abs(residuals))) if len(residuals) else 0.0,
+        'residual_std': float(np.std(residuals)) if len(residuals) else 0.0,
+        'n_samples': int(len(feature_frame)),
+        'trained_at': datetime.now().isoformat()
+    }
+
+    for feature in features:
+        if feature not in feature_frame.columns:
+            continue
+        values = feature_frame[feature].to_numpy(dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            continue
+        # Interior quantile edges; the outer bins are open-ended
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        snapshot['features'][feature] = {
+            'mean': float(values.mean()),
+            'std': float(values.std()),
+            'edges': edges.tolist(),
+            'proportions': (counts / counts.sum()).tolist()
+        }
+
+    return snapshot
+
+
+def population_stability_index(expected, actual):
+    """Compute the PSI between two arrays of bin proportions"""
+    expected = np.maximum(np.asarray(expected, dtype=float), PSI_EPSILON)
+    actual = np.maximum(np.asarray(actual, dtype=float), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class DriftMonitor:
+    """
+    Incremental drift state for one business unit.
+
+    Updates only add new observations into fixed-size histograms and a
+    residual ring buffer, so monitoring costs O(new rows) regardless of how
+    much history a unit has.
+    """
+
+    def __init__(self, business_unit_id, snapshot, thresholds=None, state=None):
+        """
+        Initialize the monitor.
+
+        Args:
+            business_unit_id (str): ID of the business unit
+            snapshot (dict): Training snapshot from the model artifact
+            thresholds (dict, optional): Overrides for DEFAULT_THRESHOLDS
+            state (dict, optional): Previously saved state (see to_dict)
+        """
+        self.business_unit_id = business_unit_id
+        self.snapshot = snapshot
+        self.thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+
+        state = state if state and state.get('trained_at') == snapshot.get('trained_at') else {}
+        self.counts = {
+            feature: np.asarray(state.get('counts', {}).get(feature, np.zeros(len(stats['proportions']))), dtype=float)
+            for feature, stats in snapshot['features'].items()
+        }
+        self.residuals = list(state.get('residuals', []))
+        self.n_observations = state.get('n_observations', 0)
+        # Latest observation date already counted, so updates never double count
+        self.last_date = state.get('last_date')
+
+    def update(self, feature_frame, actual=None, predicted=None):
+        """
+        Add new observations.
+
+        Args:
+            feature_frame (pandas.DataFrame): Unscaled features of new rows
+            actual (array-like, optional): Actual meal counts
+            predicted (array-like, optional): Forecast meal counts
+        """
+        for feature, stats in self.snapshot['features'].items():
+            if feature not in feature_frame.columns:
+                continue
+            values = feature_frame[feature].to_numpy(dtype=float)
+            values = values[~np.isnan(values)]
+            bins = np.searchsorted(np.asarray(stats['edges']), values, side='right')
+            self.counts[feature] += np.bincount(bins, minlength=len(self.counts[feature]))
+
+        if actual is not None and predicted is not None:
+            residuals = np.asarray(actual, dtype=float) - np.asarray(predicted, dtype=float)
+            window = self.thresholds['residual_window']
+            self.residuals = (self.residuals + residuals.tolist())[-window:]
+
+        self.n_observations += len(feature_frame)
+        if 'date' in feature_frame.columns and len(feature_frame):
+            latest = pd.to_datetime(feature_frame['date']).max().isoformat()
+            self.last_date = max(self.last_date, latest) if self.last_date else latest
+
+    def check(self):
+        """
+        Compare the recent window against the training snapshot.
+
+        Returns:
+            dict: Per-feature PSI, rolling MAE and the list of crossed
+                thresholds ('reasons'); retraining is needed if non-empty
+        """
+        result = {'psi': {}, 'rolling_mae': None, 'reasons': [], 'n_observations': self.n_observations}
+        if self.n_observations < self.thresholds['min_samples']:
+            return result
+
+        for feature, stats in self.snapshot['features'].items():
+            counts = self.counts[feature]
+            if counts.sum() == 0:
+                continue
+            psi = population_stability_index(stats['proportions'], counts / counts.sum())
+            result['psi'][feature] = psi
+            if psi > self.thresholds['psi']:
+                result['reasons'].append(f"feature drift: {feature} PSI {psi:.3f} > {self.thresholds['psi']}")
+
+        if len(self.residuals) >= self.thresholds['min_samples']:
+            rolling_mae = float(np.mean(np.abs(self.residuals)))
+            result['rolling_mae'] = rolling_mae
+            limit = self.snapshot['residual_mae'] * self.thresholds['mae_ratio']
+            if limit > 0 and rolling_mae > limit:
+                result['reasons'].append(f"error drift: rolling MAE {rolling_mae:.2f} > {limit:.2f}")
+
+        return result
+
+    def to_dict(self):
+        """Get JSON-serializable monitor state"""
+        return {
+            'business_unit_id': self.business_unit_id,
+            'trained_at': self.snapshot.get('trained_at'),
+            'residual_mae': self.snapshot.get('residual_mae'),
+            'counts': {feature: counts.tolist() for feature, counts in self.counts.items()},
+            'residuals': self.residuals,
+            'n_observations': self.n_observations,
+            'last_date': self.last_date
+        }
+
+
+def trigger_document(business_unit_id, check_result):
+    """
+    Build the retrain trigger document for a drift check.
+
+    Args:
+        business_unit_id (str): ID of the business unit
+        check_result (dict): Result of DriftMonitor.check
+
+    Returns:
+        dict: Document for the retrain trigger collection
+    """
+    return {
+        'businessUnitId': business_unit_id,
+        'reasons': check_result['reasons'],
+        'psi': check_result['psi'],
+        'rollingMae': check_result['rolling_mae'],
+        'nObservations': check_result['n_observations'],
+        'createdAt': datetime.now()
+    }
+
+
+class DriftStore:
+    """
+    Persistence for monitor state and retrain triggers.
+
+    Monitor state is kept as small JSON files next to the models; every
+    triggered retrain is recorded with its reasons in MongoDB when available.
+    The trigger index is created with the first recorded trigger.
+    """
+
+    def __init__(self, state_dir, db=None, collection_name='retraintriggers'):
+        """
+        Initialize the store.
+
+        Args:
+            state_dir (str): Directory for monitor state files
+            db (pymongo.database.Database, optional): Database for triggers
+            collection_name (str): Name of the trigger collection
+        """
+        self.state_dir = state_dir
+        self.collection = db[collection_name] if db is not None else None
+        self._indexed = False
+        os.makedirs(state_dir, exist_ok=True)
+
+    def ensure_indexes(self):
+        """Create the trigger index once (retried on the next call if MongoDB is unavailable)"""
+        if self.collection is None or self._indexed:
+            return
+        try:
+            with pymongo.timeout(INDEX_TIMEOUT_SECONDS):
+                self.collection.create_index([('businessUnitId', 1), ('createdAt', -1)])
+            self._indexed = True
+        except Exception as e:
+            logger.warning("Failed to create retrain trigger indexes: %s", e)
+
+    def _state_path(self, business_unit_id):
+        """Get path to the state file for a business unit"""
+        return os.path.join(self.state_dir, f"drift_{business_unit_id}.json")
+
+    def load_monitor(self, business_unit_id, snapshot, thresholds=None):
+        """
+        Load the monitor for a business unit.
+
+        State saved against an older training snapshot is discarded.
+
+        Args:
+            business_unit_id (str): ID of the business unit
+            snapshot (dict): Training snapshot of the current model
+            thresholds (dict, optional): Overrides for DEFAULT_THRESHOLDS
+
+        Returns:
+            DriftMonitor: Monitor for the unit
+        """
+        state = None
+        path = self._state_path(business_unit_id)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+        return DriftMonitor(business_unit_id, snapshot, thresholds, state)
+
+    def save_monitor(self, monitor):
+        """Persist monitor state"""
+        with open(self._state_path(monitor.business_unit_id), 'w') as f:
+            json.dump(monitor.to_dict(), f)
+
+    def reset(self, business_unit_id):
+        """Drop monitor state, e.g. after retraining"""
+        path = self._state_path(business_unit_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def record_trigger(self, business_unit_id, check_result):
+        """
+        Record a retrain trigger with its reasons.
+
+        Args:
+            business_unit_id (str): ID of the business unit
+            check_result (dict): Result of DriftMonitor.check
+        """
+        logger.info("Retrain triggered for business unit %s: %s", business_unit_id,
+                    '; '.join(check_result['reasons']), extra={'business_unit_id': business_unit_id})
+        if self.collection is not None:
+            self.ensure_indexes()
+            self.collection.insert_one(trigger_document(business_unit_id, check_result))
+
+    def get_triggers(self, business_unit_id, limit=50):
+        """Get the most recent retrain triggers for a business unit"""
+        if self.collection is None:
+            return []
+        cursor = self.collection.find({'businessUnitId': business_unit_id}, {'_id': 0}) \
+            .sort('createdAt', -1).limit(limit)
+        return [{**trigger, 'createdAt': trigger['createdAt'].isoformat()} for trigger in cursor]
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Factor Calendar for Kanteeno Forecasting
+
+This module persists holidays and special events (external factors) per
+business unit and applies them to forecast frames as feature columns.
+"""
+
+import threading
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pymongo
+from pymongo import ASCENDING
+
+logger = logging.getLogger("factor_calendar")
+
+FACTOR_TYPES = ('holiday', 'special_event')
+
+# Upper bound on waiting for MongoDB when creating indexes
+INDEX_TIMEOUT_SECONDS = 5
+
+
+def parse_date(value):
+    """Parse an ISO date string (or pass through a datetime)"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+
+class FactorIntervalIndex:
+    """
+    In-memory interval index over the factors of one business unit.
+
+    Factors are stored as arrays sorted by start day, so a date-range lookup
+    is a binary search followed by a vectorized overlap mask.
+    """
+
+    def __init__(self, factors):
+        """
+        Build the index.
+
+        Args:
+            factors (list): Factor documents with date, endDate, impact and type
+        """
+        factors = sorted(factors, key=lambda factor: factor['date'])
+        self.factors = factors
+        self.starts = np.array([np.datetime64(factor['date'], 'D') for factor in factors],
+                               dtype='datetime64[D]')
+        self.ends = np.array([np.datetime64(factor.get('endDate') or factor['date'], 'D') for factor in factors],
+                             dtype='datetime64[D]')
+        self.impacts = np.array([factor.get('impact', 0) for factor in factors], dtype=float)
+        self.is_holiday = np.array([factor.get('type') == 'holiday' for factor in factors], dtype=bool)
+        # Longest factor bounds how far back an overlapping start can be
+        self.max_span = (self.ends - self.starts).max() if factors else np.timedelta64(0, 'D')
+
+    def overlapping(self, start, end):
+        """
+        Get positions of factors overlapping a date range.
+
+        Args:
+            start (numpy.datetime64): First day of the range
+            end (numpy.datetime64): Last day of the range
+
+        Returns:
+            numpy.ndarray: Positions into the index arrays
+        """
+        lo = np.searchsorted(self.starts, start - self.max_span, side='left')
+        hi = np.searchsorted(self.starts, end, side='right')
+        candidates = np.arange(lo, hi)
+        return candidates[self.ends[candidates] >= start]
+
+    def in_range(self, start_date=None, end_date=None):
+        """
+        Get factors overlapping an optionally open-ended date range.
+
+        Args:
+            start_date (datetime, optional): First day of the range
+            end_date (datetime, optional): Last day of the range
+
+        Returns:
+            list: JSON-serializable factor dicts
+        """
+        if start_date is None and end_date is None:
+            positions = np.arange(len(self.factors))
+        else:
+            start = np.datetime64(start_date, 'D') if start_date else np.datetime64('1970-01-01')
+            end = np.datetime64(end_date, 'D') if end_date else np.datetime64('2999-12-31')
+            positions = self.overlapping(start, end)
+
+        return [format_factor(self.factors[i]) for i in positions]
+
+    def features(self, dates):
+        """
+        Compute factor feature columns for an array of dates.
+
+        Args:
+            dates (numpy.ndarray): Dates (datetime64[D])
+
+        Returns:
+            tuple: is_holiday, is_special_event (bool arrays) and impact (float array)
+        """
+        n = len(dates)
+        if n == 0 or not self.factors:
+            return np.zeros(n, dtype=bool), np.zeros(n, dtype=bool), np.zeros(n)
+
+        first, last = dates.min(), dates.max()
+        positions = self.overlapping(first, last)
+        span = int((last - first).astype(int)) + 2
+
+        # Difference arrays over day offsets, accumulated with one cumsum each
+        starts = np.clip((self.starts[positions] - first).astype(int), 0, span - 1)
+        ends = np.clip((self.ends[positions] - first).astype(int) + 1, 0, span - 1)
+        holidays = self.is_holiday[positions]
+
+        holiday_count = np.zeros(span)
+        event_count = np.zeros(span)
+        impact = np.zeros(span)
+        np.add.at(holiday_count, starts[holidays], 1)
+        np.add.at(holiday_count, ends[holidays], -1)
+        np.add.at(event_count, starts[~holidays], 1)
+        np.add.at(event_count, ends[~holidays], -1)
+        np.add.at(impact, starts, self.impacts[positions])
+        np.add.at(impact, ends, -self.impacts[positions])
+
+        offsets = (dates - first).astype(int)
+        return (
+            np.cumsum(holiday_count)[offsets] > 0,
+            np.cumsum(event_count)[offsets] > 0,
+            np.cumsum(impact)[offsets]
+        )
+
+
+def factor_document(business_unit_id, factor):
+    """
+    Validate a factor and build its database document.
+
+    Args:
+        business_unit_id (str): ID of the business unit
+        factor (dict): name, date, impact, description and optionally
+            endDate and type ('holiday' or 'special_event')
+
+    Returns:
+        dict: Document for the factor collection
+    """
+    factor_type = factor.get('type', 'special_event')
+    if factor_type not in FACTOR_TYPES:
+        raise ValueError(f"type must be one of {', '.join(FACTOR_TYPES)}")
+
+    start = parse_date(factor['date'])
+    end = parse_date(factor['endDate']) if factor.get('endDate') else start
+    if end < start:
+        raise ValueError("endDate must not be before date")
+
+    return {
+        'businessUnitId': business_unit_id,
+        'name': factor['name'],
+        'date': start,
+        'endDate': end,
+        'impact': float(factor['impact']),
+        'description': factor.get('description', ''),
+        'type': factor_type,
+        'createdAt': datetime.now()
+    }
+
+
+def format_factor(factor):
+    """Convert a factor document to its JSON-serializable API form"""
+    return {
+        'id': str(factor.get('_id')),
+        'name': factor['name'],
+        'date': factor['date'].date().isoformat(),
+        'endDate': (factor.get('endDate') or factor['date']).date().isoformat(),
+        'impact': factor['impact'],
+        'description': factor.get('description', ''),
+        'type': factor.get('type', 'special_event')
+    }
+
+
+def apply_factor_index(index, df):
+    """
+    Add factor feature columns to a forecast frame.
+
+    Args:
+        index (FactorIntervalIndex): Factors of the frame's business unit
+        df (pandas.DataFrame): Frame with a 'date' column
+
+    Returns:
+        pandas.DataFrame: Frame with is_holiday, is_special_event and
+            factor_impact columns set
+    """
+    dates = pd.to_datetime(df['date'])
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    dates = dates.to_numpy().astype('datetime64[D]')
+    is_holiday, is_special_event, impact = index.features(dates)
+
+    df['is_holiday'] = is_holiday
+    df['is_special_event'] = is_special_event
+    df['factor_impact'] = impact
+    return df
+
+
+class FactorCalendar:
+    """
+    Persisted calendar of external factors per business unit.
+
+    Factors live in an indexed MongoDB collection; each business unit's
+    factors are cached as a FactorIntervalIndex until a factor is added.
+    The indexes are created on the first write rather than on construction,
+    so importing the API never waits for MongoDB.
+    """
+
+    def __init__(self, db, collection_name='forecastfactors'):
+        """
+        Initialize the calendar.
+
+        Args:
+            db (pymongo.database.Database): Database handle
+            collection_name (str): Name of the factor collection
+        """
+        self.collection = db[collection_name]
+        self._indexed = False
+        self._cache = {}
+        # Invalidation counters (per unit and for all units), so an index
+        # loaded while a factor was added is not cached
+        self._generations = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        """Create the factor indexes once (retried on the next call if MongoDB is unavailable)"""
+        if self._indexed:
+            return
+        try:
+            with pymongo.timeout(INDEX_TIMEOUT_SECONDS):
+                self.collection.create_index([('businessUnitId', ASCENDING), ('date', ASCENDING)])
+                self.collection.create_index([('businessUnitId', ASCENDING), ('endDate', ASCENDING)])
+            self._indexed = True
+        except Exception as e:
+            logger.warning("Failed to create factor indexes: %s", e)
+
+    def _index(self, business_unit_id):
+        """Get the cached interval index for a business unit"""
+        with self._lock:
+            index = self._cache.get(business_unit_id)
+            generation = (self._generation, self._generations.get(business_unit_id, 0))
+        if index is None:
+            factors = list(self.collection.find({'businessUnitId': business_unit_id}))
+            index = FactorIntervalIndex(factors)
+            with self._lock:
+                if generation == (self._generation, self._generations.get(business_unit_id, 0)):
+                    self._cache[business_unit_id] = index
+            logger.info("Loaded %d factors for business unit %s", len(factors), business_unit_id,
+                        extra={'business_unit_id': business_unit_id})
+        return index
+
+    def invalidate(self, business_unit_id=None):
+        """
+        Drop cached factors.
+
+        Args:
+            business_unit_id (str, optional): Unit to invalidate; all if omitted
+        """
+        with self._lock:
+            if business_unit_id is None:
+                self._cache.clear()
+                self._generation += 1
+            else:
+                self._cache.pop(business_unit_id, None)
+                self._generations[business_unit_id] = self._generations.get(business_unit_id, 0) + 1
+
+    def add_factor(self, business_unit_id, factor):
+        """
+        Persist a factor and invalidate the unit's cached index.
+
+        Args:
+            business_unit_id (str): ID of the business unit
+            factor (dict): name, date, impact, description and optionally
+                endDate and type ('holiday' or 'special_event')
+
+        Returns:
+            str: ID of the inserted factor
+        """
+        self.ensure_indexes()
+        document = factor_document(business_unit_id, factor)
+        result = self.collection.insert_one(document)
+        self.invalidate(business_unit_id)
+
+        return str(result.inserted_id)
+
+    def get_factors(self, business_unit_id, start_date=None, end_date=None):
+        """
+        Get factors overlapping a date range.
+
+        Args:
+            business_unit_id (str): ID of the business unit
+            start_date (datetime, optional): First day of the range
+            end_date (datetime, optional): Last day of the range
+
+        Returns:
+            list: JSON-serializable factor dicts
+        """
+        return self._index(business_unit_id).in_range(start_date, end_date)
+
+    def apply(self, business_unit_id, df):
+        """
+        Add factor feature columns to a forecast frame.
+
+        Args:
+            business_unit_id (str): ID of the business unit
+            df (pandas.DataFrame): Frame with a 'date' column
+
+        Returns:
+            pandas.DataFrame: Frame with is_holiday, is_special_event and
+                factor_impact columns set
+        """
+        return apply_factor_index(self._index(business_unit_id), df)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Forecast Explainer for Kanteeno
+
+This module breaks individual random forest predictions down into per-feature
+contributions by decomposing each decision path: every split moves the
+prediction from the parent node's value to the child's, and that change is
+credited to the split feature.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class PathContributionExplainer:
+    """
+    Per-prediction feature contributions for a fitted forest regressor.
+
+    The contribution vector of every node (summed along its path from the
+    root) is precomputed once, so explaining a batch of rows only needs the
+    leaf indices from forest.apply and one gather over all trees.
+    """
+
+    def __init__(self, forest, features):
+        """
+        Precompute path contributions for every node of every tree.
+
+        Args:
+            forest (sklearn.ensemble.RandomForestRegressor): Fitted forest
+            features (list): Feature names in model input order
+        """
+        self.features = list(features)
+        n_features = len(self.features)
+        node_contributions = []
+        offsets = []
+        biases = []
+        total_nodes = 0
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            values = tree.value[:, 0, 0]
+            contributions = np.zeros((tree.node_count, n_features))
+
+            # Walk the tree level by level; each child inherits its parent's
+            # path sum plus the value change of the parent's split
+            frontier = np.array([0])
+            while len(frontier):
+                frontier = frontier[tree.children_left[frontier] >= 0]
+                for children in (tree.children_left[frontier], tree.children_right[frontier]):
+                    contributions[children] = contributions[frontier]
+                    contributions[children, tree.feature[frontier]] += values[children] - values[frontier]
+                frontier = np.concatenate([tree.children_left[frontier], tree.children_right[frontier]])
+
+            node_contributions.append(contributions)
+            offsets.append(total_nodes)
+            biases.append(values[0])
+            total_nodes += tree.node_count
+
+        self.node_contributions = np.vstack(node_contributions)
+        self.offsets = np.array(offsets)
+        self.bias = float(np.mean(biases))
+        self.forest = forest
+
+    def explain(self, X):
+        """
+        Compute per-feature contributions for each row.
+
+        Args:
+            X (numpy.ndarray): Model input rows (already preprocessed)
+
+        Returns:
+            tuple: Bias (float) and contributions (rows × features array);
+                bias plus the row sum equals the forest prediction
+        """
+        leaves = self.forest.apply(X)
+        return self.bias, self.node_contributions[leaves + self.offsets].mean(axis=1)
+
+    def explain_frame(self, X):
+        """
+        Compute per-feature contributions as a DataFrame.
+
+        Args:
+            X (numpy.ndarray): Model input rows (already preprocessed)
+
+        Returns:
+            pandas.DataFrame: One column per feature plus a 'bias' column
+        """
+        bias, contributions = self.explain(X)
+        frame = pd.DataFrame(contributions, columns=self.features)
+        frame['bias'] = bias
+        return frame
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Forecast Materializer for Kanteeno
+
+This script precomputes rolling forecasts for every business unit (run it
+after the nightly data sync) and stores them in a read-optimized collection,
+one document per unit, day and meal type. The forecast API serves requests
+from this collection when the stored model version matches the current model
+and the forecast inputs (factors and weather) hash to the stored version.
+
+Usage:
+python forecast_materializer.py [--horizon 14] [--workers 4]
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from dotenv import load_dotenv
+from log_config import configure_logging
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger("forecast_materializer")
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/kanteeno')
+MODEL_DIR = os.getenv('MODEL_DIR', './models')
+
+COLLECTION_NAME = 'materializedforecasts'
+
+DEFAULT_HORIZON_DAYS = 14
+
+
+def ensure_indexes(db):
+    """Create the lookup index of the materialized forecast collection"""
+    db[COLLECTION_NAME].create_index(
+        [('businessUnitId', ASCENDING), ('date', ASCENDING), ('mealType', ASCENDING)],
+        unique=True
+    )
+
+
+def input_versions(forecast_data):
+    """
+    Hash the inputs of every row of a prepared forecast frame.
+
+    Factors added through the API and new weather change these inputs
+    without changing the model version, so a materialized forecast is only
+    served while the hash of its inputs is unchanged.
+
+    Args:
+        forecast_data (pandas.DataFrame): Frame from prepare_forecast_data
+
+    Returns:
+        dict: (YYYY-MM-DD, meal type) to input hash
+    """
+    inputs = forecast_data.drop(columns=['date', 'meal_type'])
+    inputs = inputs[sorted(inputs.columns)].astype(float)
+    hashes = pd.util.hash_pandas_object(inputs, index=False)
+    days = pd.to_datetime(forecast_data['date']).dt.strftime('%Y-%m-%d')
+    return {
+        (day, meal_type): format(value, '016x')
+        for day, meal_type, value in zip(days, forecast_data['meal_type'], hashes)
+    }
+
+
+def forecast_unit(business_unit_id, start_date, end_date):
+    """
+    Compute the rolling forecast of one business unit.
+
+    Runs in a worker process and reuses the API's feature preparation, so
+    materialized forecasts match live inference.
+
+    Args:
+        business_unit_id (str): ID of the business unit
+        start_date (datetime): First forecast day
+        end_date (datetime): Last forecast day
+
+    Returns:
+        dict: business_unit_id, model_version, forecast records and the
+            input_versions of the records
+    """
+    from api import get_model, prepare_forecast_data
+
+    model = get_model(business_unit_id)
+    if model is None:
+        return {'business_unit_id': business_unit_id, 'model_version': None, 'records': [], 'input_versions': {}}
+
+    forecast_data = prepare_forecast_data(business_unit_id, start_date, end_date)
+    versions = input_versions(forecast_data)
+    forecast = model.predict(forecast_data)
+    return {
+        'business_unit_id': business_unit_id,
+        'model_version': model.model_version,
+        'records': forecast.to_dict(orient='records'),
+        'input_versions': versions
+    }
+
+
+def write_forecasts(db, result, materialized_at):
+    """
+    Upsert one unit's forecast records with a single bulk write.
+
+    Args:
+        db (pymongo.database.Database): Database handle
+        result (dict): Result of forecast_unit
+        materialized_at (datetime): Timestamp of this materialization run
+
+    Returns:
+        int: Number of records written
+    """
+    operations = [
+        UpdateOne(
+            {
+                'businessUnitId': result['business_unit_id'],
+                'date': pd.Timestamp(record['date']).to_pydatetime().replace(tzinfo=None),
+                'mealType': record['meal_type']
+            },
+            {'$set': {
+                'predictedMeals': int(record['predicted_meals']),
+                'lowerBound': int(record['lower_bound']),
+                'upperBound': int(record['upper_bound']),
+                'confidence': float(record['confidence']),
+                'modelVersion': result['model_version'],
+                'inputsVersion': result['input_versions'].get(
+                    (pd.Timestamp(record['date']).strftime('%Y-%m-%d'), record['meal_type'])),
+                'materializedAt': materialized_at
+            }},
+            upsert=True
+        )
+        for record in result['records']
+    ]
+    if operations:
+        db[COLLECTION_NAME].bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def materialized_query(business_unit_id, start_date, end_date, model_version, meal_types):
+    """
+    Build the lookup of materialized forecasts covering a request.
+
+    Args:
+        business_unit_id (str): ID of the business unit
+        start_date (datetime): First forecast day
+        end_date (datetime): Last forecast day
+        model_version (str): Version of the unit's current model
+        meal_types (list): Meal types the request covers
+
+    Returns:
+        tuple: MongoDB filter and the number of documents a full cover has
+    """
+    days = pd.date_range(start_date.date(), end_date.date())
+    query = {
+        'businessUnitId': business_unit_id,
+        'date': {'$gte': days[0].to_pydatetime(), '$lte': days[-1].to_pydatetime()},
+        'mealType': {'$in': meal_types},
+        'modelVersion': model_version
+    }
+    return query, len(days) * len(meal_types)
+
+
+def forecast_records(documents, expected, meal_types, versions):
+    """
+    Convert materialized documents to forecast records in the API format.
+
+    Args:
+        documents (list): Documents matched by materialized_query
+        expected (int): Number of documents a full cover has
+        meal_types (list): Meal types the request covers, in output order
+        versions (dict): Current input_versions of the request
+
+    Returns:
+        list: Forecast records, or None if the up-to-date documents do not
+            fully cover the request
+    """
+    documents = [
+        document for document in documents
+        if document.get('inputsVersion') == versions.get((document['date'].strftime('%Y-%m-%d'), document['mealType']))
+    ]
+    if len(documents) != expected:
+        return None
+
+    order = {meal_type: i for i, meal_type in enumerate(meal_types)}
+    documents = sorted(documents, key=lambda document: (document['date'], order[document['mealType']]))
+    return [
+        {
+            'date': document['date'],
+            'meal_type': document['mealType'],
+            'predicted_meals': document['predictedMeals'],
+            'lower_bound': document['lowerBound'],
+            'upper_bound': document['upperBound'],
+            'confidence': document['confidence']
+        }
+        for document in documents
+    ]
+
+
+def read_forecasts(db, business_unit_id, start_date, end_date, model_version, meal_types, versions):
+    """
+    Read materialized forecasts if they fully cover a request.
+
+    Args:
+        db (pymongo.database.Database): Database handle
+        business_unit_id (str): ID of the business unit
+        start_date (datetime): First forecast day
+        end_date (datetime): Last forecast day
+        model_version (str): Version of the unit's current model
+        meal_types (list): Meal types the request covers
+        versions (dict): input_versions of the request's current forecast inputs
+
+    Returns:
+        list: Forecast records in the API format, or None if any day or meal
+            type is missing or was produced by another model version or
+            from other factors or weather
+    """
+    query, expected = materialized_query(business_unit_id, start_date, end_date, model_version, meal_types)
+    documents = list(db[COLLECTION_NAME].find(query, {'_id': 0}))
+    return forecast_records(documents, expected, meal_types, versions)
+
+
+def materialize(db, business_unit_ids, horizon_days=DEFAULT_HORIZON_DAYS, workers=None):
+    """
+    Precompute forecasts for many business units in parallel.
+
+    Args:
+        db (pymongo.database.Database): Database handle
+        business_unit_ids (list): Units to materialize
+        horizon_days (int): Number of days from today to forecast
+        workers (int, optional): Worker processes (defaults to CPU count)
+
+    Returns:
+        dict: Counts of units materialized, skipped and failed
+    """
+    ensure_indexes(db)
+    start_date = datetime.combine(datetime.now().date(), datetime.min.time())
+    end_date = start_date + timedelta(days=horizon_days - 1)
+    materialized_at = datetime.now()
+    summary = {'materialized': 0, 'skipped': 0, 'failed': 0, 'records': 0}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(forecast_unit, business_unit_id, start_date, end_date): business_unit_id
+            for business_unit_id in business_unit_ids
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error("Failed to materialize business unit %s: %s", futures[future], e,
+                             extra={'business_unit_id': futures[future]})
+                summary['failed'] += 1
+                continue
+            if result['model_version'] is None:
+                summary['skipped'] += 1
+                continue
+            summary['records'] += write_forecasts(db, result, materialized_at)
+            summary['materialized'] += 1
+
+    # Days that have rolled out of the horizon are no longer served
+    db[COLLECTION_NAME].delete_many({'date': {'$lt': start_date}})
+
+    logger.info("Materialized %d forecast records for %d business units (%d without model, %d failed)",
+                summary['records'], summary['materialized'], summary['skipped'], summary['failed'])
+    return summary
+
+
+def main():
+    """
+    Main function for command-line usage.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Materialize rolling forecasts')
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON_DAYS, help='Days to forecast')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--business-unit', action='append', help='Business unit ID (default: all units with a model)')
+
+    args = parser.parse_args()
+
+    configure_logging()
+
+    db = MongoClient(MONGO_URI).kanteeno
+
+    business_unit_ids = args.business_unit or sorted(
+        name[len('model_'):-len('.joblib')]
+        for name in os.listdir(MODEL_DIR)
+        if name.startswith('model_') and name.endswith('.joblib')
+    )
+
+    summary = materialize(db, business_unit_ids, args.horizon, args.workers)
+    print(f"Materialization summary: {summary}")
+
+
+if __name__ == "__main__":
+    main()
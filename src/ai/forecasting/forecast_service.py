@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Forecast Service Core for Kanteeno
+
+This module holds the settings and the database-free parts of the forecast
+API: model files and caches, the cold-start similarity index, arrival
+profiles, feature frames, training and the drift monitor update. The Flask
+API (api.py) combines them with synchronous pymongo access; the async API
+loads data through Motor in the event loop and runs these functions in its
+worker processes on plain frames.
+
+Importing this module never connects to MongoDB.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from dotenv import load_dotenv
+from meal_forecast_model import MealForecastModel, MIN_FIT_ROWS
+from weather_provider import LocalWeatherProvider, CachedWeatherProvider, merge_weather
+from drift_monitor import DriftStore
+from intraday_profiles import ArrivalProfiles
+from unit_similarity import UnitSimilarityIndex, demand_profile, blend_forecasts
+from log_config import log_stage
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger("forecast_service")
+
+# Environment variables
+MODEL_DIR = os.getenv('MODEL_DIR', './models')
+WEATHER_DATA_FILE = os.getenv('WEATHER_DATA_FILE', './data/weather.csv')
+WEATHER_CACHE_DIR = os.getenv('WEATHER_CACHE_DIR', './cache/weather')
+UNIT_INDEX_PATH = os.getenv('UNIT_INDEX_PATH', os.path.join(MODEL_DIR, 'unit_index.joblib'))
+ARRIVAL_PROFILES_PATH = os.getenv('ARRIVAL_PROFILES_PATH', os.path.join(MODEL_DIR, 'arrival_profiles.joblib'))
+
+# Units with fewer historical rows get a cold-start forecast from similar units
+# instead of an own model (never fewer than a model can be fitted on)
+MIN_TRAINING_ROWS = max(int(os.getenv('MIN_TRAINING_ROWS', 60)), MIN_FIT_ROWS)
+COLD_START_NEIGHBORS = int(os.getenv('COLD_START_NEIGHBORS', 3))
+
+# Allowed relative MAE increase when compressing trained forests, e.g. 0.02
+# (unset by default: compression holds out part of the training rows, so
+# forests are only compressed when this is set)
+FOREST_MAE_TOLERANCE = os.getenv('FOREST_MAE_TOLERANCE')
+FOREST_MAE_TOLERANCE = float(FOREST_MAE_TOLERANCE) if FOREST_MAE_TOLERANCE else None
+
+# Meal types forecast for every day
+FORECAST_MEAL_TYPES = ['breakfast', 'lunch', 'dinner']
+
+# Accuracy reported until actual-vs-forecast tracking is stored in the database
+PLACEHOLDER_ACCURACY = {
+    'accuracy': 92.5,
+    'mae': 3.2,
+    'rmse': 4.1,
+    'by_day': {
+        'monday': 94.2,
+        'tuesday': 93.1,
+        'wednesday': 91.8,
+        'thursday': 92.5,
+        'friday': 90.9,
+        'saturday': 95.0,
+        'sunday': 94.8
+    },
+    'by_meal_type': {
+        'breakfast': 93.5,
+        'lunch': 91.2,
+        'dinner': 94.1
+    }
+}
+
+# Ensure model directory exists
+os.makedirs(MODEL_DIR, exist_ok=True)
+
+# Weather features, cached per location so units in one region share lookups
+weather_provider = CachedWeatherProvider(LocalWeatherProvider(WEATHER_DATA_FILE), WEATHER_CACHE_DIR)
+
+# Drift monitor state files (retrain triggers are recorded by the APIs)
+monitor_store = DriftStore(MODEL_DIR)
+
+# Loaded models by business unit, reloaded when the model file changes
+loaded_models = {}
+
+# Nearest-neighbor index over trained units, for cold-start forecasts
+# (modification time, index), reloaded when the retrain scheduler rebuilds it
+unit_index = None
+
+# Intraday arrival profiles (modification time, profiles), reloaded when refitted
+arrival_profiles = None
+
+
+def get_model_path(business_unit_id):
+    """Get path to model file for a business unit"""
+    return os.path.join(MODEL_DIR, f"model_{business_unit_id}.joblib")
+
+
+def get_model(business_unit_id):
+    """Get the current model for a business unit (None if not trained)"""
+    model_path = get_model_path(business_unit_id)
+    if not os.path.exists(model_path):
+        return None
+
+    modified = os.path.getmtime(model_path)
+    cached = loaded_models.get(business_unit_id)
+    if cached is None or cached[0] != modified:
+        cached = (modified, MealForecastModel(business_unit_id, model_path))
+        loaded_models[business_unit_id] = cached
+        logger.info("Loaded existing model for business unit %s", business_unit_id,
+                    extra={'business_unit_id': business_unit_id})
+    return cached[1]
+
+
+def get_arrival_profiles():
+    """Get the intraday arrival profiles (default service peaks if none are fitted)"""
+    global arrival_profiles
+
+    modified = os.path.getmtime(ARRIVAL_PROFILES_PATH) if os.path.exists(ARRIVAL_PROFILES_PATH) else None
+    if arrival_profiles is None or arrival_profiles[0] != modified:
+        profiles = ArrivalProfiles.load(ARRIVAL_PROFILES_PATH) if modified else ArrivalProfiles.default()
+        arrival_profiles = (modified, profiles)
+        logger.info("Loaded arrival profiles for %d business units", len(profiles.unit_ids))
+    return arrival_profiles[1]
+
+
+def get_trained_unit_ids():
+    """Get the IDs of all business units with a saved model"""
+    return sorted(
+        name[len('model_'):-len('.joblib')]
+        for name in os.listdir(MODEL_DIR)
+        if name.startswith('model_') and name.endswith('.joblib')
+    )
+
+
+def get_unit_index():
+    """Get the saved similarity index (None until one is built), reloaded when it was rebuilt"""
+    global unit_index
+
+    if not os.path.exists(UNIT_INDEX_PATH):
+        return None
+    modified = os.path.getmtime(UNIT_INDEX_PATH)
+    if unit_index is None or unit_index[0] != modified:
+        unit_index = (modified, UnitSimilarityIndex.load(UNIT_INDEX_PATH))
+        logger.info("Loaded unit similarity index with %d business units", len(unit_index[1]))
+    return unit_index[1]
+
+
+def neighbor_forecast(business_unit_id, business_unit, forecast_data, historical_data):
+    """
+    Forecast a unit without its own model from its nearest trained units.
+
+    Args:
+        business_unit_id (str): ID of the business unit
+        business_unit (dict): Business unit document (may be None)
+        forecast_data (pandas.DataFrame): Prepared forecast frame
+        historical_data (pandas.DataFrame): The unit's (short) history
+
+    Returns:
+        tuple: Blended forecast DataFrame (None without neighbors) and the
+            neighbors used
+    """
+    index = get_unit_index()
+    if index is None:
+        logger.warning("No unit similarity index for cold-start forecasts, run the retrain scheduler "
+                       "or unit_similarity.py --rebuild", extra={'business_unit_id': business_unit_id})
+        return None, []
+
+    neighbors = index.query(business_unit, k=COLD_START_NEIGHBORS,
+                            profile=demand_profile(historical_data), exclude=business_unit_id)
+    if not neighbors:
+        return None, []
+
+    neighbor_forecasts = [
+        (neighbor, get_model(neighbor['business_unit_id']).predict(forecast_data.copy()))
+        for neighbor in neighbors
+    ]
+    return blend_forecasts(neighbor_forecasts), neighbors
+
+
+def historical_data_pipeline(business_unit_id, start_date=None, end_date=None):
+    """Build the aggregation pipeline for historical meal data"""
+    # Default to last 90 days if dates not provided
+    if not end_date:
+        end_date = datetime.now()
+    if not start_date:
+        start_date = end_date - timedelta(days=90)
+
+    # Query MongoDB for historical data
+    return [
+        {
+            "$match": {
+                "businessUnitId": business_unit_id,
+                "date": {"$gte": start_date, "$lte": end_date}
+            }
+        },
+        {
+            "$lookup": {
+                "from": "menus",
+                "localField": "menuId",
+                "foreignField": "_id",
+                "as": "menu"
+            }
+        },
+        {
+            "$unwind": "$menu"
+        },
+        {
+            "$project": {
+                "date": 1,
+                "mealType": 1,
+                "actualMeals": "$guestCount",
+                "temperature": "$weather.temperature",
+                "is_holiday": "$isHoliday",
+                "is_special_event": "$isSpecialEvent",
+                "previous_week_avg": 1,
+                "previous_day": 1,
+                "registered_guests": "$registeredGuests"
+            }
+        }
+    ]
+
+
+def historical_frame(results):
+    """Convert historical meal data documents to a DataFrame"""
+    if results:
+        df = pd.DataFrame(results)
+        # Use the column names expected by MealForecastModel
+        return df.rename(columns={'mealType': 'meal_type', 'actualMeals': 'actual_meals'})
+    else:
+        # If no data, return empty DataFrame with expected columns
+        return pd.DataFrame(columns=[
+            'date', 'meal_type', 'actual_meals', 'temperature',
+            'is_holiday', 'is_special_event', 'previous_week_avg',
+            'previous_day', 'registered_guests'
+        ])
+
+
+def forecast_frame(start_date, end_date, location):
+    """Build the forecast feature frame before business unit factors are applied"""
+    # Get dates for the forecast period
+    dates = pd.date_range(start=start_date, end=end_date)
+    meal_types = FORECAST_MEAL_TYPES
+
+    # Create DataFrame with all combinations of dates and meal types
+    forecast_data = []
+    for date in dates:
+        for meal_type in meal_types:
+            forecast_data.append({
+                'date': date,
+                'meal_type': meal_type,
+                'temperature': None,  # Will be filled with weather API data
+                'is_holiday': False,  # Will be determined
+                'is_special_event': False,  # Will be determined
+                'previous_week_avg': None,  # Will be calculated
+                'previous_day': None,  # Will be calculated
+                'registered_guests': None  # Will be fetched from reservations
+            })
+
+    df = pd.DataFrame(forecast_data)
+
+    # Fill temperature from the cached weather provider
+    weather = weather_provider.fetch(location, start_date, end_date)
+    df = merge_weather(df, weather)
+
+    # TODO: Enhance with actual calculations based on historical data
+    # For now, use simple placeholders
+    df['previous_week_avg'] = 100  # Placeholder
+    df['previous_day'] = 100  # Placeholder
+    df['registered_guests'] = 0  # Placeholder
+
+    return df
+
+
+def train_and_save_model(business_unit_id, historical_data):
+    """Train a unit's model on historical data and save it"""
+    model = MealForecastModel(business_unit_id)
+    with log_stage(logger, 'train', business_unit_id):
+        metrics = model.train(historical_data, compression_tolerance=FOREST_MAE_TOLERANCE)
+    model.save_model(get_model_path(business_unit_id))
+    return model, metrics
+
+
+def drift_since(business_unit_id):
+    """
+    Get the time after which actuals are new to a unit's drift monitor.
+
+    Returns:
+        tuple: Status ('ok', 'no_model' or 'no_snapshot') and, when 'ok', the
+            time of the last observation (or of the training run)
+    """
+    model = get_model(business_unit_id)
+    if model is None:
+        return 'no_model', None
+    if not model.training_snapshot:
+        return 'no_snapshot', None
+
+    monitor = monitor_store.load_monitor(business_unit_id, model.training_snapshot)
+    return 'ok', datetime.fromisoformat(monitor.last_date or model.training_snapshot['trained_at'])
+
+
+def update_drift_monitor(business_unit_id, new_data):
+    """
+    Update a unit's drift monitor with new actuals and check it.
+
+    Args:
+        business_unit_id (str): ID of a business unit with a model snapshot
+        new_data (pandas.DataFrame): Historical rows newer than drift_since
+
+    Returns:
+        dict: Result of DriftMonitor.check with status 'drift' or 'ok'
+    """
+    model = get_model(business_unit_id)
+    monitor = monitor_store.load_monitor(business_unit_id, model.training_snapshot)
+    if not new_data.empty:
+        predictions = model.predict(new_data.drop(columns=['actual_meals']))
+        monitor.update(model.build_feature_frame(new_data),
+                       new_data['actual_meals'].to_numpy(), predictions['predicted_meals'].to_numpy())
+        monitor_store.save_monitor(monitor)
+
+    result = monitor.check()
+    result['status'] = 'drift' if result['reasons'] else 'ok'
+    return result
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Forest Compression for Kanteeno Forecasting
+
+This module shrinks a fitted random forest regressor after training: it
+greedily selects a small subset of trees whose average matches the full
+forest on validation data, then collapses leaf pairs whose split barely
+changes the prediction. Both steps stay within a validation MAE budget.
+"""
+
+import time
+import pickle
+import logging
+import numpy as np
+from sklearn.tree._tree import Tree
+from sklearn.metrics import mean_absolute_error
+
+logger = logging.getLogger("forest_compression")
+
+# Allowed relative increase of validation MAE over the full forest
+DEFAULT_MAE_TOLERANCE = 0.02
+
+# Share of the budget spent on tree selection (the rest goes to leaf pruning)
+SELECTION_BUDGET_SHARE = 0.5
+
+# Fewest trees kept, since small validation sets make the MAE check noisy
+MIN_TREES = 10
+
+# Quantiles of the leaf-pair gains tried as pruning thresholds
+PRUNE_QUANTILES = np.linspace(0.1, 0.9, 9)
+
+TREE_LEAF = -1
+TREE_UNDEFINED = -2
+
+
+def greedy_tree_order(tree_predictions, y_val):
+    """
+    Order trees by greedy forward selection on validation MAE.
+
+    Each step adds the tree that most lowers the MAE of the running mean.
+
+    Args:
+        tree_predictions (numpy.ndarray): (trees, rows) validation predictions
+        y_val (numpy.ndarray): Validation targets
+
+    Returns:
+        numpy.ndarray: Tree positions in selection order
+    """
+    n_trees = len(tree_predictions)
+    order = []
+    remaining = np.ones(n_trees, dtype=bool)
+    running_sum = np.zeros(tree_predictions.shape[1])
+
+    while remaining.any():
+        # Validation MAE of the ensemble after adding each remaining tree
+        candidates = np.flatnonzero(remaining)
+        ensemble = (running_sum + tree_predictions[candidates]) / (len(order) + 1)
+        best = candidates[np.argmin(np.abs(ensemble - y_val).mean(axis=1))]
+
+        order.append(best)
+        remaining[best] = False
+        running_sum += tree_predictions[best]
+
+    return np.array(order)
+
+
+def smallest_prefix(tree_predictions, y_val, order, target_mae):
+    """
+    Find the fewest leading trees of an order whose mean meets the MAE target.
+
+    Args:
+        tree_predictions (numpy.ndarray): (trees, rows) predictions on check rows
+        y_val (numpy.ndarray): Targets of the check rows
+        order (numpy.ndarray): Tree positions in selection order
+        target_mae (float): Largest acceptable MAE
+
+    Returns:
+        int: Number of leading trees to keep (all trees if none meets the target)
+    """
+    prefix_means = np.cumsum(tree_predictions[order], axis=0) / np.arange(1, len(order) + 1)[:, np.newaxis]
+    errors = np.abs(prefix_means - y_val).mean(axis=1)
+    within = np.flatnonzero(errors <= target_mae)
+    return int(within[0]) + 1 if len(within) else len(order)
+
+
+def _leaf_pair_gains(tree, left, right):
+    """
+    Squared-error reduction of every split whose children are both leaves.
+
+    Returns:
+        tuple: Parent node positions and their gains (per root sample)
+    """
+    is_leaf = left == TREE_LEAF
+    parents = np.flatnonzero(~is_leaf)
+    parents = parents[is_leaf[left[parents]] & is_leaf[right[parents]]]
+
+    weights = tree.weighted_n_node_samples
+    values = tree.value[:, 0, 0]
+    n_left, n_right = weights[left[parents]], weights[right[parents]]
+    gains = n_left * n_right / (n_left + n_right) * (values[left[parents]] - values[right[parents]]) ** 2
+    return parents, gains / weights[0]
+
+
+def prune_children(tree, threshold):
+    """
+    Collapse leaf pairs with a gain below threshold, bottom-up.
+
+    Args:
+        tree (sklearn.tree._tree.Tree): Tree to prune (left unchanged)
+        threshold (float): Smallest gain a split must have to be kept
+
+    Returns:
+        tuple: Pruned left and right child arrays
+    """
+    left = tree.children_left.copy()
+    right = tree.children_right.copy()
+    while True:
+        parents, gains = _leaf_pair_gains(tree, left, right)
+        collapse = parents[gains < threshold]
+        if not len(collapse):
+            return left, right
+        left[collapse] = TREE_LEAF
+        right[collapse] = TREE_LEAF
+
+
+def rebuild_tree(tree, left, right):
+    """
+    Build a compact copy of a tree with new child links.
+
+    Nodes no longer reachable from the root are dropped and the remaining
+    nodes are renumbered in depth-first order.
+
+    Args:
+        tree (sklearn.tree._tree.Tree): Original tree
+        left (numpy.ndarray): Left child of every original node
+        right (numpy.ndarray): Right child of every original node
+
+    Returns:
+        sklearn.tree._tree.Tree: Compacted tree
+    """
+    state = tree.__getstate__()
+
+    order = []
+    depths = []
+    stack = [(0, 0)]
+    while stack:
+        node, depth = stack.pop()
+        order.append(node)
+        depths.append(depth)
+        if left[node] != TREE_LEAF:
+            stack.append((right[node], depth + 1))
+            stack.append((left[node], depth + 1))
+    order = np.array(order)
+
+    remap = np.full(len(left), TREE_LEAF)
+    remap[order] = np.arange(len(order))
+    nodes = state['nodes'][order].copy()
+    is_leaf = left[order] == TREE_LEAF
+    nodes['left_child'] = np.where(is_leaf, TREE_LEAF, remap[left[order]])
+    nodes['right_child'] = np.where(is_leaf, TREE_LEAF, remap[right[order]])
+    nodes['feature'][is_leaf] = TREE_UNDEFINED
+    nodes['threshold'][is_leaf] = TREE_UNDEFINED
+
+    compact = Tree(tree.n_features, tree.n_classes, tree.n_outputs)
+    compact.__setstate__({
+        **state,
+        'max_depth': int(max(depths)),
+        'node_count': len(order),
+        'nodes': nodes,
+        'values': state['values'][order]
+    })
+    return compact
+
+
+def _prediction_ms(forest, X, repeats=5):
+    """Median prediction latency of a forest in milliseconds"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        forest.predict(X)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def compress_forest(forest, X_val, y_val, mae_tolerance=DEFAULT_MAE_TOLERANCE):
+    """
+    Compress a fitted forest in place within a validation MAE budget.
+
+    Args:
+        forest (sklearn.ensemble.RandomForestRegressor): Fitted forest
+        X_val (numpy.ndarray): Validation features (already preprocessed)
+        y_val (array-like): Validation targets
+        mae_tolerance (float): Allowed relative MAE increase (0.02 = 2%)
+
+    Returns:
+        dict: Compression report with tree and node counts, MAE on the
+            held-out half of the validation rows, artifact size and
+            prediction latency before and after
+    """
+    y_val = np.asarray(y_val, dtype=float)
+    report = {
+        'mae_tolerance': mae_tolerance,
+        'trees_before': len(forest.estimators_),
+        'nodes_before': int(sum(estimator.tree_.node_count for estimator in forest.estimators_)),
+        'bytes_before': len(pickle.dumps(forest)),
+        'latency_ms_before': _prediction_ms(forest, X_val)
+    }
+
+    # Trees are ranked on one half of the validation rows and the budget is
+    # checked on the other half, so the selection does not fit its own check
+    rows = np.random.RandomState(42).permutation(len(y_val))
+    fit_rows, check_rows = rows[:len(rows) // 2], rows[len(rows) // 2:]
+    X_check, y_check = X_val[check_rows], y_val[check_rows]
+
+    tree_predictions = np.array([estimator.predict(X_val) for estimator in forest.estimators_])
+    full_mae = mean_absolute_error(y_check, tree_predictions[:, check_rows].mean(axis=0))
+    budget_mae = full_mae * (1 + mae_tolerance)
+
+    # Step 1: fewest greedily ranked trees within part of the budget
+    order = greedy_tree_order(tree_predictions[:, fit_rows], y_val[fit_rows])
+    n_keep = smallest_prefix(tree_predictions[:, check_rows], y_check, order,
+                             full_mae * (1 + mae_tolerance * SELECTION_BUDGET_SHARE))
+    n_keep = max(n_keep, min(MIN_TREES, len(order)))
+    estimators = [forest.estimators_[i] for i in order[:n_keep]]
+
+    # Step 2: the largest pruning threshold that keeps the whole budget
+    trees = [estimator.tree_ for estimator in estimators]
+    gains = np.concatenate([_leaf_pair_gains(tree, tree.children_left, tree.children_right)[1] for tree in trees])
+    links = [(tree.children_left, tree.children_right) for tree in trees]
+    X_tree = np.ascontiguousarray(X_check, dtype=np.float32)
+    for threshold in np.quantile(gains, PRUNE_QUANTILES) if len(gains) else []:
+        candidate = [prune_children(tree, threshold) for tree in trees]
+        predictions = np.mean([
+            rebuild_tree(tree, left, right).predict(X_tree).reshape(len(X_tree), -1)[:, 0]
+            for tree, (left, right) in zip(trees, candidate)
+        ], axis=0)
+        if mean_absolute_error(y_check, predictions) > budget_mae:
+            break
+        links = candidate
+
+    for estimator, tree, (left, right) in zip(estimators, trees, links):
+        estimator.tree_ = rebuild_tree(tree, left, right)
+
+    forest.estimators_ = estimators
+    forest.n_estimators = len(estimators)
+
+    report.update({
+        'trees_after': len(estimators),
+        'nodes_after': int(sum(estimator.tree_.node_count for estimator in estimators)),
+        'bytes_after': len(pickle.dumps(forest)),
+        'latency_ms_after': _prediction_ms(forest, X_val),
+        'mae_before': float(full_mae),
+        'mae_after': float(mean_absolute_error(y_check, forest.predict(X_check)))
+    })
+
+    logger.info("Compressed forest from %d trees / %d nodes to %d trees / %d nodes "
+                "(%.0f%% of memory, %.0f%% of latency, MAE %.2f -> %.2f)",
+                report['trees_before'], report['nodes_before'], report['trees_after'], report['nodes_after'],
+                100 * report['bytes_after'] / report['bytes_before'],
+                100 * report['latency_ms_after'] / max(report['latency_ms_before'], 1e-9),
+                report['mae_before'], report['mae_after'])
+    return report
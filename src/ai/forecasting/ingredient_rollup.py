@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Ingredient Demand Rollup for Kanteeno
+
+This script converts meal forecasts (as produced by MealForecastModel.predict)
+into daily ingredient and supplier demand in kilograms, using the recipe
+structures from the simulation data and ingredient_data.json.
+"""
+
+import json
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logger = logging.getLogger("ingredient_rollup")
+
+# Forecast columns that are propagated through the recipe matrix
+BOUND_COLUMNS = {
+    'predicted_meals': 'quantity_kg',
+    'lower_bound': 'lower_kg',
+    'upper_bound': 'upper_kg'
+}
+
+
+def ingredient_key(ingredient):
+    """Get the identifier used for an ingredient line in a recipe"""
+    for key in ('ingredientId', 'id', 'name'):
+        if ingredient.get(key) is not None:
+            return ingredient[key]
+    return 'Unknown'
+
+
+def menu_plan_from_yearly_menu(yearly_menu, meal_type='lunch', shares=None):
+    """
+    Build a menu plan frame from a yearly menu.
+
+    Args:
+        yearly_menu (list): Day entries with 'date' and 'meals' (meal IDs)
+        meal_type (str): Meal type the menu options are served at
+        shares (dict, optional): Expected share of covers per meal ID. Meals
+            without a share split the remainder of the day equally.
+
+    Returns:
+        pandas.DataFrame: Columns date, meal_type, meal_id and share
+    """
+    shares = shares or {}
+    rows = []
+    for day_menu in yearly_menu:
+        meal_ids = day_menu['meals']
+        fixed = {meal_id: shares[meal_id] for meal_id in meal_ids if meal_id in shares}
+        free = [meal_id for meal_id in meal_ids if meal_id not in fixed]
+        remainder = max(0.0, 1.0 - sum(fixed.values()))
+        for meal_id in meal_ids:
+            share = fixed.get(meal_id, remainder / len(free) if free else 0.0)
+            rows.append({
+                'date': day_menu['date'],
+                'meal_type': meal_type,
+                'meal_id': meal_id,
+                'share': share
+            })
+
+    plan = pd.DataFrame(rows, columns=['date', 'meal_type', 'meal_id', 'share'])
+    plan['date'] = pd.to_datetime(plan['date'])
+    return plan
+
+
+class IngredientRollup:
+    """
+    Sparse recipe matrix for rolling meal forecasts up to ingredient demand.
+
+    Each recipe line (ingredient bought from a given supplier) is a column of
+    a sparse meal × line matrix holding kilograms per portion. Daily covers per
+    meal are multiplied through this matrix and then aggregated per ingredient
+    and per supplier with sparse indicator matrices.
+    """
+
+    def __init__(self, meals, ingredient_data=None):
+        """
+        Initialize the rollup from the recipe structures.
+
+        Args:
+            meals (list): Meals with 'id' and 'ingredients' (each with
+                'quantity' in grams and 'supplierId')
+            ingredient_data (dict, optional): Contents of ingredient_data.json,
+                used to resolve ingredient and supplier names
+        """
+        self.meal_index = {}
+        line_index = {}
+        rows, cols, values = [], [], []
+
+        for meal in meals:
+            if 'ingredients' not in meal:
+                continue
+            meal_row = self.meal_index.setdefault(meal['id'], len(self.meal_index))
+            for ingredient in meal['ingredients']:
+                line = (ingredient_key(ingredient), ingredient.get('supplierId', 0))
+                col = line_index.setdefault(line, len(line_index))
+                rows.append(meal_row)
+                cols.append(col)
+                values.append(ingredient.get('quantity', 0) / 1000.0)
+
+        self.lines = list(line_index)
+        self.recipe_matrix = sparse.csr_matrix(
+            (values, (rows, cols)), shape=(len(self.meal_index), len(self.lines))
+        )
+
+        # Indicator matrices mapping recipe lines to ingredients and suppliers
+        self.ingredients, ingredient_cols = np.unique(
+            np.array([str(key) for key, _ in self.lines], dtype=object), return_inverse=True
+        ) if self.lines else (np.array([], dtype=object), np.array([], dtype=int))
+        self.ingredient_ids = {}
+        for (key, _), col in zip(self.lines, ingredient_cols):
+            self.ingredient_ids.setdefault(col, key)
+        self.suppliers, supplier_cols = np.unique(
+            np.array([supplier for _, supplier in self.lines]), return_inverse=True
+        ) if self.lines else (np.array([]), np.array([], dtype=int))
+
+        n_lines = len(self.lines)
+        self.ingredient_map = sparse.csr_matrix(
+            (np.ones(n_lines), (np.arange(n_lines), ingredient_cols)),
+            shape=(n_lines, len(self.ingredients))
+        )
+        self.supplier_map = sparse.csr_matrix(
+            (np.ones(n_lines), (np.arange(n_lines), supplier_cols)),
+            shape=(n_lines, len(self.suppliers))
+        )
+
+        self.ingredient_names, self.supplier_names = self._resolve_names(ingredient_data)
+
+        logger.info("Recipe matrix built: %d meals x %d recipe lines (%d non-zero)",
+                    len(self.meal_index), n_lines, self.recipe_matrix.nnz)
+
+    def _resolve_names(self, ingredient_data):
+        """Build ingredient and supplier name lookups from ingredient data"""
+        ingredient_names, supplier_names = {}, {}
+        if not ingredient_data:
+            return ingredient_names, supplier_names
+
+        for ingredient in ingredient_data.get('ingredients', []):
+            ingredient_names[str(ingredient.get('id'))] = ingredient.get('name')
+            ingredient_names[str(ingredient.get('name'))] = ingredient.get('name')
+            for supplier in ingredient.get('suppliers', []):
+                supplier_names[supplier.get('id')] = supplier.get('name')
+
+        return ingredient_names, supplier_names
+
+    def _covers_matrix(self, forecast, menu_plan, column, days):
+        """Build the sparse day × meal matrix of expected covers"""
+        merged = forecast.merge(menu_plan, on=['date', 'meal_type'], how='inner')
+        meal_rows = merged['meal_id'].map(self.meal_index)
+        known = meal_rows.notna().to_numpy()
+        if not known.all():
+            logger.warning("%d menu entries reference meals without recipes", (~known).sum())
+
+        merged = merged[known]
+        day_rows = days.get_indexer(merged['date'])
+        covers = merged[column].to_numpy(dtype=float) * merged['share'].to_numpy(dtype=float)
+
+        return sparse.csr_matrix(
+            (covers, (day_rows, meal_rows[known].to_numpy(dtype=int))),
+            shape=(len(days), len(self.meal_index))
+        )
+
+    def rollup(self, forecast, menu_plan):
+        """
+        Roll a meal forecast up to daily ingredient and supplier demand.
+
+        Lower and upper bounds are multiplied through the same non-negative
+        recipe matrix, so they stay valid bounds on the ingredient quantities.
+
+        Args:
+            forecast (pandas.DataFrame): Forecast with date, meal_type,
+                predicted_meals and optionally lower_bound and upper_bound
+            menu_plan (pandas.DataFrame): Columns date, meal_type, meal_id and
+                share (see menu_plan_from_yearly_menu)
+
+        Returns:
+            dict: 'ingredients' and 'suppliers' DataFrames with one row per
+                day and non-zero ingredient or supplier, in kilograms
+        """
+        forecast = forecast.copy()
+        forecast['date'] = pd.to_datetime(forecast['date'])
+        menu_plan = menu_plan.copy()
+        menu_plan['date'] = pd.to_datetime(menu_plan['date'])
+        days = pd.DatetimeIndex(sorted(forecast['date'].unique()))
+
+        ingredient_demand, supplier_demand = {}, {}
+        for column, output in BOUND_COLUMNS.items():
+            if column not in forecast.columns:
+                continue
+            line_demand = self._covers_matrix(forecast, menu_plan, column, days) @ self.recipe_matrix
+            ingredient_demand[output] = (line_demand @ self.ingredient_map).tocsr()
+            supplier_demand[output] = (line_demand @ self.supplier_map).tocsr()
+
+        ingredients = self._to_frame(ingredient_demand, days, 'ingredient_id',
+                                     [self.ingredient_ids[i] for i in range(len(self.ingredients))])
+        ingredients['ingredient_name'] = ingredients['ingredient_id'].astype(str).map(self.ingredient_names)
+
+        suppliers = self._to_frame(supplier_demand, days, 'supplier_id', list(self.suppliers))
+        suppliers['supplier_name'] = suppliers['supplier_id'].map(self.supplier_names)
+
+        logger.info("Rolled up %d days into %d ingredient and %d supplier demand rows",
+                    len(days), len(ingredients), len(suppliers))
+
+        return {'ingredients': ingredients, 'suppliers': suppliers}
+
+    def _to_frame(self, demand, days, key_column, keys):
+        """Convert sparse day × key demand matrices to a long DataFrame"""
+        columns = ['date', key_column] + list(demand)
+        matrices = list(demand.values())
+        if not matrices or 0 in matrices[0].shape:
+            # No forecast days or no recipe lines (e.g. an empty recipe list)
+            return pd.DataFrame(columns=columns)
+
+        # Union of the sparsity patterns so all bound columns share rows
+        pattern = abs(matrices[0])
+        for matrix in matrices[1:]:
+            pattern = pattern + abs(matrix)
+        pattern = pattern.tocoo()
+        day_rows, key_cols = pattern.row, pattern.col
+        order = np.lexsort((key_cols, day_rows))
+        day_rows, key_cols = day_rows[order], key_cols[order]
+
+        frame = pd.DataFrame({
+            'date': days[day_rows],
+            key_column: np.asarray(keys, dtype=object)[key_cols] if len(keys) else []
+        })
+        for output, matrix in demand.items():
+            frame[output] = np.asarray(matrix[day_rows, key_cols]).ravel()
+
+        return frame[columns]
+
+
+def main():
+    """
+    Main function for command-line usage.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingredient Demand Rollup')
+    parser.add_argument('--forecast', required=True, help='Forecast file (CSV) from MealForecastModel')
+    parser.add_argument('--menu', required=True, help='Meal data file (JSON) with meals and yearlyMenu')
+    parser.add_argument('--ingredients', help='Ingredient data file (JSON)')
+    parser.add_argument('--meal-type', default='lunch', help='Meal type the menu options are served at')
+    parser.add_argument('--output', required=True, help='Output prefix for demand files (CSV)')
+
+    args = parser.parse_args()
+
+    forecast = pd.read_csv(args.forecast, parse_dates=['date'])
+    with open(args.menu, 'r') as f:
+        meal_data = json.load(f)
+    ingredient_data = None
+    if args.ingredients:
+        with open(args.ingredients, 'r') as f:
+            ingredient_data = json.load(f)
+
+    rollup = IngredientRollup(meal_data['meals'], ingredient_data)
+    plan = menu_plan_from_yearly_menu(meal_data['yearlyMenu'], meal_type=args.meal_type)
+    demand = rollup.rollup(forecast, plan)
+
+    demand['ingredients'].to_csv(f"{args.output}_ingredients.csv", index=False)
+    demand['suppliers'].to_csv(f"{args.output}_suppliers.csv", index=False)
+    print(f"Ingredient demand saved to {args.output}_ingredients.csv")
+    print(f"Supplier demand saved to {args.output}_suppliers.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Intraday Arrival Profiles for Kanteeno Forecasting
+
+This module learns when guests arrive during the day, per business unit,
+weekday and meal type, and uses those arrival profiles to split daily meal
+forecasts into 15-minute slots for batch cooking.
+
+Usage:
+python intraday_profiles.py --fit --arrivals arrivals.csv --output arrival_profiles.joblib
+python intraday_profiles.py --profiles arrival_profiles.joblib --forecast forecast.csv --business-unit ID
+"""
+
+import sys
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import joblib
+from log_config import configure_logging
+
+logger = logging.getLogger("intraday_profiles")
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner', 'snack']
+
+# Typical service peaks (hour, spread in hours) used as the prior profile
+DEFAULT_PEAKS = {
+    'breakfast': (7.5, 0.75),
+    'lunch': (12.25, 0.66),
+    'dinner': (18.5, 1.0),
+    'snack': (15.5, 1.0)
+}
+
+# Arrivals needed before a unit's own profile outweighs the prior
+DEFAULT_PRIOR_STRENGTH = 50
+
+# Slots below this share of a meal's arrivals are left out of the output
+MIN_SLOT_SHARE = 1e-3
+
+
+def default_profile():
+    """
+    Build the prior arrival profile from the typical service peaks.
+
+    Returns:
+        numpy.ndarray: (meal types, slots) shares, each row summing to 1
+    """
+    hours = (np.arange(SLOTS_PER_DAY) + 0.5) * SLOT_MINUTES / 60
+    profile = np.array([
+        np.exp(-0.5 * ((hours - peak) / spread) ** 2)
+        for peak, spread in (DEFAULT_PEAKS[meal_type] for meal_type in MEAL_TYPES)
+    ])
+    return profile / profile.sum(axis=1, keepdims=True)
+
+
+def _meal_codes(meal_type):
+    """Map meal types to profile indices (unknown meal types raise)"""
+    codes = pd.Categorical(np.asarray(meal_type), categories=MEAL_TYPES).codes.astype(int)
+    if (codes < 0).any():
+        raise ValueError(f"meal_type must be one of {', '.join(MEAL_TYPES)}")
+    return codes
+
+
+def allocate(totals, shares):
+    """
+    Split integer totals over slots so each row sums exactly to its total.
+
+    Uses largest-remainder rounding, vectorized over all rows.
+
+    Args:
+        totals (numpy.ndarray): Non-negative integer total per row
+        shares (numpy.ndarray): (rows, slots) shares summing to 1 per row
+
+    Returns:
+        numpy.ndarray: (rows, slots) integer allocation
+    """
+    # Renormalize in float64 so float32 profile rows cannot overshoot the total
+    shares = shares.astype(float)
+    expected = totals[:, np.newaxis] * shares / shares.sum(axis=1, keepdims=True)
+    counts = np.floor(expected).astype(int)
+    remainder = totals.astype(int) - counts.sum(axis=1)
+
+    # Hand the leftover units to the slots with the largest fractional parts
+    order = np.argsort(counts - expected, axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(shares.shape[1])[np.newaxis, :], axis=1)
+    return counts + (ranks < remainder[:, np.newaxis])
+
+
+class ArrivalProfiles:
+    """
+    Per-unit, per-weekday arrival profiles stored as one compact array.
+
+    shares[u, d, m] holds the share of meal type m's guests arriving in each
+    15-minute slot on weekday d at unit u. The last unit row is the pooled
+    profile used for units without arrival history.
+    """
+
+    def __init__(self, unit_ids, shares):
+        """
+        Initialize the profiles.
+
+        Args:
+            unit_ids (list): Business unit IDs, one per leading row of shares
+            shares (numpy.ndarray): (units + 1, 7, meal types, slots) shares
+        """
+        self.unit_ids = list(unit_ids)
+        self.unit_codes = {unit_id: i for i, unit_id in enumerate(self.unit_ids)}
+        self.shares = shares.astype(np.float32)
+        self.fitted_at = datetime.now().isoformat()
+
+    @classmethod
+    def default(cls):
+        """Profiles without any units, serving the default service peaks"""
+        prior = default_profile()[np.newaxis, np.newaxis]
+        return cls([], np.broadcast_to(prior, (1, 7) + prior.shape[2:]).copy())
+
+    @classmethod
+    def fit(cls, arrivals, prior_strength=DEFAULT_PRIOR_STRENGTH):
+        """
+        Learn arrival profiles from arrival events.
+
+        Each unit's profile is smoothed towards the pooled profile of all
+        units, which in turn is smoothed towards the default service peaks.
+
+        Args:
+            arrivals (pandas.DataFrame): business_unit_id, timestamp and
+                meal_type columns, plus an optional count column
+            prior_strength (float): Pseudo-arrivals given to the prior
+
+        Returns:
+            ArrivalProfiles: Fitted profiles
+        """
+        unit_codes, unit_ids = pd.factorize(arrivals['business_unit_id'].astype(str), sort=True)
+        timestamps = pd.to_datetime(arrivals['timestamp'])
+        slots = (timestamps.dt.hour * 60 + timestamps.dt.minute).to_numpy() // SLOT_MINUTES
+        days = timestamps.dt.dayofweek.to_numpy()
+        meals = _meal_codes(arrivals['meal_type'])
+        weights = arrivals['count'].to_numpy(dtype=float) if 'count' in arrivals else np.ones(len(arrivals))
+
+        counts = np.zeros((len(unit_ids), 7, len(MEAL_TYPES), SLOTS_PER_DAY))
+        np.add.at(counts, (unit_codes, days, meals, slots), weights)
+
+        prior = np.broadcast_to(default_profile()[np.newaxis], (7, len(MEAL_TYPES), SLOTS_PER_DAY))
+        pooled_counts = counts.sum(axis=0)
+        pooled = (pooled_counts + prior_strength * prior) / \
+            (pooled_counts.sum(axis=-1, keepdims=True) + prior_strength)
+        shares = (counts + prior_strength * pooled) / (counts.sum(axis=-1, keepdims=True) + prior_strength)
+
+        logger.info("Fitted arrival profiles for %d business units from %d arrivals", len(unit_ids), weights.sum())
+        return cls(list(unit_ids), np.concatenate([shares, pooled[np.newaxis]]))
+
+    def lookup(self, business_unit_ids, day_of_week, meal_type):
+        """
+        Gather the profile rows for many forecasts at once.
+
+        Args:
+            business_unit_ids (array-like): Business unit of each forecast
+            day_of_week (array-like): Weekday (0-6) of each forecast
+            meal_type (array-like): Meal type of each forecast
+
+        Returns:
+            numpy.ndarray: (forecasts, slots) shares
+        """
+        units = pd.Series(business_unit_ids).astype(str).map(self.unit_codes) \
+            .fillna(len(self.unit_ids)).to_numpy(dtype=int)
+        return self.shares[units, np.asarray(day_of_week, dtype=int), _meal_codes(meal_type)]
+
+    def disaggregate(self, forecast, business_unit_id=None):
+        """
+        Split daily forecasts into 15-minute slot forecasts.
+
+        Args:
+            forecast (pandas.DataFrame): Output of MealForecastModel.predict,
+                with a business_unit_id column when it covers several units
+            business_unit_id (str, optional): Unit of a single-unit forecast
+
+        Returns:
+            pandas.DataFrame: One row per forecast and slot with a meaningful
+                share: date, meal_type, slot, slot_start, predicted_meals,
+                lower_bound and upper_bound. Slot meals sum to the daily
+                predicted_meals.
+        """
+        if 'business_unit_id' in forecast:
+            unit_ids = forecast['business_unit_id'].to_numpy()
+        else:
+            unit_ids = np.full(len(forecast), business_unit_id, dtype=object)
+
+        dates = pd.to_datetime(forecast['date']).dt.normalize()
+        shares = self.lookup(unit_ids, dates.dt.dayofweek.to_numpy(), forecast['meal_type']).astype(float)
+
+        # Drop negligible slots and renormalize over the kept ones before
+        # allocating, so the kept slots carry the whole daily forecast
+        shares = np.where(shares >= MIN_SLOT_SHARE, shares, 0.0)
+        shares /= shares.sum(axis=1, keepdims=True)
+        predicted = allocate(np.maximum(forecast['predicted_meals'].to_numpy(), 0).round().astype(int), shares)
+
+        rows, slots = np.nonzero(shares)
+        slot_shares = shares[rows, slots]
+        results = pd.DataFrame({
+            'date': dates.to_numpy()[rows],
+            'meal_type': forecast['meal_type'].to_numpy()[rows],
+            'slot': slots,
+            'slot_start': dates.to_numpy()[rows] + (slots * SLOT_MINUTES).astype('timedelta64[m]'),
+            'predicted_meals': predicted[rows, slots],
+            'lower_bound': np.round(forecast['lower_bound'].to_numpy(dtype=float)[rows] * slot_shares, 1),
+            'upper_bound': np.round(forecast['upper_bound'].to_numpy(dtype=float)[rows] * slot_shares, 1)
+        })
+        if 'business_unit_id' in forecast:
+            results.insert(0, 'business_unit_id', unit_ids[rows])
+        return results
+
+    def save(self, path):
+        """Save the profiles to a file"""
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path):
+        """Load profiles from a file"""
+        return joblib.load(path)
+
+
+def main():
+    """
+    Main function for command-line usage.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Intraday Arrival Profiles')
+    parser.add_argument('--fit', action='store_true', help='Fit profiles from arrival events')
+    parser.add_argument('--arrivals', help='Arrival events file (CSV)')
+    parser.add_argument('--profiles', help='Profiles file path (for loading)')
+    parser.add_argument('--forecast', help='Daily forecast file (CSV) to disaggregate')
+    parser.add_argument('--business-unit', help='Business unit ID of the forecast')
+    parser.add_argument('--output', help='Output file (profiles for --fit, slot forecasts otherwise)')
+    args = parser.parse_args()
+
+    configure_logging()
+
+    if args.fit:
+        if not args.arrivals:
+            logger.error("Arrival events file is required for fitting")
+            sys.exit(1)
+        profiles = ArrivalProfiles.fit(pd.read_csv(args.arrivals))
+        profiles.save(args.output or 'arrival_profiles.joblib')
+        print(f"Arrival profiles saved to {args.output or 'arrival_profiles.joblib'}")
+    elif args.profiles and args.forecast:
+        profiles = ArrivalProfiles.load(args.profiles)
+        slot_forecast = profiles.disaggregate(pd.read_csv(args.forecast), args.business_unit)
+        if args.output:
+            slot_forecast.to_csv(args.output, index=False)
+            print(f"Slot forecasts saved to {args.output}")
+        else:
+            print(slot_forecast)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Logging Setup for Kanteeno Forecasting
+
+This module configures non-blocking, structured logging for entry points
+(the API, CLIs and workers). Application threads only put log records on an
+in-memory queue; a background listener thread formats them as JSON events
+and writes them to the console and optional log file.
+
+Library modules only create loggers with logging.getLogger and never
+configure handlers themselves.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Structured fields copied from a record's extra into the JSON event
+EVENT_FIELDS = ('business_unit_id', 'stage', 'duration_ms', 'request_id')
+
+# Request ID of the current request (set by the API per request)
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_listener = None
+_settings = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON events"""
+
+    def format(self, record):
+        event = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request ID to records logged while handling a request"""
+
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread.
+
+    The standard QueueHandler formats the message before enqueueing so the
+    record can be pickled; records here stay in-process, so the message and
+    its arguments are only formatted by the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _build_handlers(log_file, json_format):
+    """Create the console and file handlers that write formatted events"""
+    formatter = JsonFormatter() if json_format else \
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def configure_logging(log_file=None, level=None, json_format=None):
+    """
+    Route all logging through a queue to a background writer thread.
+
+    Safe to call more than once; only the first call installs handlers.
+
+    Args:
+        log_file (str, optional): File to append events to in addition to stdout
+        level (str or int, optional): Root log level (defaults to LOG_LEVEL or INFO)
+        json_format (bool, optional): Emit JSON events (defaults to LOG_FORMAT != 'text')
+
+    Returns:
+        logging.handlers.QueueListener: The running listener
+    """
+    global _listener, _settings
+    if _listener is not None:
+        return _listener
+
+    if level is None:
+        level = os.getenv('LOG_LEVEL', 'INFO')
+    if json_format is None:
+        json_format = os.getenv('LOG_FORMAT', 'json') != 'text'
+    _settings = (log_file, json_format)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, *_build_handlers(log_file, json_format), respect_handler_level=True)
+    _listener.start()
+    # Flush queued events before the interpreter exits
+    atexit.register(_listener.stop)
+
+    return _listener
+
+
+def _log_directly_in_child():
+    """
+    Make forked worker processes write events synchronously.
+
+    The listener thread does not survive a fork and pool workers exit
+    without running atexit hooks, so workers skip the queue entirely.
+    """
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, DeferredQueueHandler)]:
+        root.removeHandler(handler)
+    for handler in _build_handlers(*_settings):
+        handler.addFilter(RequestContextFilter())
+        root.addHandler(handler)
+    _listener = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_log_directly_in_child)
+
+
+@contextmanager
+def log_stage(logger, stage, business_unit_id=None, level=logging.INFO):
+    """
+    Log the duration of a processing stage as a structured event.
+
+    Args:
+        logger (logging.Logger): Logger to emit the event on
+        stage (str): Stage name (e.g. 'train', 'predict')
+        business_unit_id (str, optional): Business unit being processed
+        level (int): Log level of the event
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if logger.isEnabledFor(level):
+            duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            logger.log(level, "Stage %s finished in %.2f ms", stage, duration_ms,
+                       extra={'stage': stage, 'business_unit_id': business_unit_id,
+                              'duration_ms': duration_ms})
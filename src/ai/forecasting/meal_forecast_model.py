@@ -7,7 +7,6 @@ for canteens based on historical data and external factors.
 """
 
 import os
-import sys
 import json
 import numpy as np
 import pandas as pd
@@ -18,18 +17,26 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import joblib
 import logging
+from drift_monitor import build_training_snapshot
+from conformal_intervals import build_calibration, conformal_interval
+from forecast_explainer import PathContributionExplainer
+from forest_compression import compress_forest
+from log_config import configure_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("forecast.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger("meal_forecast")
 
+# Share of the training rows held out to compress the forest, so the
+# validation rows behind the metrics, drift snapshot and conformal
+# calibration are never seen by the compressor
+COMPRESSION_SET_SIZE = 0.2
+
+# Fewest held-out rows worth compressing on (smaller sets skip compression)
+MIN_COMPRESSION_ROWS = 10
+
+# Fewest rows a model can be trained on (the 20% validation split needs at
+# least two rows for the metrics and calibration)
+MIN_FIT_ROWS = 10
+
 class MealForecastModel:
     """
     Machine learning model for forecasting meal demand in canteens.
@@ -39,17 +46,30 @@ class MealForecastModel:
     predict future meal demand.
     """
     
-    def __init__(self, business_unit_id, model_path=None):
+    def __init__(self, business_unit_id, model_path=None, interval_mode='conformal'):
         """
         Initialize the forecast model.
         
         Args:
             business_unit_id (str): ID of the business unit (canteen)
             model_path (str, optional): Path to a saved model file
+            interval_mode (str): 'conformal' to derive intervals from stored
+                calibration residuals, or 'forest' to use the spread of
+                per-tree predictions. Models saved without calibration
+                always use 'forest'.
         """
+        if interval_mode not in ('conformal', 'forest'):
+            raise ValueError("interval_mode must be 'conformal' or 'forest'")
+        
         self.business_unit_id = business_unit_id
         self.model = None
         self.scaler = None
+        self.training_snapshot = None
+        self.calibration = None
+        self.model_version = None
+        self.interval_mode = interval_mode
+        self.explainer = None
+        self.compression = None
         self.features = [
             'day_of_week', 'is_holiday', 'month', 'temperature', 
             'is_special_event', 'previous_week_avg', 'previous_day',
@@ -58,7 +78,7 @@ class MealForecastModel:
         
         if model_path and os.path.exists(model_path):
             self.load_model(model_path)
-            logger.info(f"Model loaded from {model_path}")
+            logger.info("Model loaded from %s", model_path)
         else:
             self.model = RandomForestRegressor(
                 n_estimators=100, 
@@ -68,15 +88,15 @@ class MealForecastModel:
             self.scaler = StandardScaler()
             logger.info("New model initialized")
     
-    def preprocess_data(self, data):
+    def build_feature_frame(self, data):
         """
-        Preprocess the input data for training or prediction.
+        Derive and clean the model features without scaling them.
         
         Args:
             data (pandas.DataFrame): Raw input data
             
         Returns:
-            tuple: Processed features (X) and target values (y) if available
+            pandas.DataFrame: Input data with all feature columns filled in
         """
         # Create copy to avoid modifying original data
         df = data.copy()
@@ -100,6 +120,20 @@ class MealForecastModel:
             'registered_guests': df['registered_guests'].median()
         })
         
+        return df
+    
+    def preprocess_data(self, data):
+        """
+        Preprocess the input data for training or prediction.
+        
+        Args:
+            data (pandas.DataFrame): Raw input data
+            
+        Returns:
+            tuple: Processed features (X) and target values (y) if available
+        """
+        df = self.build_feature_frame(data)
+        
         # Select features
         X = df[self.features]
         
@@ -113,28 +147,55 @@ class MealForecastModel:
         else:
             return X_scaled
     
-    def train(self, training_data):
+    def train(self, training_data, group_calibration=True, compression_tolerance=None):
         """
         Train the forecast model on historical data.
         
         Args:
             training_data (pandas.DataFrame): Historical meal data
+            group_calibration (bool): Calibrate conformal intervals per
+                weekday and meal type instead of pooling all residuals
+            compression_tolerance (float, optional): If set, compress the
+                forest after fitting while keeping the MAE on rows held out
+                from training within this relative tolerance (e.g. 0.02 for 2%)
             
         Returns:
             dict: Training metrics
         """
-        logger.info(f"Training model for business unit {self.business_unit_id}")
+        if len(training_data) < MIN_FIT_ROWS:
+            raise ValueError(f"At least {MIN_FIT_ROWS} rows are needed for training, got {len(training_data)}")
+        
+        logger.info("Training model for business unit %s", self.business_unit_id,
+                    extra={'business_unit_id': self.business_unit_id})
         
         # Preprocess data
+        feature_frame = self.build_feature_frame(training_data)
         X, y = self.preprocess_data(training_data)
         
         # Split data into training and validation sets
-        X_train, X_val, y_train, y_val = train_test_split(
-            X, y, test_size=0.2, random_state=42
+        X_train, X_val, y_train, y_val, _, val_rows = train_test_split(
+            X, y, np.arange(len(y)), test_size=0.2, random_state=42
         )
         
+        # Hold out compression rows from the training rows
+        if compression_tolerance is not None and len(y_train) * COMPRESSION_SET_SIZE < MIN_COMPRESSION_ROWS:
+            logger.info("Too few training rows to compress the forest",
+                        extra={'business_unit_id': self.business_unit_id})
+            compression_tolerance = None
+        if compression_tolerance is not None:
+            X_train, X_compress, y_train, y_compress = train_test_split(
+                X_train, y_train, test_size=COMPRESSION_SET_SIZE, random_state=42
+            )
+        
         # Train the model
         self.model.fit(X_train, y_train)
+        self.explainer = None
+        self.compression = None
+        
+        # Drop redundant trees and leaves; the compressed forest is what gets saved and served
+        if compression_tolerance is not None:
+            self.compression = compress_forest(self.model, X_compress, y_compress, compression_tolerance)
+        self.model_version = datetime.now().strftime('%Y%m%d%H%M%S')
         
         # Evaluate on validation set
         y_pred = self.model.predict(X_val)
@@ -145,6 +206,19 @@ class MealForecastModel:
         rmse = np.sqrt(mse)
         r2 = r2_score(y_val, y_pred)
         
+        # Keep feature distributions and validation residuals for drift monitoring
+        self.training_snapshot = build_training_snapshot(
+            feature_frame, np.asarray(y_val) - y_pred
+        )
+        
+        # Validation residuals calibrate the conformal prediction intervals
+        self.calibration = build_calibration(
+            np.asarray(y_val) - y_pred,
+            feature_frame['day_of_week'].to_numpy()[val_rows],
+            training_data['meal_type'].to_numpy()[val_rows],
+            grouped=group_calibration
+        )
+        
         metrics = {
             'mae': mae,
             'mse': mse,
@@ -152,8 +226,11 @@ class MealForecastModel:
             'r2': r2,
             'feature_importance': dict(zip(self.features, self.model.feature_importances_))
         }
+        if self.compression is not None:
+            metrics['compression'] = self.compression
         
-        logger.info(f"Model trained successfully. Metrics: MAE={mae:.2f}, RMSE={rmse:.2f}, R²={r2:.2f}")
+        logger.info("Model trained successfully. Metrics: MAE=%.2f, RMSE=%.2f, R²=%.2f", mae, rmse, r2,
+                    extra={'business_unit_id': self.business_unit_id})
         
         return metrics
     
@@ -170,7 +247,8 @@ class MealForecastModel:
         if self.model is None:
             raise ValueError("Model not trained. Call train() first.")
         
-        logger.info(f"Generating forecast for business unit {self.business_unit_id}")
+        logger.info("Generating forecast for business unit %s", self.business_unit_id,
+                    extra={'business_unit_id': self.business_unit_id})
         
         # Preprocess data
         X = self.preprocess_data(forecast_data)
@@ -178,11 +256,19 @@ class MealForecastModel:
         # Generate predictions
         predictions = self.model.predict(X)
         
-        # Calculate confidence intervals (using prediction intervals from forest)
-        predictions_all_trees = np.array([tree.predict(X) for tree in self.model.estimators_])
-        lower_bound = np.percentile(predictions_all_trees, 10, axis=0)
-        upper_bound = np.percentile(predictions_all_trees, 90, axis=0)
-        confidence = 100 - (np.std(predictions_all_trees, axis=0) / np.mean(predictions_all_trees, axis=0) * 100)
+        if self.interval_mode == 'conformal' and self.calibration is not None:
+            # Calibrated intervals from stored residual quantiles (no extra forest pass)
+            lower_bound, upper_bound, confidence = conformal_interval(
+                self.calibration, predictions,
+                pd.to_datetime(forecast_data['date']).dt.dayofweek.to_numpy(),
+                forecast_data['meal_type'].to_numpy()
+            )
+        else:
+            # Calculate confidence intervals (using prediction intervals from forest)
+            predictions_all_trees = np.array([tree.predict(X) for tree in self.model.estimators_])
+            lower_bound = np.percentile(predictions_all_trees, 10, axis=0)
+            upper_bound = np.percentile(predictions_all_trees, 90, axis=0)
+            confidence = 100 - (np.std(predictions_all_trees, axis=0) / np.mean(predictions_all_trees, axis=0) * 100)
         
         # Create results dataframe
         results = forecast_data[['date', 'meal_type']].copy()
@@ -191,10 +277,36 @@ class MealForecastModel:
         results['upper_bound'] = np.round(upper_bound).astype(int)
         results['confidence'] = np.clip(confidence, 0, 100)
         
-        logger.info(f"Forecast generated for {len(results)} data points")
+        logger.info("Forecast generated for %d data points", len(results),
+                    extra={'business_unit_id': self.business_unit_id})
         
         return results
     
+    def explain(self, forecast_data):
+        """
+        Break forecasts down into per-feature contributions.
+        
+        Args:
+            forecast_data (pandas.DataFrame): Data for forecast period
+            
+        Returns:
+            pandas.DataFrame: date, meal_type, a 'bias' column and one
+                contribution column per feature; bias plus the contributions
+                equals the unrounded forecast
+        """
+        if self.model is None:
+            raise ValueError("Model not trained. Call train() first.")
+        
+        # Node path sums are computed once per loaded model
+        if self.explainer is None:
+            self.explainer = PathContributionExplainer(self.model, self.features)
+        
+        X = self.preprocess_data(forecast_data)
+        contributions = self.explainer.explain_frame(X)
+        
+        results = forecast_data[['date', 'meal_type']].reset_index(drop=True)
+        return pd.concat([results, contributions], axis=1)
+    
     def save_model(self, path):
         """
         Save the trained model to a file.
@@ -210,11 +322,15 @@ class MealForecastModel:
             'scaler': self.scaler,
             'features': self.features,
             'business_unit_id': self.business_unit_id,
+            'training_snapshot': self.training_snapshot,
+            'calibration': self.calibration,
+            'model_version': self.model_version,
+            'compression': self.compression,
             'timestamp': datetime.now().isoformat()
         }
         
         joblib.dump(model_data, path)
-        logger.info(f"Model saved to {path}")
+        logger.info("Model saved to %s", path)
     
     def load_model(self, path):
         """
@@ -229,8 +345,13 @@ class MealForecastModel:
         self.scaler = model_data['scaler']
         self.features = model_data['features']
         self.business_unit_id = model_data['business_unit_id']
+        self.training_snapshot = model_data.get('training_snapshot')
+        self.calibration = model_data.get('calibration')
+        self.model_version = model_data.get('model_version', model_data['timestamp'])
+        self.compression = model_data.get('compression')
+        self.explainer = None
         
-        logger.info(f"Model loaded from {path} (saved on {model_data['timestamp']})")
+        logger.info("Model loaded from %s (saved on %s)", path, model_data['timestamp'])
     
     def evaluate_accuracy(self, actual_data):
         """
@@ -265,7 +386,7 @@ class MealForecastModel:
             'by_meal_type': actual_data.groupby('meal_type')['pct_error'].mean().to_dict()
         }
         
-        logger.info(f"Forecast accuracy: {accuracy:.2f}%")
+        logger.info("Forecast accuracy: %.2f%%", accuracy)
         
         return metrics
 
@@ -284,13 +405,20 @@ def main():
     parser.add_argument('--input', required=True, help='Input data file (CSV)')
     parser.add_argument('--output', help='Output file for predictions (CSV)')
     parser.add_argument('--model', help='Model file path (for saving or loading)')
+    parser.add_argument('--interval-mode', choices=['conformal', 'forest'], default='conformal',
+                        help='How prediction intervals are computed')
+    parser.add_argument('--compress-tolerance', type=float,
+                        help='Compress the trained forest within this relative validation MAE increase')
     
     args = parser.parse_args()
     
+    configure_logging(os.getenv('LOG_FILE', 'forecast.log'))
+    
     # Initialize model
     model = MealForecastModel(
         business_unit_id=args.business_unit,
-        model_path=args.model if not args.train else None
+        model_path=args.model if not args.train else None,
+        interval_mode=args.interval_mode
     )
     
     # Load data
@@ -298,7 +426,7 @@ def main():
     
     if args.train:
         # Train model
-        metrics = model.train(data)
+        metrics = model.train(data, compression_tolerance=args.compress_tolerance)
         print(f"Training metrics: {json.dumps(metrics, indent=2)}")
         
         # Save model if path provided
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Retrain Scheduler for Kanteeno Forecasting
+
+This script runs next to the forecast API and keeps business unit models
+fresh. Units are queued by model age, new data volume and recent forecast
+error, and retrained within a global CPU budget and a per-node concurrency
+limit so retraining never competes with serving for the whole machine.
+
+Usage:
+python retrain_scheduler.py [--dry-run] [--once]
+"""
+
+import os
+import json
+import time
+import heapq
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from log_config import configure_logging
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger("retrain_scheduler")
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/kanteeno')
+MODEL_DIR = os.getenv('MODEL_DIR', './models')
+
+DEFAULT_SETTINGS = {
+    'max_concurrency': max(1, (os.cpu_count() or 2) // 4),  # Retrains per node
+    'cpu_budget_seconds': 1800,     # CPU seconds of retraining per budget window
+    'budget_window_seconds': 3600,
+    'min_model_age_hours': 12,      # Never retrain a model younger than this
+    'default_retrain_seconds': 30,  # Cost estimate for units never retrained
+    'weights': {
+        'age_days': 1.0,            # Per day since last training
+        'new_rows': 0.05,           # Per meal record added since training
+        'error_ratio': 10.0         # Per unit of rolling MAE / training MAE above 1
+    },
+    'poll_seconds': 300
+}
+
+
+def retrain_unit(business_unit_id):
+    """
+    Retrain and save the model of one business unit.
+
+    Runs in a worker process; reuses the API's data access so training data
+    is prepared exactly as for on-demand training.
+
+    Args:
+        business_unit_id (str): ID of the business unit
+
+    Returns:
+        dict: business_unit_id, status, CPU seconds used and metrics
+    """
+    from api import fetch_historical_data, train_and_save_model, drift_store
+    from forecast_service import MIN_FIT_ROWS
+
+    started = time.process_time()
+    historical_data = fetch_historical_data(business_unit_id)
+    if len(historical_data) < MIN_FIT_ROWS:
+        return {'business_unit_id': business_unit_id, 'status': 'no_data',
+                'cpu_seconds': time.process_time() - started}
+
+    _, metrics = train_and_save_model(business_unit_id, historical_data)
+    drift_store.reset(business_unit_id)
+
+    return {
+        'business_unit_id': business_unit_id,
+        'status': 'retrained',
+        'cpu_seconds': time.process_time() - started,
+        'mae': float(metrics['mae'])
+    }
+
+
+def refresh_similarity_index(retrained):
+    """
+    Rebuild the cold-start similarity index over the trained units.
+
+    Runs in a worker process after every cycle, so forecast requests only
+    load the saved index. The index is rebuilt when units were retrained or
+    when it misses trained units (e.g. units trained through the API).
+
+    Args:
+        retrained (bool): Whether the cycle retrained any unit
+
+    Returns:
+        bool: Whether the index was rebuilt
+    """
+    from api import rebuild_unit_index
+    from forecast_service import UNIT_INDEX_PATH, get_trained_unit_ids
+    from unit_similarity import UnitSimilarityIndex
+
+    if not retrained and os.path.exists(UNIT_INDEX_PATH) \
+            and UnitSimilarityIndex.load(UNIT_INDEX_PATH).unit_ids == get_trained_unit_ids():
+        return False
+    rebuild_unit_index()
+    return True
+
+
+class RetrainScheduler:
+    """
+    Staleness-prioritized retrain scheduler with persisted state.
+
+    State (last training time, measured retrain cost and budget usage) is
+    stored as JSON in the model directory, so a restarted scheduler keeps
+    its priorities and does not overspend the current budget window.
+    """
+
+    def __init__(self, db, model_dir, settings=None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            db (pymongo.database.Database): Database handle (may be None)
+            model_dir (str): Directory with model and drift state files
+            settings (dict, optional): Overrides for DEFAULT_SETTINGS
+        """
+        self.db = db
+        self.model_dir = model_dir
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.state_path = os.path.join(model_dir, 'scheduler_state.json')
+        self.state = self._load_state()
+        self.reserved_seconds = 0.0  # Estimates of the retrains currently running
+
+    def _load_state(self):
+        """Load persisted scheduler state"""
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        return {'units': {}, 'window_start': time.time(), 'window_spent': 0.0}
+
+    def _save_state(self):
+        """Persist scheduler state atomically"""
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def budget_remaining(self):
+        """CPU seconds left in the current budget window, net of running retrains"""
+        if time.time() - self.state['window_start'] >= self.settings['budget_window_seconds']:
+            self.state['window_start'] = time.time()
+            self.state['window_spent'] = 0.0
+        return self.settings['cpu_budget_seconds'] - self.state['window_spent'] - self.reserved_seconds
+
+    def _business_units(self):
+        """Get IDs of all business units (from the database and model files)"""
+        units = set()
+        if self.db is not None:
+            units.update(str(unit['_id']) for unit in self.db.businessunits.find({}, {'_id': 1}))
+        for name in os.listdir(self.model_dir):
+            if name.startswith('model_') and name.endswith('.joblib'):
+                units.add(name[len('model_'):-len('.joblib')])
+        return sorted(units)
+
+    def _trained_at(self, business_unit_id):
+        """Get when a unit's model was last trained (None if never)"""
+        path = os.path.join(self.model_dir, f"model_{business_unit_id}.joblib")
+        if not os.path.exists(path):
+            return None
+        return datetime.fromtimestamp(os.path.getmtime(path))
+
+    def _new_rows(self, business_unit_id, trained_at):
+        """Count meal records added since the model was trained"""
+        if self.db is None:
+            return 0
+        query = {'businessUnitId': business_unit_id}
+        if trained_at:
+            query['date'] = {'$gt': trained_at}
+        return self.db.meals.count_documents(query)
+
+    def _error_ratio(self, business_unit_id):
+        """Get rolling MAE relative to training MAE from drift monitor state"""
+        path = os.path.join(self.model_dir, f"drift_{business_unit_id}.json")
+        if not os.path.exists(path):
+            return 1.0
+        with open(path, 'r') as f:
+            state = json.load(f)
+        residuals = state.get('residuals') or []
+        training_mae = state.get('residual_mae') or 0
+        if not residuals or training_mae <= 0:
+            return 1.0
+        return sum(abs(r) for r in residuals) / len(residuals) / training_mae
+
+    def plan(self, now=None):
+        """
+        Build the retrain priority queue.
+
+        Args:
+            now (datetime, optional): Reference time
+
+        Returns:
+            list: Queue entries (dicts) in priority order
+        """
+        now = now or datetime.now()
+        weights = self.settings['weights']
+        min_age = timedelta(hours=self.settings['min_model_age_hours'])
+        heap = []
+
+        for business_unit_id in self._business_units():
+            trained_at = self._trained_at(business_unit_id)
+            if trained_at and now - trained_at < min_age:
+                continue
+
+            age_days = (now - trained_at).total_seconds() / 86400 if trained_at else 365.0
+            new_rows = self._new_rows(business_unit_id, trained_at)
+            if trained_at and new_rows == 0:
+                continue  # Nothing new to learn from
+            error_ratio = self._error_ratio(business_unit_id)
+
+            priority = (weights['age_days'] * age_days
+                        + weights['new_rows'] * new_rows
+                        + weights['error_ratio'] * max(0.0, error_ratio - 1.0))
+            unit_state = self.state['units'].get(business_unit_id, {})
+            entry = {
+                'business_unit_id': business_unit_id,
+                'priority': round(priority, 3),
+                'age_days': round(age_days, 2),
+                'new_rows': new_rows,
+                'error_ratio': round(error_ratio, 3),
+                'estimated_seconds': unit_state.get('last_cpu_seconds', self.settings['default_retrain_seconds'])
+            }
+            heapq.heappush(heap, (-priority, business_unit_id, entry))
+
+        return [heapq.heappop(heap)[2] for _ in range(len(heap))]
+
+    def select(self, queue):
+        """Mark the queue entries that fit in the remaining CPU budget"""
+        remaining = self.budget_remaining
+        for entry in queue:
+            entry['scheduled'] = entry['estimated_seconds'] <= remaining
+            if entry['scheduled']:
+                remaining -= entry['estimated_seconds']
+        return queue
+
+    def _record(self, result):
+        """Update state with a finished retrain"""
+        unit_state = self.state['units'].setdefault(result['business_unit_id'], {})
+        unit_state['last_status'] = result['status']
+        unit_state['last_run'] = datetime.now().isoformat()
+        unit_state['last_cpu_seconds'] = round(result['cpu_seconds'], 2)
+        self.state['window_spent'] += result['cpu_seconds']
+        self._save_state()
+
+    def run_cycle(self):
+        """
+        Plan and run one round of retrains within the budget.
+
+        Returns:
+            list: Results of the retrains that ran
+        """
+        queue = [entry for entry in self.select(self.plan()) if entry['scheduled']]
+        if not queue:
+            logger.info("No business units due for retraining")
+            self.refresh_unit_index([])
+            return []
+
+        results = []
+        pending = iter(queue)
+        with ProcessPoolExecutor(max_workers=self.settings['max_concurrency']) as executor:
+            running = {}
+
+            def refill():
+                # Reserve each retrain's estimate while it runs so the cycle cannot overspend
+                for entry in pending:
+                    if entry['estimated_seconds'] > self.budget_remaining:
+                        continue
+                    self.reserved_seconds += entry['estimated_seconds']
+                    running[executor.submit(retrain_unit, entry['business_unit_id'])] = entry
+                    if len(running) >= self.settings['max_concurrency']:
+                        break
+
+            refill()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = running.pop(future)
+                    self.reserved_seconds -= entry['estimated_seconds']
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error("Retrain failed: %s", e)
+                        continue
+                    self._record(result)
+                    results.append(result)
+                    logger.info("Retrained business unit %s (%s, %.1f CPU s)", result['business_unit_id'],
+                                result['status'], result['cpu_seconds'],
+                                extra={'business_unit_id': result['business_unit_id']})
+
+                # Refill free slots while the budget allows it
+                refill()
+
+        self.refresh_unit_index(results)
+        return results
+
+    def refresh_unit_index(self, results):
+        """Bring the cold-start similarity index up to date after a cycle"""
+        retrained = any(result['status'] == 'retrained' for result in results)
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                if executor.submit(refresh_similarity_index, retrained).result():
+                    logger.info("Rebuilt unit similarity index")
+        except Exception as e:
+            logger.error("Failed to rebuild unit similarity index: %s", e)
+
+    def run_forever(self):
+        """Run retrain cycles until interrupted"""
+        while True:
+            self.run_cycle()
+            time.sleep(self.settings['poll_seconds'])
+
+
+def print_schedule(queue, budget_remaining):
+    """Print a planned schedule"""
+    print(f"Remaining CPU budget: {budget_remaining:.0f} s")
+    print(f"{'#':>3}  {'business unit':<26} {'priority':>9} {'age (d)':>8} {'new rows':>9} "
+          f"{'err ratio':>9} {'est. s':>7}  scheduled")
+    for rank, entry in enumerate(queue, 1):
+        print(f"{rank:>3}  {entry['business_unit_id']:<26} {entry['priority']:>9.2f} {entry['age_days']:>8.1f} "
+              f"{entry['new_rows']:>9} {entry['error_ratio']:>9.2f} {entry['estimated_seconds']:>7.1f}  "
+              f"{'yes' if entry['scheduled'] else 'no'}")
+
+
+def main():
+    """
+    Main function for command-line usage.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Forecast Model Retrain Scheduler')
+    parser.add_argument('--dry-run', action='store_true', help='Print the planned schedule without retraining')
+    parser.add_argument('--once', action='store_true', help='Run a single retrain cycle and exit')
+    parser.add_argument('--max-concurrency', type=int, help='Maximum concurrent retrains on this node')
+    parser.add_argument('--cpu-budget', type=float, help='CPU seconds of retraining per budget window')
+
+    args = parser.parse_args()
+
+    configure_logging()
+
+    settings = {}
+    if args.max_concurrency:
+        settings['max_concurrency'] = args.max_concurrency
+    if args.cpu_budget:
+        settings['cpu_budget_seconds'] = args.cpu_budget
+
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    try:
+        db = MongoClient(MONGO_URI).kanteeno
+    except Exception as e:
+        logger.error("Failed to connect to MongoDB: %s", e)
+        db = None
+
+    scheduler = RetrainScheduler(db, MODEL_DIR, settings)
+
+    if args.dry_run:
+        queue = scheduler.select(scheduler.plan())
+        print_schedule(queue, scheduler.budget_remaining)
+    elif args.once:
+        scheduler.run_cycle()
+    else:
+        scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Request Coalescing for Kanteeno Forecasting
+
+This module makes concurrent identical calls share one computation: the
+first caller for a key runs it, callers arriving while it is in flight wait
+for and receive the same result (or exception). Nothing is cached once the
+computation finishes.
+"""
+
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("single_flight")
+
+
+class _Call:
+    """An in-flight computation and its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key across threads.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize the group.
+
+        Args:
+            name (str): Name used in log messages
+        """
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run function once per key among concurrent callers.
+
+        Args:
+            key (hashable): Identity of the computation
+            function (callable): Computation to run
+            *args, **kwargs: Arguments passed to function
+
+        Returns:
+            The result of the shared computation (its exception is re-raised
+            in every waiting caller; if the computation was interrupted, e.g.
+            by SystemExit, waiting callers get a RuntimeError)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            logger.debug("Joining in-flight %s for %s", self.name, key)
+            call.done.wait()
+        else:
+            try:
+                call.result = function(*args, **kwargs)
+            except BaseException as e:
+                # Also SystemExit and KeyboardInterrupt, so waiters never get a missing result
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+                if call.waiters:
+                    logger.info("Shared %s for %s with %d waiting requests", self.name, key, call.waiters)
+
+        if call.error is not None:
+            if not leader and not isinstance(call.error, Exception):
+                raise RuntimeError(f"In-flight {self.name} for {key} was interrupted") from call.error
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent calls with the same key within one event loop.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize the group.
+
+        Args:
+            name (str): Name used in log messages
+        """
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        """
+        Await coroutine function once per key among concurrent callers.
+
+        Args:
+            key (hashable): Identity of the computation
+            function (callable): Coroutine function to run
+            *args, **kwargs: Arguments passed to function
+
+        Returns:
+            The result of the shared computation (its exception is re-raised
+            in every waiting caller)
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            logger.debug("Joining in-flight %s for %s", self.name, key)
+        # Shield the shared task so a cancelled caller does not cancel the others
+        return await asyncio.shield(task)
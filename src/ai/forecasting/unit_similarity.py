@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Business Unit Similarity Index for Kanteeno
+
+This module finds trained business units that resemble a new canteen, so a
+unit without enough history can be served a scaled forecast from its
+nearest neighbors' models until it has enough data for its own model.
+
+Usage:
+python unit_similarity.py --rebuild
+"""
+
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.neighbors import KDTree
+from log_config import configure_logging
+
+logger = logging.getLogger("unit_similarity")
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner', 'snack']
+PROFILE_MEAL_TYPES = ['breakfast', 'lunch', 'dinner']
+
+# Defaults from the BusinessUnit schema, used for missing settings
+DEFAULT_CAPACITY = 100
+DEFAULT_OPERATING_DAYS = {day: day not in ('saturday', 'sunday') for day in WEEKDAYS}
+DEFAULT_MEAL_TYPES = {'breakfast': False, 'lunch': True, 'dinner': False, 'snack': False}
+
+
+def unit_capacity(business_unit):
+    """Get the meal capacity of a business unit"""
+    settings = (business_unit or {}).get('settings') or {}
+    return float(settings.get('mealCapacity') or DEFAULT_CAPACITY)
+
+
+def unit_descriptor(business_unit):
+    """
+    Encode a business unit document as a numeric descriptor.
+
+    Args:
+        business_unit (dict): Business unit document (may be None)
+
+    Returns:
+        numpy.ndarray: Descriptor vector
+    """
+    business_unit = business_unit or {}
+    settings = business_unit.get('settings') or {}
+    preferences = (business_unit.get('preferences') or {}).get('dietaryPreferences') or {}
+    operating_days = {**DEFAULT_OPERATING_DAYS, **(settings.get('operatingDays') or {})}
+    meal_types = {**DEFAULT_MEAL_TYPES, **(settings.get('mealTypes') or {})}
+
+    return np.array(
+        [np.log1p(unit_capacity(business_unit))]
+        + [float(bool(operating_days[day])) for day in WEEKDAYS]
+        + [float(bool(meal_types[meal_type])) for meal_type in MEAL_TYPES]
+        + [
+            float(settings.get('budgetPerMeal') or 35) / 100,
+            float(preferences.get('vegetarianPercentage') or 20) / 100,
+            float(preferences.get('veganPercentage') or 10) / 100,
+            float(settings.get('organicPercentageTarget') or 30) / 100
+        ]
+    )
+
+
+def demand_profile(historical_data):
+    """
+    Summarize historical demand as weekday × meal type shares.
+
+    Args:
+        historical_data (pandas.DataFrame): date, meal_type and actual_meals
+
+    Returns:
+        numpy.ndarray: Flattened 7 × 3 shares of average demand (None if empty)
+    """
+    if historical_data is None or historical_data.empty:
+        return None
+    frame = historical_data.assign(day_of_week=pd.to_datetime(historical_data['date']).dt.dayofweek)
+    means = frame.pivot_table(index='day_of_week', columns='meal_type', values='actual_meals', aggfunc='mean')
+    means = means.reindex(index=range(7), columns=PROFILE_MEAL_TYPES).fillna(0).to_numpy(dtype=float)
+    total = means.sum()
+    return (means / total).ravel() if total > 0 else None
+
+
+class UnitSimilarityIndex:
+    """
+    KD-tree over standardized descriptors of business units with a model.
+
+    Lookups query the tree for a few candidates and, when the new unit
+    already has some demand history, re-rank them by demand profile.
+    """
+
+    def __init__(self, unit_ids, descriptors, capacities, profiles=None):
+        """
+        Build the index.
+
+        Args:
+            unit_ids (list): IDs of trained business units
+            descriptors (numpy.ndarray): One descriptor row per unit
+            capacities (numpy.ndarray): Meal capacity per unit
+            profiles (dict, optional): Unit ID to demand profile
+        """
+        self.unit_ids = list(unit_ids)
+        descriptors = np.asarray(descriptors, dtype=float)
+        descriptors = descriptors.reshape(len(self.unit_ids), -1) if len(self.unit_ids) else np.empty((0, 0))
+        self.mean = descriptors.mean(axis=0) if len(descriptors) else 0
+        self.std = descriptors.std(axis=0) if len(descriptors) else 1
+        self.std = np.where(self.std > 0, self.std, 1.0)
+        self.tree = KDTree((descriptors - self.mean) / self.std) if len(descriptors) else None
+        self.capacities = np.asarray(capacities, dtype=float)
+        self.profiles = profiles or {}
+        self.built_at = datetime.now().isoformat()
+
+    def __len__(self):
+        return len(self.unit_ids)
+
+    @classmethod
+    def build(cls, business_units, trained_unit_ids, profiles=None):
+        """
+        Build the index from business unit documents.
+
+        Args:
+            business_units (dict): Unit ID to business unit document
+            trained_unit_ids (list): Units that have a trained model
+            profiles (dict, optional): Unit ID to demand profile
+
+        Returns:
+            UnitSimilarityIndex: The index
+        """
+        unit_ids = sorted(trained_unit_ids)
+        descriptors = np.array([unit_descriptor(business_units.get(unit_id)) for unit_id in unit_ids])
+        capacities = np.array([unit_capacity(business_units.get(unit_id)) for unit_id in unit_ids])
+        return cls(unit_ids, descriptors, capacities, profiles)
+
+    def query(self, business_unit, k=3, profile=None, exclude=None):
+        """
+        Find the nearest trained units.
+
+        Args:
+            business_unit (dict): Business unit document of the new unit
+            k (int): Number of neighbors
+            profile (numpy.ndarray, optional): Partial demand profile of the
+                new unit, used to re-rank candidates
+            exclude (str, optional): Unit ID to leave out (the unit itself)
+
+        Returns:
+            list: Dicts with business_unit_id, weight (summing to 1) and
+                scale (capacity ratio)
+        """
+        if self.tree is None:
+            return []
+
+        n_candidates = min(len(self), k * 3 + 1)
+        point = ((unit_descriptor(business_unit) - self.mean) / self.std)[np.newaxis, :]
+        distances, positions = self.tree.query(point, k=n_candidates)
+        distances, positions = distances[0], positions[0]
+
+        keep = np.array([self.unit_ids[i] != exclude for i in positions], dtype=bool)
+        distances, positions = distances[keep], positions[keep]
+
+        if profile is not None:
+            # Blend descriptor distance with demand profile distance
+            candidate_profiles = [self.profiles.get(self.unit_ids[i]) for i in positions]
+            profile_distances = np.array([
+                np.abs(candidate - profile).sum() if candidate is not None else 1.0
+                for candidate in candidate_profiles
+            ])
+            distances = distances + profile_distances * np.sqrt(point.shape[1])
+
+        order = np.argsort(distances, kind='stable')[:k]
+        distances, positions = distances[order], positions[order]
+        weights = 1.0 / (distances + 1e-6)
+        weights /= weights.sum()
+        capacity = unit_capacity(business_unit)
+
+        return [
+            {
+                'business_unit_id': self.unit_ids[position],
+                'weight': float(weight),
+                'scale': float(capacity / self.capacities[position]) if self.capacities[position] > 0 else 1.0
+            }
+            for position, weight in zip(positions, weights)
+        ]
+
+    def save(self, path):
+        """Save the index to a file"""
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path):
+        """Load an index from a file"""
+        return joblib.load(path)
+
+
+def blend_forecasts(neighbor_forecasts):
+    """
+    Combine neighbor forecasts into a cold-start forecast.
+
+    Args:
+        neighbor_forecasts (list): (neighbor dict from query, forecast
+            DataFrame from MealForecastModel.predict) pairs
+
+    Returns:
+        pandas.DataFrame: Forecast in the MealForecastModel.predict format
+    """
+    first = neighbor_forecasts[0][1]
+    results = first[['date', 'meal_type']].copy()
+    for column in ('predicted_meals', 'lower_bound', 'upper_bound', 'confidence'):
+        blended = np.zeros(len(first))
+        for neighbor, forecast in neighbor_forecasts:
+            scale = neighbor['scale'] if column != 'confidence' else 1.0
+            blended += neighbor['weight'] * scale * forecast[column].to_numpy(dtype=float)
+        results[column] = blended if column == 'confidence' else np.round(blended).astype(int)
+    return results
+
+
+def main():
+    """
+    Main function for command-line usage.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Business Unit Similarity Index')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the database')
+    args = parser.parse_args()
+
+    configure_logging()
+
+    if args.rebuild:
+        from api import rebuild_unit_index
+        index = rebuild_unit_index()
+        print(f"Unit similarity index rebuilt with {len(index)} business units")
+
+
+if __name__ == "__main__":
+    main()
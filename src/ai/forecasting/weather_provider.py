@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Weather Feature Provider for Kanteeno Forecasting
+
+This module supplies daily temperatures for forecast frames. Providers fetch
+whole date ranges per location, and CachedWeatherProvider keeps a persistent
+per-location cache so business units sharing a region share one lookup.
+"""
+
+import os
+import re
+import threading
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("weather_provider")
+
+# Temperature used when no observation or forecast is available
+DEFAULT_TEMPERATURE = 20.0
+
+WEATHER_COLUMNS = ['date', 'temperature']
+
+
+def to_day(value):
+    """Convert a date or datetime to a timezone-naive midnight Timestamp"""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_localize(None)
+    return timestamp.normalize()
+
+
+def to_days(values):
+    """Convert a column of dates to timezone-naive midnight Timestamps"""
+    values = pd.to_datetime(values)
+    if values.dt.tz is not None:
+        values = values.dt.tz_localize(None)
+    return values.dt.normalize()
+
+
+def location_key(address):
+    """
+    Build a normalized location key from a business unit address.
+
+    Args:
+        address (dict): Address with city and country
+
+    Returns:
+        str: Location key shared by units in the same city
+    """
+    if not address:
+        return 'default'
+    parts = [address.get('city') or '', address.get('country') or '']
+    key = '-'.join(part.strip().lower() for part in parts if part and part.strip())
+    return re.sub(r'[^\w-]+', '_', key) or 'default'
+
+
+class WeatherProvider:
+    """
+    Interface for weather data sources.
+
+    Implementations return one row per day for a whole date range, so callers
+    never have to request days one at a time.
+    """
+
+    def fetch(self, location, start_date, end_date):
+        """
+        Fetch daily weather for a location.
+
+        Args:
+            location (str): Location key
+            start_date (datetime): First day of the range
+            end_date (datetime): Last day of the range
+
+        Returns:
+            pandas.DataFrame: Columns date and temperature, one row per day
+        """
+        raise NotImplementedError
+
+
+class LocalWeatherProvider(WeatherProvider):
+    """
+    File-backed weather provider for tests and offline runs.
+
+    Reads a CSV file with location, date and temperature columns. Days missing
+    from the file are returned with a NaN temperature.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the provider.
+
+        Args:
+            path (str): Path to the weather CSV file
+        """
+        self.path = path
+        if os.path.exists(path):
+            data = pd.read_csv(path, parse_dates=['date'])
+            data['date'] = data['date'].dt.normalize()
+            self.data = {location: group[WEATHER_COLUMNS].set_index('date')['temperature']
+                         for location, group in data.groupby('location')}
+            logger.info("Loaded weather for %d locations from %s", len(self.data), path)
+        else:
+            self.data = {}
+            logger.warning("Weather file %s not found, temperatures will be missing", path)
+
+    def fetch(self, location, start_date, end_date):
+        dates = pd.date_range(to_day(start_date), to_day(end_date))
+        series = self.data.get(location)
+        temperature = series.reindex(dates).to_numpy() if series is not None else np.full(len(dates), np.nan)
+        return pd.DataFrame({'date': dates, 'temperature': temperature})
+
+
+class CachedWeatherProvider(WeatherProvider):
+    """
+    Persistent per-location cache in front of another provider.
+
+    Past days are final once fetched; days from yesterday onwards are
+    forecasts and, like days the source had no value for, are refetched
+    when older than forecast_ttl. Missing or
+    stale days in a request are fetched with a single range call.
+    """
+
+    def __init__(self, provider, cache_dir, forecast_ttl=timedelta(hours=6)):
+        """
+        Initialize the cache.
+
+        Args:
+            provider (WeatherProvider): Underlying weather source
+            cache_dir (str): Directory for per-location cache files
+            forecast_ttl (timedelta): Maximum age of cached forecast days
+        """
+        self.provider = provider
+        self.cache_dir = cache_dir
+        self.forecast_ttl = forecast_ttl
+        self._frames = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, location):
+        """Get path to the cache file for a location"""
+        return os.path.join(self.cache_dir, f"weather_{location}.csv")
+
+    def _location_lock(self, location):
+        """Get the lock serializing fetches for a location"""
+        with self._lock:
+            return self._locks.setdefault(location, threading.Lock())
+
+    def _load(self, location):
+        """Load the cached frame for a location (memory first, then disk)"""
+        frame = self._frames.get(location)
+        if frame is None:
+            path = self._cache_path(location)
+            if os.path.exists(path):
+                frame = pd.read_csv(path, parse_dates=['date', 'fetched_at']).set_index('date')
+            else:
+                frame = pd.DataFrame(columns=['temperature', 'fetched_at'],
+                                     index=pd.DatetimeIndex([], name='date'))
+            self._frames[location] = frame
+        return frame
+
+    def _stale(self, frame, dates, now):
+        """Get a mask of requested dates that need fetching"""
+        cached = frame.reindex(dates)
+        fetched_at = pd.to_datetime(cached['fetched_at'])
+        never_fetched = fetched_at.isna().to_numpy()
+        # Forecast days and days the source had no value for can still change
+        changeable = (dates >= (to_day(now) - pd.Timedelta(days=1))) | cached['temperature'].isna().to_numpy()
+        expired = ((pd.Timestamp(now) - fetched_at) > pd.Timedelta(self.forecast_ttl)).to_numpy()
+        return never_fetched | (changeable & expired)
+
+    def fetch(self, location, start_date, end_date):
+        dates = pd.date_range(to_day(start_date), to_day(end_date))
+        now = datetime.now()
+
+        with self._location_lock(location):
+            frame = self._load(location)
+            stale = self._stale(frame, dates, now)
+
+            if stale.any():
+                # One bulk request covering every stale day in the range
+                fetch_dates = dates[stale]
+                fetched = self.provider.fetch(location, fetch_dates.min(), fetch_dates.max())
+                fetched = fetched.set_index(to_days(fetched['date']))
+                fetched = fetched[['temperature']]
+                fetched['fetched_at'] = pd.Timestamp(now)
+
+                frame = pd.concat([frame[~frame.index.isin(fetched.index)], fetched]).sort_index()
+                frame.index.name = 'date'
+                self._frames[location] = frame
+                frame.reset_index().to_csv(self._cache_path(location), index=False)
+                logger.info("Fetched %d days of weather for %s", len(fetched), location)
+
+        return pd.DataFrame({'date': dates, 'temperature': frame['temperature'].reindex(dates).to_numpy(dtype=float)})
+
+    def fetch_many(self, locations, start_date, end_date):
+        """
+        Fetch one date range for many locations, once per distinct location.
+
+        Args:
+            locations (iterable): Location keys (duplicates are fetched once)
+            start_date (datetime): First day of the range
+            end_date (datetime): Last day of the range
+
+        Returns:
+            dict: Location key to weather DataFrame
+        """
+        return {location: self.fetch(location, start_date, end_date) for location in set(locations)}
+
+
+def merge_weather(df, weather):
+    """
+    Set the temperature column of a forecast frame from weather data.
+
+    Args:
+        df (pandas.DataFrame): Forecast frame with a 'date' column
+        weather (pandas.DataFrame): Columns date and temperature
+
+    Returns:
+        pandas.DataFrame: Frame with temperature filled in
+    """
+    temperatures = weather.set_index(to_days(weather['date']))['temperature']
+    df['temperature'] = (to_days(df['date'])
+                         .map(temperatures)
+                         .fillna(DEFAULT_TEMPERATURE)
+                         .to_numpy(dtype=float))
+    return df
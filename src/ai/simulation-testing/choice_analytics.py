@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Single-Pass Choice Analytics
+
+This module computes the metrics of analyze_results with one pass over the
+choice records. ChoiceAnalytics keeps running totals, bincounts over the
+integer columns of each ChoiceStore, of:
+- Records and attendances per user, which also give the profile attendance
+- Records and attendances per weekday and month
+- Choices per catalog meal, which give the meal, category and ingredient
+  statistics without looking at the records again
+
+Stores can be added while the simulation runs (see observe), so the
+analysis is ready when the last block of days has been simulated and the
+records do not have to be kept in memory. They can also be removed again,
+which lets incremental_simulation patch the analysis of re-simulated days.
+"""
+
+import datetime
+import numpy as np
+from typing import List, Dict, Any, Iterable, Iterator
+from choice_store import ChoiceStore, meal_details
+
+# Display name of each meal category
+CATEGORY_NAMES = {
+    1: "Vegetarian",
+    2: "Organic with meat",
+    3: "Quick"
+}
+
+
+class ChoiceAnalytics:
+    """
+    Online accumulator of the analyze_results metrics.
+    """
+
+    def __init__(self, users: List[Dict[str, Any]], meals: List[Dict[str, Any]]):
+        """
+        Initialize empty totals.
+
+        Args:
+            users: Simulated users (with id and profile)
+            meals: Meal catalog the choice stores refer to
+        """
+        self.users = users
+        self.meals = meals
+        self._user_positions = {user["id"]: position for position, user in enumerate(users)}
+
+        self.records = 0
+        self.user_records = np.zeros(len(users), dtype=np.int64)
+        self.user_visits = np.zeros(len(users), dtype=np.int64)
+        self.weekday_records = np.zeros(7, dtype=np.int64)
+        self.weekday_visits = np.zeros(7, dtype=np.int64)
+        self.month_records = np.zeros(13, dtype=np.int64)
+        self.month_visits = np.zeros(13, dtype=np.int64)
+        self.meal_counts = np.zeros(len(meals), dtype=np.int64)
+        self.date_records = {}
+
+    def update(self, store: ChoiceStore):
+        """Add the records of a store to the totals."""
+        self._add(store, 1)
+
+    def remove(self, store: ChoiceStore):
+        """Subtract the records of a previously added store from the totals."""
+        self._add(store, -1)
+
+    def _add(self, store: ChoiceStore, sign: int):
+        """Add (sign 1) or subtract (sign -1) the records of a store."""
+        if not len(store):
+            return
+        attended = store.attended
+
+        # Per user (store positions mapped to positions in users)
+        user_map = np.array([self._user_positions[user_id] for user_id in store.user_ids], dtype=np.int64)
+        users = user_map[store.user_index]
+        self.user_records += sign * np.bincount(users, minlength=len(self.users))
+        self.user_visits += sign * np.bincount(users[attended], minlength=len(self.users))
+
+        # Per day, then per weekday and month
+        day_records = np.bincount(store.day_index, minlength=len(store.dates))
+        day_visits = np.bincount(store.day_index[attended], minlength=len(store.dates))
+        day_dates = [datetime.datetime.strptime(date, "%Y-%m-%d").date() for date in store.dates]
+        weekdays = np.array([date.weekday() for date in day_dates], dtype=int)
+        months = np.array([date.month for date in day_dates], dtype=int)
+        np.add.at(self.weekday_records, weekdays, sign * day_records)
+        np.add.at(self.weekday_visits, weekdays, sign * day_visits)
+        np.add.at(self.month_records, months, sign * day_records)
+        np.add.at(self.month_visits, months, sign * day_visits)
+        for date, count in zip(store.dates, day_records.tolist()):
+            self.date_records[date] = self.date_records.get(date, 0) + sign * count
+
+        self.meal_counts += sign * store.meal_counts()
+        self.records += sign * len(store)
+
+    def observe(self, stores: Iterable[ChoiceStore]) -> Iterator[ChoiceStore]:
+        """Pass stores through while adding them (e.g. on their way to a writer)."""
+        for store in stores:
+            self.update(store)
+            yield store
+
+    def _profile_attendance(self) -> Dict[str, Dict[str, Any]]:
+        """Attendance per user profile, in the order of their first user."""
+        profile_attendance = {}
+        for position in np.flatnonzero(self.user_records):
+            profile = self.users[position]["profile"]
+            data = profile_attendance.setdefault(profile, {"count": 0, "total": 0})
+            data["count"] += int(self.user_visits[position])
+            data["total"] += int(self.user_records[position])
+
+        for data in profile_attendance.values():
+            data["rate"] = data["count"] / data["total"] if data["total"] > 0 else 0
+        return profile_attendance
+
+    def _ingredient_stats(self) -> Dict[str, Any]:
+        """Ingredient statistics of the chosen meals, weighted by choice counts."""
+        detailed_meals = []
+        for position in np.flatnonzero(self.meal_counts):
+            details = meal_details(self.meals[position])
+            if details is not None:
+                detailed_meals.append((int(self.meal_counts[position]), details))
+        detailed_count = sum(count for count, _ in detailed_meals)
+        if not detailed_count:
+            return {}
+
+        origin_counts = {}
+        allergen_counts = {}
+        for count, details in detailed_meals:
+            for origin in details["ingredientStats"]["origins"]:
+                origin_counts[str(origin)] = origin_counts.get(str(origin), 0) + count
+            for allergen in details["ingredientStats"]["allergens"]:
+                allergen_counts[str(allergen)] = allergen_counts.get(str(allergen), 0) + count
+
+        return {
+            "organicPercentageAvg": float(sum(count * details["ingredientStats"]["organicPercentage"] for count, details in detailed_meals) / detailed_count),
+            "co2FootprintAvg": float(sum(count * details["co2Footprint"] for count, details in detailed_meals) / detailed_count),
+            "priceAvg": float(sum(count * details["price"] for count, details in detailed_meals) / detailed_count),
+            "originCounts": origin_counts,
+            "allergenCounts": allergen_counts
+        }
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Get the analysis of all records added so far.
+
+        Returns:
+            JSON-serializable dict with the same structure as analyze_results
+        """
+        total_days = sum(1 for count in self.date_records.values() if count)
+        total_users = int(np.count_nonzero(self.user_records))
+        total_possible_visits = total_days * total_users
+        total_actual_visits = int(self.meal_counts.sum())
+
+        def percentage(count):
+            return count / total_actual_visits * 100 if total_actual_visits else 0.0
+
+        # Meals by descending popularity
+        meal_popularity = {}
+        for position in np.argsort(-self.meal_counts, kind="stable"):
+            count = int(self.meal_counts[position])
+            if not count:
+                break
+            meal = self.meals[position]
+            meal_popularity[str(meal["id"])] = {
+                "count": count,
+                "percentage": float(percentage(count)),
+                "name": str(meal["name"]),
+                "category": int(meal["categoryId"])
+            }
+
+        category_counts = dict.fromkeys(CATEGORY_NAMES, 0)
+        for data in meal_popularity.values():
+            category_counts[data["category"]] += data["count"]
+
+        return {
+            "summary": {
+                "total_days": total_days,
+                "total_users": total_users,
+                "total_possible_visits": total_possible_visits,
+                "total_actual_visits": total_actual_visits,
+                "overall_attendance_rate": float(total_actual_visits / total_possible_visits) if total_possible_visits else 0.0
+            },
+            "meal_popularity": meal_popularity,
+            "category_popularity": {
+                str(category): {
+                    "count": count,
+                    "percentage": float(percentage(count)),
+                    "name": CATEGORY_NAMES[category]
+                }
+                for category, count in category_counts.items()
+            },
+            "weekday_attendance": {
+                str(weekday): float(self.weekday_visits[weekday] / self.weekday_records[weekday])
+                for weekday in np.flatnonzero(self.weekday_records)
+            },
+            "month_attendance": {
+                str(month): float(self.month_visits[month] / self.month_records[month])
+                for month in np.flatnonzero(self.month_records)
+            },
+            "profile_attendance": self._profile_attendance(),
+            "ingredient_stats": self._ingredient_stats()
+        }
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Columnar Choice Store
+
+This module keeps simulated choices as a struct of arrays instead of one
+dict per decision: every record is a user index, a day index and a meal
+position (-1 when the user did not attend). Users, dates and meals are
+stored once and referenced by index, and meal details are resolved from
+the meal catalog only when they are needed, so large populations fit in
+a fraction of the memory of the userChoices dicts.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any, Iterator
+
+
+def meal_details(meal: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarize a meal for the mealDetails of a choice record (None without ingredients)."""
+    if "ingredients" not in meal:
+        return None
+
+    # Calculate nutritional totals
+    total_calories = meal.get("nutritionalInfo", {}).get("calories", 0)
+    total_protein = meal.get("nutritionalInfo", {}).get("protein", 0)
+    total_carbs = meal.get("nutritionalInfo", {}).get("carbs", 0)
+    total_fat = meal.get("nutritionalInfo", {}).get("fat", 0)
+
+    # Calculate ingredient statistics
+    organic_count = sum(1 for ing in meal["ingredients"] if ing.get("isOrganic", False))
+    organic_percentage = organic_count / len(meal["ingredients"]) * 100
+
+    # Get unique allergens
+    all_allergens = []
+    for ing in meal["ingredients"]:
+        all_allergens.extend(ing.get("allergens", []))
+    unique_allergens = list(set(all_allergens))
+
+    # Get unique origins
+    origins = [ing.get("origin", "Unknown") for ing in meal["ingredients"]]
+    unique_origins = list(set(origins))
+
+    return {
+        "name": meal["name"],
+        "category": meal["categoryId"],
+        "price": meal.get("price", 0),
+        "co2Footprint": meal.get("co2Footprint", 0),
+        "nutritionalInfo": {
+            "calories": total_calories,
+            "protein": total_protein,
+            "carbs": total_carbs,
+            "fat": total_fat
+        },
+        "ingredientStats": {
+            "totalCount": len(meal["ingredients"]),
+            "organicCount": organic_count,
+            "organicPercentage": organic_percentage,
+            "allergens": unique_allergens,
+            "origins": unique_origins
+        }
+    }
+
+
+class ChoiceStore:
+    """
+    Simulated choice records as compact integer columns.
+    """
+
+    def __init__(self, user_index: np.ndarray, day_index: np.ndarray, meal_index: np.ndarray,
+                 user_ids: List[Any], dates: List[str], meals: List[Dict[str, Any]]):
+        """
+        Initialize the store.
+
+        Args:
+            user_index: Position in user_ids of every record
+            day_index: Position in dates of every record
+            meal_index: Position in meals of the chosen meal (-1 if not attended)
+            user_ids: IDs of the simulated users
+            dates: Simulated dates (YYYY-MM-DD)
+            meals: Meal catalog the meal positions refer to
+        """
+        self.user_index = np.asarray(user_index, dtype=np.int32)
+        self.day_index = np.asarray(day_index, dtype=np.int16)
+        self.meal_index = np.asarray(meal_index, dtype=np.int32)
+        self.user_ids = list(user_ids)
+        self.dates = list(dates)
+        self.meals = meals
+        self._details = {}
+
+    def __len__(self) -> int:
+        return len(self.user_index)
+
+    @property
+    def attended(self) -> np.ndarray:
+        """Whether each record is an attendance"""
+        return self.meal_index >= 0
+
+    @classmethod
+    def from_outcomes(cls, outcomes: np.ndarray, user_ids: List[Any], dates: List[str],
+                      meals: List[Dict[str, Any]]) -> "ChoiceStore":
+        """
+        Build a store from a users × days outcome matrix.
+
+        Outcomes are meal positions, -1 for non-attendance or -2 for no
+        record (see vectorized_engine.sample_choices). Records are ordered
+        by day, then user, like simulate_user_choices.
+        """
+        day_index, user_index = np.nonzero(outcomes.T != -2)
+        return cls(user_index, day_index, outcomes[user_index, day_index], user_ids, dates, meals)
+
+    @classmethod
+    def from_records(cls, user_choices: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                     user_ids: List[Any] = None) -> "ChoiceStore":
+        """
+        Build a store from userChoices dicts.
+
+        user_ids fixes the user order (e.g. the simulated users, so stores of
+        different runs can be joined); by default users are ordered by their
+        first record.
+        """
+        user_positions = {user_id: position for position, user_id in enumerate(user_ids or [])}
+        day_positions = {}
+        meal_positions = {meal["id"]: position for position, meal in enumerate(meals)}
+
+        user_index = np.empty(len(user_choices), dtype=np.int32)
+        day_index = np.empty(len(user_choices), dtype=np.int16)
+        meal_index = np.empty(len(user_choices), dtype=np.int32)
+        for row, choice in enumerate(user_choices):
+            user_index[row] = user_positions.setdefault(choice["userId"], len(user_positions))
+            day_index[row] = day_positions.setdefault(choice["date"], len(day_positions))
+            meal_index[row] = meal_positions[choice["mealId"]] if choice["attended"] else -1
+
+        return cls(user_index, day_index, meal_index, list(user_positions), list(day_positions), meals)
+
+    @classmethod
+    def concat(cls, stores: List["ChoiceStore"]) -> "ChoiceStore":
+        """
+        Join stores of consecutive days (same users and meal catalog).
+        """
+        offsets = np.cumsum([0] + [len(store.dates) for store in stores[:-1]])
+        return cls(
+            np.concatenate([store.user_index for store in stores]),
+            np.concatenate([store.day_index.astype(np.int32) + offset for store, offset in zip(stores, offsets)]),
+            np.concatenate([store.meal_index for store in stores]),
+            stores[0].user_ids,
+            [date for store in stores for date in store.dates],
+            stores[0].meals
+        )
+
+    def split_days(self) -> Dict[str, "ChoiceStore"]:
+        """Split the store into one store per date (records ordered by day)."""
+        bounds = np.searchsorted(self.day_index, np.arange(len(self.dates) + 1))
+        return {
+            date: ChoiceStore(self.user_index[start:end], np.zeros(end - start, dtype=np.int16),
+                              self.meal_index[start:end], self.user_ids, [date], self.meals)
+            for date, start, end in zip(self.dates, bounds[:-1], bounds[1:])
+        }
+
+    def with_meals(self, meals: List[Dict[str, Any]]) -> "ChoiceStore":
+        """Get the same records referring to an updated meal catalog (same meal positions)."""
+        return ChoiceStore(self.user_index, self.day_index, self.meal_index, self.user_ids, self.dates, meals)
+
+    def meal_details(self, position: int) -> Dict[str, Any]:
+        """Get the mealDetails of the meal at a catalog position (cached)."""
+        if position not in self._details:
+            self._details[position] = meal_details(self.meals[position])
+        return self._details[position]
+
+    def meal_counts(self) -> np.ndarray:
+        """Number of times each catalog meal was chosen"""
+        return np.bincount(self.meal_index[self.attended], minlength=len(self.meals))
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Get the records as a DataFrame with userId, date, attended and mealId.
+
+        mealId is a nullable integer column (missing for non-attendance).
+        """
+        meal_ids = np.array([meal["id"] for meal in self.meals] + [0])
+        attended = self.attended
+        return pd.DataFrame({
+            "userId": np.asarray(self.user_ids)[self.user_index],
+            "date": np.asarray(self.dates, dtype=object)[self.day_index],
+            "attended": attended,
+            "mealId": pd.Series(meal_ids[self.meal_index], dtype="Int64").mask(~attended)
+        })
+
+    def records(self, details: bool = True) -> Iterator[Dict[str, Any]]:
+        """Yield the records as userChoices dicts (with mealDetails for attendances if details)."""
+        meal_ids = [meal["id"] for meal in self.meals]
+        for user, day, meal in zip(self.user_index.tolist(), self.day_index.tolist(), self.meal_index.tolist()):
+            if meal < 0:
+                yield {"userId": self.user_ids[user], "date": self.dates[day], "attended": False, "mealId": None}
+                continue
+            choice_data = {"userId": self.user_ids[user], "date": self.dates[day], "attended": True, "mealId": meal_ids[meal]}
+            meal_summary = self.meal_details(meal) if details else None
+            if meal_summary is not None:
+                choice_data["mealDetails"] = meal_summary
+            yield choice_data
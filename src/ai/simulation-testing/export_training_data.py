@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Export Training Data Script
+
+This script turns simulated canteen attendance into training rows for the
+meal forecasting model (MealForecastModel). Each row is one business unit,
+day and meal type with the columns the forecaster expects:
+- date, meal_type, actual_meals
+- temperature, is_holiday, is_special_event
+- previous_week_avg, previous_day, registered_guests
+
+It can convert the choices of an existing simulation run (the userChoices
+of simulation_results.json or a streamed simulation_choices.ndjson or
+.parquet file), or generate
+multi-year data for thousands of synthetic business units with the attendance
+model of simulate_user_choices. Units are generated and written in chunks, so
+memory stays bounded however many units are exported.
+
+Usage:
+python export_training_data.py --units=2000 --years=3 --output=training_data.parquet
+python export_training_data.py --from-results=simulation_results.json --output=training_data.csv
+python export_training_data.py --from-results=simulation_choices.parquet --output=training_data.csv
+"""
+
+import json
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any, Iterator, Union
+from choice_store import ChoiceStore
+from result_writers import OUTPUT_FORMATS, read_choices
+from simulate_user_choices import (
+    USER_PROFILES, WEEKDAY_MODIFIERS, SEASONAL_MODIFIERS, SPECIAL_EVENTS, YEAR
+)
+
+# Columns of the exported training rows, in output order
+TRAINING_COLUMNS = [
+    "business_unit_id", "date", "meal_type", "actual_meals", "temperature",
+    "is_holiday", "is_special_event", "previous_week_avg", "previous_day", "registered_guests"
+]
+
+# The simulation covers lunch service only
+MEAL_TYPE = "lunch"
+
+# Served days averaged for previous_week_avg (one working week)
+LAG_WINDOW = 5
+
+# Daily mean temperature in Denmark: annual mean, seasonal amplitude and
+# day-to-day noise (°C), with the coldest day around mid-January
+TEMPERATURE_MEAN = 8.5
+TEMPERATURE_AMPLITUDE = 8.0
+TEMPERATURE_NOISE = 3.0
+
+# Range of registered app users per synthetic business unit
+DEFAULT_USERS_RANGE = (50, 600)
+
+# Business units generated and written per chunk
+DEFAULT_CHUNK_UNITS = 100
+
+
+def event_calendar(dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Map SPECIAL_EVENTS onto a date range, repeating them every year.
+
+    Events recorded with a reduced attendance modifier are public holidays
+    (Labor Day, Constitution Day) and are flagged as is_holiday.
+
+    Returns:
+        DataFrame indexed like dates with attendance_mod, is_holiday and is_special_event
+    """
+    calendar = pd.DataFrame({
+        "attendance_mod": 1.0,
+        "is_holiday": 0,
+        "is_special_event": 0
+    }, index=dates)
+    month_days = dates.strftime("%m-%d")
+
+    for event in SPECIAL_EVENTS:
+        on_event = month_days == event["date"][5:]
+        calendar.loc[on_event, "attendance_mod"] = event["attendance_mod"]
+        if event["attendance_mod"] < 1.0:
+            calendar.loc[on_event, "is_holiday"] = 1
+        else:
+            calendar.loc[on_event, "is_special_event"] = 1
+
+    return calendar
+
+
+def synthetic_temperature(dates: pd.DatetimeIndex, rng: np.random.Generator) -> np.ndarray:
+    """Generate daily mean temperatures following the Danish seasonal cycle."""
+    day_of_year = dates.dayofyear.to_numpy()
+    seasonal = TEMPERATURE_MEAN - TEMPERATURE_AMPLITUDE * np.cos(2 * np.pi * (day_of_year - 15) / 365.25)
+    return np.round(seasonal + rng.normal(0, TEMPERATURE_NOISE, len(dates)), 1)
+
+
+def sample_attendance_parameters(num_users: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """
+    Draw per-user attendance parameters as arrays.
+
+    Uses the same distributions as generate_users: a random profile, its
+    attendance rate ±0.1 clipped to [0.1, 1] and a weekday preference
+    between 0.7 and 1.3 for each working day.
+
+    Returns:
+        Dict with attendance_rate (users,) and weekday_preferences (users, 5)
+    """
+    base_rates = np.array([profile["attendance_rate"] for profile in USER_PROFILES])
+    profiles = rng.integers(0, len(USER_PROFILES), num_users)
+    return {
+        "attendance_rate": np.clip(base_rates[profiles] + rng.uniform(-0.1, 0.1, num_users), 0.1, 1.0),
+        "weekday_preferences": rng.uniform(0.7, 1.3, (num_users, 5))
+    }
+
+
+def simulate_unit_attendance(num_users: int, dates: pd.DatetimeIndex, calendar: pd.DataFrame,
+                             rng: np.random.Generator) -> np.ndarray:
+    """
+    Simulate the daily number of attending users of one business unit.
+
+    Attendance probabilities follow simulate_user_choices (user rate ×
+    weekday × season × event, capped at 1). Meal choice is not simulated,
+    so users whose allergies exclude every meal of a day still count.
+
+    Args:
+        num_users: Number of registered users
+        dates: Working days to simulate
+        calendar: Event calendar for dates (see event_calendar)
+        rng: Random generator
+
+    Returns:
+        Attending users per date
+    """
+    users = sample_attendance_parameters(num_users, rng)
+    weekdays = dates.weekday.to_numpy()
+    day_modifier = (
+        np.array([WEEKDAY_MODIFIERS[weekday] for weekday in weekdays])
+        * np.array([SEASONAL_MODIFIERS[month] for month in dates.month])
+        * calendar["attendance_mod"].to_numpy()
+    )
+
+    probabilities = np.minimum(
+        1.0,
+        users["attendance_rate"][:, np.newaxis] * users["weekday_preferences"][:, weekdays] * day_modifier
+    )
+    return (rng.random(probabilities.shape) < probabilities).sum(axis=0)
+
+
+def add_lag_features(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add previous_day and previous_week_avg per business unit and meal type.
+
+    Lags run over served days, so Monday's previous_day is the Friday before.
+    The first row of each series has no history and is left empty (the
+    forecaster fills missing lags with the column mean).
+    """
+    frame = frame.sort_values(["business_unit_id", "meal_type", "date"])
+    previous = frame.groupby(["business_unit_id", "meal_type"])["actual_meals"].shift(1)
+    frame["previous_day"] = previous
+    frame["previous_week_avg"] = previous.groupby(
+        [frame["business_unit_id"], frame["meal_type"]]
+    ).transform(lambda series: series.rolling(LAG_WINDOW, min_periods=1).mean()).round(1)
+    return frame
+
+
+def aggregate_choices(user_choices: Union[ChoiceStore, pd.DataFrame, List[Dict[str, Any]]],
+                      business_unit_id: str = "simulated", seed: int = 42) -> pd.DataFrame:
+    """
+    Convert the choices of a simulation run into training rows.
+
+    Args:
+        user_choices: ChoiceStore, choice frame (see read_choices) or
+            userChoices records of a run
+        business_unit_id: ID written to every row
+        seed: Seed for the synthetic temperatures
+
+    Returns:
+        Training rows with TRAINING_COLUMNS
+    """
+    if isinstance(user_choices, ChoiceStore):
+        actual_meals = np.bincount(user_choices.day_index, weights=user_choices.attended,
+                                   minlength=len(user_choices.dates))
+        dates, registered_guests = user_choices.dates, len(user_choices.user_ids)
+    else:
+        choices = pd.DataFrame(user_choices, columns=["userId", "date", "attended"])
+        daily = choices.groupby("date")["attended"].sum()
+        actual_meals, dates, registered_guests = daily.to_numpy(), daily.index, choices["userId"].nunique()
+
+    order = np.argsort(np.asarray(dates))
+    dates = pd.DatetimeIndex(pd.to_datetime(np.asarray(dates)[order]))
+    actual_meals = np.asarray(actual_meals)[order]
+    calendar = event_calendar(dates)
+
+    frame = pd.DataFrame({
+        "business_unit_id": business_unit_id,
+        "date": dates,
+        "meal_type": MEAL_TYPE,
+        "actual_meals": actual_meals.astype(int),
+        "temperature": synthetic_temperature(dates, np.random.default_rng(seed)),
+        "is_holiday": calendar["is_holiday"].to_numpy(),
+        "is_special_event": calendar["is_special_event"].to_numpy(),
+        "registered_guests": registered_guests
+    })
+    return add_lag_features(frame)[TRAINING_COLUMNS]
+
+
+def generate_unit_chunks(num_units: int, years: int, start_year: int = YEAR,
+                         users_range: tuple = DEFAULT_USERS_RANGE, chunk_units: int = DEFAULT_CHUNK_UNITS,
+                         seed: int = 42) -> Iterator[pd.DataFrame]:
+    """
+    Generate training rows for synthetic business units, one chunk at a time.
+
+    Every unit gets its own generator spawned from seed, so a unit's rows do
+    not depend on the chunk size.
+
+    Args:
+        num_units: Number of business units
+        years: Number of consecutive years per unit
+        start_year: First simulated year
+        users_range: Smallest and largest number of registered users per unit
+        chunk_units: Units per yielded chunk
+        seed: Root seed
+
+    Yields:
+        Training rows with TRAINING_COLUMNS for up to chunk_units units
+    """
+    dates = pd.bdate_range(f"{start_year}-01-01", f"{start_year + years - 1}-12-31")
+    calendar = event_calendar(dates)
+    unit_seeds = np.random.SeedSequence(seed).spawn(num_units)
+
+    for chunk_start in range(0, num_units, chunk_units):
+        frames = []
+        for unit in range(chunk_start, min(chunk_start + chunk_units, num_units)):
+            rng = np.random.default_rng(unit_seeds[unit])
+            num_users = int(rng.integers(users_range[0], users_range[1] + 1))
+            frames.append(pd.DataFrame({
+                "business_unit_id": f"sim-{unit:06d}",
+                "date": dates,
+                "meal_type": MEAL_TYPE,
+                "actual_meals": simulate_unit_attendance(num_users, dates, calendar, rng),
+                "temperature": synthetic_temperature(dates, rng),
+                "is_holiday": calendar["is_holiday"].to_numpy(),
+                "is_special_event": calendar["is_special_event"].to_numpy(),
+                "registered_guests": num_users
+            }))
+        yield add_lag_features(pd.concat(frames, ignore_index=True))[TRAINING_COLUMNS]
+
+
+def write_chunks(chunks: Iterator[pd.DataFrame], output_path: str) -> int:
+    """
+    Write training row chunks to a single CSV or Parquet file.
+
+    The format follows the file extension (.parquet or .csv). Parquet output
+    needs pyarrow and stores every chunk as a row group.
+
+    Returns:
+        Number of rows written
+    """
+    parquet = output_path.endswith(".parquet")
+    writer = None
+    rows = 0
+
+    if parquet:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+    try:
+        for chunk in chunks:
+            if parquet:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(output_path, mode="w" if rows == 0 else "a", header=rows == 0,
+                             index=False, date_format="%Y-%m-%d")
+            rows += len(chunk)
+            print(f"  {rows:,} rows written")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows
+
+
+def main():
+    """Main function to export forecasting training data."""
+    parser = argparse.ArgumentParser(description='Export simulated attendance as forecast training data')
+    parser.add_argument('--output', type=str, default='training_data.csv', help='Output file (.csv or .parquet)')
+    parser.add_argument('--from-results', type=str,
+                        help='Convert a simulation_results.json or simulation_choices.ndjson/.parquet')
+    parser.add_argument('--units', type=int, default=1000, help='Number of synthetic business units')
+    parser.add_argument('--years', type=int, default=3, help='Years of data per business unit')
+    parser.add_argument('--start-year', type=int, default=YEAR, help='First simulated year')
+    parser.add_argument('--min-users', type=int, default=DEFAULT_USERS_RANGE[0], help='Fewest users per unit')
+    parser.add_argument('--max-users', type=int, default=DEFAULT_USERS_RANGE[1], help='Most users per unit')
+    parser.add_argument('--chunk-units', type=int, default=DEFAULT_CHUNK_UNITS, help='Business units per chunk')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    args = parser.parse_args()
+
+    if args.from_results:
+        if args.from_results.endswith(tuple(OUTPUT_FORMATS.values())):
+            user_choices = read_choices(args.from_results, ["userId", "date", "attended"])
+        else:
+            with open(args.from_results, 'r') as f:
+                user_choices = json.load(f)["userChoices"]
+        chunks = iter([aggregate_choices(user_choices, seed=args.seed)])
+        print(f"Converting {len(user_choices):,} user choice records from {args.from_results}")
+    else:
+        chunks = generate_unit_chunks(args.units, args.years, args.start_year,
+                                      (args.min_users, args.max_users), args.chunk_units, args.seed)
+        print(f"Generating {args.years} years of data for {args.units:,} business units")
+
+    rows = write_chunks(chunks, args.output)
+    print(f"Training data with {rows:,} rows saved to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
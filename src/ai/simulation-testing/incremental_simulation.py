@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Incremental Simulation
+
+This module keeps the simulated choices of every day between runs and only
+re-simulates the days whose inputs changed, e.g. after an admin edits one
+day's menu or one meal in meal_data.json.
+
+Because every user and day draws from its own random stream (see
+rng_streams), the choices of a day depend only on:
+- The day's date, menu and the meals on it
+- The weekday, seasonal and special event modifiers of the date
+- The population (users) and the seed and engine of the simulation
+
+Each cached day is keyed by a hash of the first two; a different population,
+seed, engine or set of meal IDs starts a new cache. The analysis is patched
+by removing the old choices of the re-simulated days from a ChoiceAnalytics
+and adding the new ones.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import datetime
+from typing import List, Dict, Any
+from simulate_user_choices import (
+    WEEKDAY_MODIFIERS, SEASONAL_MODIFIERS, get_special_event_modifiers, simulate_choice_chunks
+)
+from choice_store import ChoiceStore
+from choice_analytics import ChoiceAnalytics
+
+
+def content_hash(value: Any) -> str:
+    """Hash a JSON-serializable value (independent of dict key order)."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def day_key(day_menu: Dict[str, Any], meal_lookup: Dict[int, Dict[str, Any]]) -> str:
+    """Hash everything the choices of a day depend on, besides the population."""
+    date_obj = datetime.datetime.strptime(day_menu["date"], "%Y-%m-%d").date()
+    return content_hash({
+        "date": day_menu["date"],
+        "meals": [meal_lookup[meal_id] for meal_id in day_menu["meals"]],
+        "weekday_mod": WEEKDAY_MODIFIERS.get(date_obj.weekday()),
+        "seasonal_mod": SEASONAL_MODIFIERS[date_obj.month],
+        "event_mods": get_special_event_modifiers(day_menu["date"])
+    })
+
+
+class IncrementalSimulation:
+    """
+    Per-day choice cache with a patched analysis.
+    """
+
+    def __init__(self, users: List[Dict[str, Any]], engine: str = "vectorized", seed: int = 42):
+        """
+        Initialize an empty cache.
+
+        Args:
+            users: Simulated users
+            engine: Simulation engine (see simulate_choice_chunks)
+            seed: Root seed of the per-user random streams
+        """
+        self.users = users
+        self.engine = engine
+        self.seed = seed
+        self.population_hash = content_hash(users)
+        self.meal_ids = None
+        self.days = {}  # date -> (day key, ChoiceStore of the day)
+        self.analytics = None
+
+    @classmethod
+    def load(cls, path: str, users: List[Dict[str, Any]], engine: str = "vectorized",
+             seed: int = 42) -> "IncrementalSimulation":
+        """Load a saved cache, or start a new one if it is missing or was made for other users, engine or seed."""
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                simulation = pickle.load(f)
+            if (simulation.population_hash, simulation.engine, simulation.seed) == (content_hash(users), engine, seed):
+                return simulation
+            print(f"Ignoring {path}: it was simulated for other users, engine or seed")
+        return cls(users, engine, seed)
+
+    def save(self, path: str):
+        """Save the cache for the next run."""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    def update(self, yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Bring the cache up to date with a yearly menu and meal catalog.
+
+        Args:
+            yearly_menu: Daily menus with date and meal IDs
+            meals: Meal catalog
+
+        Returns:
+            Analysis of the whole menu (same structure as analyze_results)
+        """
+        meal_ids = [meal["id"] for meal in meals]
+        if meal_ids != self.meal_ids:
+            # Choices refer to catalog positions, so a new set of meals starts over
+            self.meal_ids = meal_ids
+            self.days = {}
+            self.analytics = ChoiceAnalytics(self.users, meals)
+        else:
+            self.analytics.meals = meals
+
+        meal_lookup = {meal["id"]: meal for meal in meals}
+        working_days = [
+            day_menu for day_menu in yearly_menu
+            if datetime.datetime.strptime(day_menu["date"], "%Y-%m-%d").weekday() < 5
+        ]
+        keys = {day_menu["date"]: day_key(day_menu, meal_lookup) for day_menu in working_days}
+
+        # Drop days that were removed or changed
+        for date in list(self.days):
+            if keys.get(date) != self.days[date][0]:
+                self.analytics.remove(self.days.pop(date)[1])
+
+        # Re-simulate the missing days together
+        changed = [day_menu for day_menu in working_days if day_menu["date"] not in self.days]
+        if changed:
+            for chunk in simulate_choice_chunks(self.users, changed, meals, self.engine, self.seed):
+                for date, store in chunk.split_days().items():
+                    self.days[date] = (keys[date], store)
+                    self.analytics.update(store)
+
+        # Unchanged days keep their records but refer to the current meal details
+        self.days = {
+            date: (key, store.with_meals(meals))
+            for date, (key, store) in sorted(self.days.items())
+        }
+
+        print(f"Re-simulated {len(changed)} of {len(working_days)} days")
+        return self.analytics.result()
+
+    def day_stores(self) -> List[ChoiceStore]:
+        """Get the cached choices, one store per day in date order."""
+        return [store for _, store in self.days.values()]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Meal Compatibility Matrix
+
+This module precompiles which meals each user can and wants to eat, so the
+simulation does not rescan every meal's ingredients for every user and day.
+Meals and users are encoded once as bitmasks:
+- Allergens: one bit per allergen name found in the meals or user allergies
+- Flags: one bit per meal property a user can exclude or dislike (contains
+  meat, fish, pork, dairy, ..., not vegetarian, mostly non-organic, high CO2)
+
+A user can eat a meal when the meal's allergen bits and the user's allergy
+bits do not overlap and the meal has none of the flags the user excludes.
+The result is a users × meals matrix of preference factors with the same
+values as meal_preference_factor in simulate_user_choices.
+"""
+
+import numpy as np
+from typing import List, Dict, Any
+
+# Meal flag bits
+NOT_VEGETARIAN = 1 << 0  # Category other than vegetarian
+ANIMAL_PRODUCT = 1 << 1  # Animal product, dairy or egg (excluded for vegans)
+MEAT = 1 << 2            # Meat other than fish (excluded for pescatarians)
+FISH = 1 << 3
+SHELLFISH = 1 << 4
+PORK = 1 << 5
+BEEF = 1 << 6
+DAIRY = 1 << 7
+EGG = 1 << 8
+LOW_ORGANIC = 1 << 9     # Less than half of the ingredients are organic
+HIGH_CO2 = 1 << 10       # CO2 footprint above HIGH_CO2_FOOTPRINT
+
+# Dietary restrictions and the meal flags they exclude
+RESTRICTION_FLAGS = {
+    "vegan": ANIMAL_PRODUCT,
+    "pescatarian": MEAT,
+    "no_fish": FISH,
+    "no_shellfish": SHELLFISH,
+    "no_pork": PORK,
+    "no_beef": BEEF,
+    "no_dairy": DAIRY,
+    "no_eggs": EGG
+}
+
+# Ingredient properties and the meal flag they set
+INGREDIENT_FLAGS = [
+    (lambda ing: ing.get("isAnimalProduct", False) or ing.get("isDairy", False) or ing.get("isEgg", False), ANIMAL_PRODUCT),
+    (lambda ing: ing.get("isMeat", False) and not ing.get("isFish", False), MEAT),
+    (lambda ing: ing.get("isFish", False), FISH),
+    (lambda ing: ing.get("isShellfish", False), SHELLFISH),
+    (lambda ing: ing.get("isPork", False), PORK),
+    (lambda ing: ing.get("isBeef", False), BEEF),
+    (lambda ing: ing.get("isDairy", False), DAIRY),
+    (lambda ing: ing.get("isEgg", False), EGG)
+]
+
+# Thresholds of the soft preferences
+ORGANIC_PREFERENCE_THRESHOLD = 0.7  # Users above it dislike LOW_ORGANIC meals
+HIGH_CO2_FOOTPRINT = 5.0            # kg CO2
+LOW_ORGANIC_FACTOR = 0.5
+HIGH_CO2_FACTOR = 0.7
+
+
+def allergen_vocabulary(users: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Assign one bit to every allergen named by a meal ingredient or a user."""
+    names = {allergen for user in users for allergen in user.get("allergies", [])}
+    names.update(
+        allergen for meal in meals for ing in meal.get("ingredients", []) for allergen in ing.get("allergens", [])
+    )
+    if len(names) > 64:
+        raise ValueError(f"Too many distinct allergens for a 64-bit mask: {len(names)}")
+    return {name: 1 << bit for bit, name in enumerate(sorted(names))}
+
+
+def encode_meals(meals: List[Dict[str, Any]], allergen_bits: Dict[str, int]) -> Dict[str, np.ndarray]:
+    """
+    Encode meals as allergen and flag bitmasks.
+
+    Returns:
+        Dict with allergens (uint64) and flags (uint32) per meal
+    """
+    allergens = np.zeros(len(meals), dtype=np.uint64)
+    flags = np.zeros(len(meals), dtype=np.uint32)
+
+    for position, meal in enumerate(meals):
+        ingredients = meal.get("ingredients", [])
+        meal_allergens = 0
+        meal_flags = NOT_VEGETARIAN if meal["categoryId"] != 1 else 0
+
+        for ing in ingredients:
+            for allergen in ing.get("allergens", []):
+                meal_allergens |= allergen_bits[allergen]
+            for has_flag, flag in INGREDIENT_FLAGS:
+                if has_flag(ing):
+                    meal_flags |= flag
+
+        if sum(1 for ing in ingredients if ing.get("isOrganic", False)) < len(ingredients) / 2:
+            meal_flags |= LOW_ORGANIC
+        if meal.get("co2Footprint", 0) > HIGH_CO2_FOOTPRINT:
+            meal_flags |= HIGH_CO2
+
+        allergens[position] = meal_allergens
+        flags[position] = meal_flags
+
+    return {"allergens": allergens, "flags": flags}
+
+
+def encode_users(users: List[Dict[str, Any]], allergen_bits: Dict[str, int]) -> Dict[str, np.ndarray]:
+    """
+    Encode users' allergies, restrictions and soft preferences.
+
+    Returns:
+        Dict with allergies (uint64), excluded flags (uint32), and the
+        organic_minded and eco_conscious booleans per user
+    """
+    allergies = np.zeros(len(users), dtype=np.uint64)
+    excluded = np.zeros(len(users), dtype=np.uint32)
+    organic_minded = np.zeros(len(users), dtype=bool)
+    eco_conscious = np.zeros(len(users), dtype=bool)
+
+    for position, user in enumerate(users):
+        user_allergies = 0
+        for allergen in user.get("allergies", []):
+            user_allergies |= allergen_bits[allergen]
+        allergies[position] = user_allergies
+
+        user_excluded = 0
+        preferences = user.get("dietary_preferences", {})
+        if preferences.get("vegetarian", False):
+            user_excluded |= NOT_VEGETARIAN
+        for restriction, flag in RESTRICTION_FLAGS.items():
+            if user.get("dietary_restrictions", {}).get(restriction, False):
+                user_excluded |= flag
+        excluded[position] = user_excluded
+
+        organic_minded[position] = preferences.get("organic_preference", 0) > ORGANIC_PREFERENCE_THRESHOLD
+        eco_conscious[position] = preferences.get("eco_conscious", False)
+
+    return {"allergies": allergies, "excluded": excluded,
+            "organic_minded": organic_minded, "eco_conscious": eco_conscious}
+
+
+def preference_factor_matrix(users: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Compute the preference factor of every user for every meal.
+
+    Args:
+        users: Users from generate_users (optionally with dietary_restrictions)
+        meals: Meal catalog
+
+    Returns:
+        Factors (users × meals): 0 for incompatible meals, otherwise 1 reduced
+        by LOW_ORGANIC_FACTOR and HIGH_CO2_FACTOR where they apply
+    """
+    allergen_bits = allergen_vocabulary(users, meals)
+    meal_codes = encode_meals(meals, allergen_bits)
+    user_codes = encode_users(users, allergen_bits)
+
+    compatible = (
+        ((user_codes["allergies"][:, np.newaxis] & meal_codes["allergens"]) == 0)
+        & ((user_codes["excluded"][:, np.newaxis] & meal_codes["flags"]) == 0)
+    )
+    low_organic = user_codes["organic_minded"][:, np.newaxis] & ((meal_codes["flags"] & LOW_ORGANIC) != 0)
+    high_co2 = user_codes["eco_conscious"][:, np.newaxis] & ((meal_codes["flags"] & HIGH_CO2) != 0)
+
+    factors = np.where(low_organic, LOW_ORGANIC_FACTOR, 1.0) * np.where(high_co2, HIGH_CO2_FACTOR, 1.0)
+    return np.where(compatible, factors, 0.0)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Yearly Menu Optimizer Script
+
+This script picks the daily menus of a year with the simulated users in the
+loop (the multi-objective menu optimization of dynamic_menu_optimization.md)
+instead of only evaluating a menu made elsewhere:
+- Hard constraints: only meals that pass filter_meals_by_parameters (portion
+  weight, price, CO2, organic share, origins, suppliers and the customer
+  contract) are served, MEALS_PER_DAY different meals a day with at least
+  one vegetarian meal, and a meal is not repeated within MIN_REPEAT_GAP
+  working days
+- Objectives: maximize the attendance and the share of visits that meet
+  the customer contract, minimize the average price and CO2 footprint per
+  visit, combined with OBJECTIVE_WEIGHTS (price and CO2 relative to the
+  contract limits)
+
+The fitness of a day's menu is the expected outcome of the simulation model
+for that day (attendance probabilities and Gumbel-max choice shares of all
+users, computed with the arrays of vectorized_engine), so it is noise-free
+and fast. In the model, days only depend on each other through the repeat
+gap, so the menu is built day by day: the CANDIDATES_PER_DAY best available
+meals of the day are combined into every possible menu and the best one is
+kept. Menus are evaluated once per day context (weekday, attendance and
+preference modifiers) and cached, since most days share a context with
+many others.
+
+The optimized menu and the current menu of meal_data.json are then both
+simulated with simulate_choice_chunks for comparison.
+
+Usage:
+python menu_optimizer.py --config=config.json [--engine=vectorized] [--output-dir=simulation_results/optimized_menu]
+"""
+
+import os
+import copy
+import json
+import random
+import datetime
+import argparse
+import itertools
+import numpy as np
+from typing import List, Dict, Any, Tuple
+from simulate_user_choices import ENGINES, simulate_choice_chunks
+from vectorized_engine import user_arrays, menu_arrays
+from meal_compatibility import preference_factor_matrix
+from choice_analytics import ChoiceAnalytics
+from run_parametrized_simulation import (
+    load_config, filter_meals_by_parameters, adjust_user_profiles, meal_meets_contract
+)
+
+# Weights of the objectives (price and CO2 are divided by the contract limits)
+OBJECTIVE_WEIGHTS = {
+    "attendance": 1.0,
+    "compliance": 0.5,
+    "price": 0.3,
+    "co2": 0.3
+}
+
+MEALS_PER_DAY = 3
+MIN_REPEAT_GAP = 5       # Working days before a meal can be served again
+CANDIDATES_PER_DAY = 10  # Best single meals combined into menus each day
+
+
+class MenuEvaluator:
+    """
+    Expected simulation outcome of daily menus, with cached evaluations.
+    """
+
+    def __init__(self, users: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                 customer_contract: Dict[str, Any], weights: Dict[str, float] = None):
+        """
+        Compile the users and meals into arrays.
+
+        Args:
+            users: Simulated users
+            meals: Meals that can be served
+            customer_contract: Contract with max_price_per_meal and max_co2_per_meal
+            weights: Objective weights (default OBJECTIVE_WEIGHTS)
+        """
+        self.meals = meals
+        self.weights = weights or OBJECTIVE_WEIGHTS
+        self.users = user_arrays(users)
+        self.factors = preference_factor_matrix(users, meals)
+        self.categories = np.array([meal["categoryId"] - 1 for meal in meals], dtype=int)
+        self.price = np.array([meal.get("price", 0) for meal in meals], dtype=float)
+        self.co2 = np.array([meal.get("co2Footprint", 0) for meal in meals], dtype=float)
+        self.compliant = np.array([meal_meets_contract(meal, customer_contract) for meal in meals], dtype=float)
+        self.price_scale = customer_contract["max_price_per_meal"]
+        self.co2_scale = customer_contract["max_co2_per_meal"]
+
+        self.cache = {}
+        self.lookups = 0
+        self.evaluations = 0
+        self._weights = {}
+
+    def _meal_weights(self, preference_modifier: Tuple[float, ...]) -> np.ndarray:
+        """Choice weight of every meal for every user (users × meals) under preference modifiers."""
+        if preference_modifier not in self._weights:
+            self._weights[preference_modifier] = (
+                self.users["category_preferences"][:, self.categories]
+                * np.asarray(preference_modifier)[self.categories]
+                * self.factors
+            )
+        return self._weights[preference_modifier]
+
+    def evaluate(self, context: Tuple[Any, ...], menus: List[Tuple[int, ...]]) -> List[Dict[str, float]]:
+        """
+        Evaluate menus on a day.
+
+        Args:
+            context: (weekday, attendance modifier, preference modifiers) of the day
+            menus: Menus as tuples of meal positions
+
+        Returns:
+            Per menu: expected attendance rate, compliance, price and CO2 per visit, and score
+        """
+        self.lookups += len(menus)
+        missing = [menu for menu in dict.fromkeys(menus) if (context, menu) not in self.cache]
+        if missing:
+            weekday, attendance_modifier, preference_modifier = context
+            probability = np.minimum(
+                1.0, self.users["attendance_rate"] * self.users["weekday_preferences"][:, weekday] * attendance_modifier
+            )
+            options = np.array(missing, dtype=int)                            # menus × meals
+            weights = self._meal_weights(preference_modifier)[:, options]    # users × menus × meals
+            totals = weights.sum(axis=2)
+            shares = weights / np.where(totals > 0, totals, 1)[:, :, np.newaxis]
+
+            # Expected visits per menu and meal (users without an acceptable meal stay away)
+            meal_visits = np.einsum("u,umk->mk", probability, shares)
+            visits = meal_visits.sum(axis=1)
+            per_visit = meal_visits / np.where(visits > 0, visits, 1)[:, np.newaxis]
+
+            attendance = visits / len(probability)
+            compliance = (per_visit * self.compliant[options]).sum(axis=1)
+            price = (per_visit * self.price[options]).sum(axis=1)
+            co2 = (per_visit * self.co2[options]).sum(axis=1)
+            scores = (
+                self.weights["attendance"] * attendance
+                + self.weights["compliance"] * compliance
+                - self.weights["price"] * price / self.price_scale
+                - self.weights["co2"] * co2 / self.co2_scale
+            )
+            for position, menu in enumerate(missing):
+                self.cache[(context, menu)] = {
+                    "attendance": float(attendance[position]),
+                    "compliance": float(compliance[position]),
+                    "price": float(price[position]),
+                    "co2": float(co2[position]),
+                    "score": float(scores[position])
+                }
+            self.evaluations += len(missing)
+
+        return [self.cache[(context, menu)] for menu in menus]
+
+
+def day_contexts(dates: List[str]) -> List[Tuple[Any, ...]]:
+    """Get the (weekday, attendance modifier, preference modifiers) of working days."""
+    menu = menu_arrays([{"date": date, "meals": []} for date in dates], {}, [])
+    return [
+        (int(weekday), float(attendance_modifier), tuple(preference_modifier.tolist()))
+        for weekday, attendance_modifier, preference_modifier
+        in zip(menu["weekday"], menu["attendance_modifier"], menu["preference_modifier"])
+    ]
+
+
+def optimize_menu(evaluator: MenuEvaluator, dates: List[str], meals_per_day: int = MEALS_PER_DAY,
+                  repeat_gap: int = MIN_REPEAT_GAP, candidates_per_day: int = CANDIDATES_PER_DAY) -> List[Dict[str, Any]]:
+    """
+    Build the yearly menu day by day.
+
+    Args:
+        evaluator: MenuEvaluator of the users and servable meals
+        dates: Dates of the year (weekends are skipped)
+        meals_per_day: Meals on each daily menu
+        repeat_gap: Working days before a meal can be served again
+        candidates_per_day: Best single meals combined into menus each day
+
+    Returns:
+        Yearly menu as [{"date", "meals": [meal IDs]}]
+    """
+    meals = evaluator.meals
+    working_days = [date for date in dates if datetime.datetime.strptime(date, "%Y-%m-%d").weekday() < 5]
+    vegetarian = {position for position, meal in enumerate(meals) if meal["categoryId"] == 1}
+
+    yearly_menu = []
+    recent = []  # Menus of the last repeat_gap days
+    for date, context in zip(working_days, day_contexts(working_days)):
+        served = {position for menu in recent for position in menu}
+        available = [position for position in range(len(meals)) if position not in served]
+        if len(available) < meals_per_day:
+            available = list(range(len(meals)))
+
+        # Best single meals of the day (a menu of only that meal)
+        singles = evaluator.evaluate(context, [(position,) * meals_per_day for position in available])
+        ranked = [position for _, position in sorted(zip((-single["score"] for single in singles), available))]
+        candidates = ranked[:candidates_per_day]
+        if not vegetarian.intersection(candidates):
+            candidates += [position for position in ranked if position in vegetarian][:1]
+
+        # Every menu of the candidates (with a vegetarian meal when there is one)
+        menus = [
+            menu for menu in itertools.combinations(sorted(candidates), min(meals_per_day, len(candidates)))
+            if vegetarian.intersection(menu) or not vegetarian.intersection(candidates)
+        ]
+        results = evaluator.evaluate(context, menus)
+        best = max(range(len(menus)), key=lambda index: results[index]["score"])
+
+        yearly_menu.append({"date": date, "meals": [meals[position]["id"] for position in menus[best]]})
+        recent = (recent + [menus[best]])[-repeat_gap:] if repeat_gap else []
+
+    return yearly_menu
+
+
+def simulate_menu(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                  customer_contract: Dict[str, Any], engine: str = "vectorized", seed: int = 42) -> Dict[str, Any]:
+    """Simulate a yearly menu and summarize attendance, contract compliance, price and CO2."""
+    analytics = ChoiceAnalytics(users, meals)
+    for store in simulate_choice_chunks(users, yearly_menu, meals, engine, seed):
+        analytics.update(store)
+    analysis = analytics.result()
+
+    compliant = np.array([meal_meets_contract(meal, customer_contract) for meal in meals], dtype=bool)
+    visits = analytics.meal_counts.sum()
+    return {
+        "attendance_rate": analysis["summary"]["overall_attendance_rate"],
+        "visits": analysis["summary"]["total_actual_visits"],
+        "contract_compliance": float(analytics.meal_counts[compliant].sum() / visits) if visits else 0.0,
+        "price_avg": analysis["ingredient_stats"].get("priceAvg"),
+        "co2_footprint_avg": analysis["ingredient_stats"].get("co2FootprintAvg"),
+        "organic_percentage_avg": analysis["ingredient_stats"].get("organicPercentageAvg")
+    }
+
+
+def main():
+    """Main function to optimize the yearly menu."""
+    parser = argparse.ArgumentParser(description='Optimize the yearly menu against simulated users')
+    parser.add_argument('--config', type=str, help='Path to configuration JSON file')
+    parser.add_argument('--engine', choices=ENGINES, default="vectorized", help='Simulation engine for the comparison')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the population and simulations')
+    parser.add_argument('--repeat-gap', type=int, default=MIN_REPEAT_GAP, help='Working days before a meal is repeated')
+    parser.add_argument('--output-dir', type=str, default="simulation_results/optimized_menu", help='Output directory')
+    args = parser.parse_args()
+
+    # Change to the directory where this script is located
+    config_path = os.path.abspath(args.config) if args.config else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    params = load_config(config_path)
+    customer_contract = params["customer_contract"]
+
+    with open('meal_data.json', 'r') as f:
+        data = json.load(f)
+    with open('ingredient_data.json', 'r') as f:
+        ingredient_data = json.load(f)
+
+    # Filtering sets discounted prices, which both menus are compared with
+    all_meals = copy.deepcopy(data["meals"])
+    meals = filter_meals_by_parameters(all_meals, params, ingredient_data)
+    if len(meals) < MEALS_PER_DAY * (args.repeat_gap + 1):
+        print(f"Warning: Only {len(meals)} meals meet the criteria. Meals will repeat more often.")
+    if len(meals) < MEALS_PER_DAY:
+        raise ValueError(f"Only {len(meals)} meals meet the criteria, at least {MEALS_PER_DAY} are needed")
+
+    random.seed(args.seed)
+    users = adjust_user_profiles(params)
+
+    evaluator = MenuEvaluator(users, meals, customer_contract)
+    dates = [day_menu["date"] for day_menu in data["yearlyMenu"]]
+    yearly_menu = optimize_menu(evaluator, dates, repeat_gap=args.repeat_gap)
+    print(f"Optimized {len(yearly_menu)} days: {evaluator.lookups} menu lookups, {evaluator.evaluations} evaluated "
+          f"({1 - evaluator.evaluations / max(evaluator.lookups, 1):.0%} from cache)")
+
+    comparison = {
+        "current": simulate_menu(users, data["yearlyMenu"], all_meals, customer_contract, args.engine, args.seed),
+        "optimized": simulate_menu(users, yearly_menu, meals, customer_contract, args.engine, args.seed)
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "optimized_meal_data.json"), 'w') as f:
+        json.dump({"meals": meals, "yearlyMenu": yearly_menu}, f, indent=2)
+    with open(os.path.join(args.output_dir, "menu_comparison.json"), 'w') as f:
+        json.dump(comparison, f, indent=2)
+
+    print(f"\n{'Metric':<24}{'Current':>12}{'Optimized':>12}")
+    for metric in comparison["optimized"]:
+        current, optimized = comparison["current"][metric], comparison["optimized"][metric]
+        print(f"{metric:<24}{current if current is not None else float('nan'):>12.3f}{optimized if optimized is not None else float('nan'):>12.3f}")
+    print(f"\nResults saved to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo Replicates
+
+This module runs the same simulation with many independent seeds on a
+process pool and summarizes the analyze_results metrics of all replicates
+as means and percentile bands, so projections come with their uncertainty.
+
+The users, menu and meals are sent to each worker once when it starts and
+are shared read-only by all replicates the worker runs; a replicate only
+returns its (small) analysis, which is accumulated block by block while
+the replicate is simulated.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any
+from simulate_user_choices import simulate_choice_chunks
+from choice_analytics import ChoiceAnalytics
+
+# Percentiles reported for every metric
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+# Analysis fields that describe a metric instead of measuring it
+DESCRIPTIVE_FIELDS = {"name", "category"}
+
+# Simulation inputs of the current worker process (set by _init_worker)
+_shared = {}
+
+
+def _init_worker(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]],
+                 meals: List[Dict[str, Any]], engine: str):
+    """Keep the read-only simulation inputs in the worker process."""
+    _shared.update(users=users, yearly_menu=yearly_menu, meals=meals, engine=engine)
+
+
+def _run_replicate(seed: int) -> Dict[str, Any]:
+    """Simulate and analyze one replicate in a worker process."""
+    analytics = ChoiceAnalytics(_shared["users"], _shared["meals"])
+    for store in simulate_choice_chunks(_shared["users"], _shared["yearly_menu"], _shared["meals"],
+                                        _shared["engine"], seed=seed):
+        analytics.update(store)
+    return analytics.result()
+
+
+def replicate_seeds(seed: int, replicates: int) -> List[int]:
+    """Derive independent replicate seeds from a root seed."""
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(replicates)]
+
+
+def _flatten(analysis: Dict[str, Any], prefix: tuple = ()) -> Dict[tuple, Any]:
+    """Flatten a nested analysis into {key path: leaf value}."""
+    leaves = {}
+    for key, value in analysis.items():
+        if isinstance(value, dict):
+            leaves.update(_flatten(value, prefix + (key,)))
+        else:
+            leaves[prefix + (key,)] = value
+    return leaves
+
+
+def summarize_replicates(analyses: List[Dict[str, Any]],
+                         percentiles: tuple = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+    """
+    Combine replicate analyses into means and percentile bands.
+
+    Every numeric metric becomes {"mean", "std", "p5", "p50", "p95"} (for
+    the default percentiles) at the same place in the analysis structure;
+    other values (meal names, categories) are kept as they are. A metric
+    missing from a replicate (e.g. a meal nobody chose) counts as 0.
+
+    Args:
+        analyses: Results of analyze_results, one per replicate
+        percentiles: Percentiles to report
+
+    Returns:
+        Analysis-shaped dict of metric summaries
+    """
+    flattened = [_flatten(analysis) for analysis in analyses]
+    paths = list(dict.fromkeys(path for leaves in flattened for path in leaves))
+
+    summary = {}
+    for path in paths:
+        values = [leaves.get(path) for leaves in flattened]
+        present = [value for value in values if value is not None]
+        numeric = all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present)
+        if numeric and path[-1] not in DESCRIPTIVE_FIELDS:
+            samples = np.array([value if value is not None else 0 for value in values], dtype=float)
+            leaf = {"mean": float(samples.mean()), "std": float(samples.std())}
+            leaf.update({f"p{p:g}": float(value) for p, value in zip(percentiles, np.percentile(samples, percentiles))})
+        else:
+            leaf = present[0]
+
+        node = summary
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = leaf
+
+    return summary
+
+
+def run_replicates(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                   replicates: int, engine: str = "vectorized", processes: int = None, seed: int = 42,
+                   percentiles: tuple = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+    """
+    Run independent replicates of a simulation in parallel.
+
+    Args:
+        users: Simulated users (the same population in every replicate)
+        yearly_menu: Daily menus with date and meal IDs
+        meals: Meal catalog
+        replicates: Number of replicates
+        engine: Simulation engine (see simulate_choices)
+        processes: Worker processes (default: one per CPU)
+        seed: Root seed the replicate seeds are derived from
+        percentiles: Percentiles to report
+
+    Returns:
+        Dict with replicates, seeds and the summarized metrics
+    """
+    seeds = replicate_seeds(seed, replicates)
+    processes = min(processes or os.cpu_count() or 1, replicates)
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(users, yearly_menu, meals, engine)) as executor:
+        analyses = list(executor.map(_run_replicate, seeds))
+
+    print(f"Completed {replicates} replicates on {processes} processes")
+    return {
+        "replicates": replicates,
+        "seeds": seeds,
+        "percentiles": list(percentiles),
+        "metrics": summarize_replicates(analyses, percentiles)
+    }
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Parameter Sweep Script
+
+This script evaluates many configurations of run_parametrized_simulation
+in one run and compares them in a single table. A sweep file sets the base
+configuration and the parameters to vary, by their path in the
+configuration:
+
+{
+  "base": {"user_count": 300},
+  "method": "lhs",
+  "samples": 20,
+  "parameters": {
+    "price.max": {"min": 50, "max": 80},
+    "co2_footprint.max": {"min": 3.0, "max": 6.0},
+    "customer_contract.min_organic_percentage": [20, 40, 60]
+  }
+}
+
+A parameter is a list of values or a {"min", "max"} range ("steps" values
+for the grid). The grid method evaluates every combination, "random"
+samples uniformly and "lhs" takes a Latin hypercube sample.
+
+The meal data and ingredient data are loaded once and shared with the
+worker processes, the yearly menu is generated once, and no plots are made
+for the individual configurations. Every configuration simulates the same
+base population with the same seed, so differences between rows come from
+the parameters rather than from sampling noise.
+
+Usage:
+python parameter_sweep.py --sweep=sweep.json [--processes=4] [--rank-by=attendance_rate]
+"""
+
+import os
+import copy
+import json
+import random
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any
+from generate_yearly_menu import update_meal_data_file
+from simulate_user_choices import ENGINES, simulate_choice_chunks
+from choice_analytics import ChoiceAnalytics
+from run_parametrized_simulation import (
+    DEFAULT_PARAMS, filter_meals_by_parameters, adjust_user_profiles, meal_meets_contract, restrict_menu,
+    generate_visualizations, generate_report
+)
+
+SAMPLING_METHODS = ["grid", "random", "lhs"]
+
+# Minimum number of meals for a configuration (as in run_parametrized_simulation)
+MIN_MEALS = 30
+
+# Sweep inputs of the current worker process (set by _init_worker)
+_shared = {}
+
+
+def set_parameter(params: Dict[str, Any], path: str, value: Any):
+    """Set a configuration value by its dotted path (e.g. "price.max")."""
+    keys = path.split(".")
+    node = params
+    for key in keys[:-1]:
+        node = node.setdefault(key, {})
+    node[keys[-1]] = value
+
+
+def _native(value: Any) -> Any:
+    """Convert NumPy scalars to Python values for JSON and the config."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def grid_points(parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Every combination of the parameter values (ranges give "steps" values, default 3)."""
+    axes = []
+    for spec in parameters.values():
+        if isinstance(spec, list):
+            axes.append(spec)
+        else:
+            axes.append(np.linspace(spec["min"], spec["max"], spec.get("steps", 3)).tolist())
+    return [dict(zip(parameters, values)) for values in itertools.product(*axes)]
+
+
+def _scale(spec: Any, unit: np.ndarray) -> List[Any]:
+    """Map samples in [0, 1) to a parameter's range or list of values."""
+    if isinstance(spec, list):
+        return [spec[int(u * len(spec))] for u in unit]
+    return (spec["min"] + unit * (spec["max"] - spec["min"])).tolist()
+
+
+def random_points(parameters: Dict[str, Any], samples: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """Independent uniform samples of all parameters."""
+    columns = {path: _scale(spec, rng.random(samples)) for path, spec in parameters.items()}
+    return [{path: columns[path][i] for path in parameters} for i in range(samples)]
+
+
+def latin_hypercube_points(parameters: Dict[str, Any], samples: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """Latin hypercube samples: every parameter range is split into samples strata, each used once."""
+    columns = {
+        path: _scale(spec, (rng.permutation(samples) + rng.random(samples)) / samples)
+        for path, spec in parameters.items()
+    }
+    return [{path: columns[path][i] for path in parameters} for i in range(samples)]
+
+
+def sweep_points(sweep: Dict[str, Any], seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Get the parameter values of every configuration of a sweep.
+
+    Args:
+        sweep: Sweep definition with method, samples and parameters
+        seed: Seed for the random and Latin hypercube methods
+
+    Returns:
+        List of {parameter path: value}
+    """
+    method = sweep.get("method", "grid")
+    parameters = sweep["parameters"]
+    rng = np.random.default_rng(seed)
+
+    if method == "grid":
+        points = grid_points(parameters)
+    elif method == "random":
+        points = random_points(parameters, sweep.get("samples", 10), rng)
+    elif method == "lhs":
+        points = latin_hypercube_points(parameters, sweep.get("samples", 10), rng)
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    return [{path: _native(value) for path, value in point.items()} for point in points]
+
+
+def sweep_config(base: Dict[str, Any], point: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a full configuration from the defaults, the sweep base and one point."""
+    params = copy.deepcopy(DEFAULT_PARAMS)
+    for key, value in base.items():
+        if isinstance(value, dict) and isinstance(params.get(key), dict):
+            params[key].update(value)
+        else:
+            params[key] = value
+    for path, value in point.items():
+        set_parameter(params, path, value)
+    return params
+
+
+def _init_worker(data: Dict[str, Any], ingredient_data: Dict[str, Any], engine: str, seed: int):
+    """Keep the loaded catalogs in the worker process."""
+    _shared.update(data=data, ingredient_data=ingredient_data, engine=engine, seed=seed)
+
+
+def evaluate_config(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Simulate one configuration with the shared catalogs (in a worker process).
+
+    Returns:
+        Dict with the comparison metrics ("metrics") and the full analysis
+    """
+    data = _shared["data"]
+
+    # Filtering sets discounted prices on the meals, so it works on a copy
+    meals = filter_meals_by_parameters(copy.deepcopy(data["meals"]), params, _shared["ingredient_data"])
+    fallback = len(meals) < MIN_MEALS
+    if fallback:
+        meals = copy.deepcopy(data["meals"])
+    yearly_menu = restrict_menu(data["yearlyMenu"], meals)
+
+    # Same base population for every configuration
+    random.seed(_shared["seed"])
+    users = adjust_user_profiles(params)
+
+    analytics = ChoiceAnalytics(users, meals)
+    for store in simulate_choice_chunks(users, yearly_menu, meals, _shared["engine"], _shared["seed"]):
+        analytics.update(store)
+    analysis = analytics.result()
+
+    compliant = np.array([meal_meets_contract(meal, params["customer_contract"]) for meal in meals], dtype=bool)
+    visits = analytics.meal_counts.sum()
+    ingredient_stats = analysis["ingredient_stats"]
+    metrics = {
+        "meals_available": len(meals),
+        "all_meals_fallback": fallback,
+        "menu_days": len(yearly_menu),
+        "attendance_rate": analysis["summary"]["overall_attendance_rate"],
+        "visits": analysis["summary"]["total_actual_visits"],
+        "vegetarian_share": analysis["category_popularity"]["1"]["percentage"],
+        "organic_percentage_avg": ingredient_stats.get("organicPercentageAvg"),
+        "co2_footprint_avg": ingredient_stats.get("co2FootprintAvg"),
+        "price_avg": ingredient_stats.get("priceAvg"),
+        "contract_compliance": float(analytics.meal_counts[compliant].sum() / visits) if visits else 0.0
+    }
+    return {"metrics": metrics, "analysis": analysis}
+
+
+def run_sweep(sweep: Dict[str, Any], engine: str = "vectorized", processes: int = None,
+              seed: int = 42) -> Dict[str, Any]:
+    """
+    Evaluate all configurations of a sweep in parallel.
+
+    Args:
+        sweep: Sweep definition (base, method, samples, parameters)
+        engine: Simulation engine (see simulate_choice_chunks)
+        processes: Worker processes (default: one per CPU)
+        seed: Seed of the sampling, the population and the simulation
+
+    Returns:
+        Dict with the comparison table (DataFrame, one row per
+        configuration), the configurations and their analyses
+    """
+    points = sweep_points(sweep, seed)
+    configs = [sweep_config(sweep.get("base", {}), point) for point in points]
+
+    # Generate the yearly menu and load the catalogs once for all configurations
+    update_meal_data_file()
+    with open('meal_data.json', 'r') as f:
+        data = json.load(f)
+    with open('ingredient_data.json', 'r') as f:
+        ingredient_data = json.load(f)
+
+    processes = min(processes or os.cpu_count() or 1, len(configs))
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(data, ingredient_data, engine, seed)) as executor:
+        results = list(executor.map(evaluate_config, configs))
+
+    print(f"Evaluated {len(configs)} configurations on {processes} processes")
+    table = pd.DataFrame([dict(point, **result["metrics"]) for point, result in zip(points, results)])
+    table.index.name = "config"
+    return {
+        "table": table,
+        "configs": configs,
+        "analyses": [result["analysis"] for result in results]
+    }
+
+
+def main():
+    """Main function to run a parameter sweep."""
+    parser = argparse.ArgumentParser(description='Compare simulations over ranges of parameters')
+    parser.add_argument('--sweep', type=str, required=True, help='Path to sweep definition JSON file')
+    parser.add_argument('--method', choices=SAMPLING_METHODS, help='Sampling method (overrides the sweep file)')
+    parser.add_argument('--samples', type=int, help='Configurations for random/lhs (overrides the sweep file)')
+    parser.add_argument('--engine', choices=ENGINES, default="vectorized", help='Simulation engine')
+    parser.add_argument('--processes', type=int, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the sampling and simulations')
+    parser.add_argument('--rank-by', type=str, default="attendance_rate", help='Metric to sort the table by (descending)')
+    parser.add_argument('--output-dir', type=str, default="simulation_results/sweep", help='Output directory')
+    args = parser.parse_args()
+
+    # Change to the directory where this script is located
+    sweep_path = os.path.abspath(args.sweep)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    with open(sweep_path, 'r') as f:
+        sweep = json.load(f)
+    if args.method:
+        sweep["method"] = args.method
+    if args.samples:
+        sweep["samples"] = args.samples
+
+    result = run_sweep(sweep, args.engine, args.processes, args.seed)
+    table = result["table"].sort_values(args.rank_by, ascending=False)
+
+    # Save the comparison table and the configurations
+    os.makedirs(args.output_dir, exist_ok=True)
+    table.to_csv(os.path.join(args.output_dir, "sweep_comparison.csv"))
+    with open(os.path.join(args.output_dir, "sweep_configs.json"), 'w') as f:
+        json.dump(result["configs"], f, indent=2)
+
+    # Plots and report only for the best configuration
+    best = int(table.index[0])
+    best_dir = os.path.join(args.output_dir, "best")
+    os.makedirs(best_dir, exist_ok=True)
+    generate_visualizations(result["analyses"][best], best_dir)
+    generate_report(result["analyses"][best], result["configs"][best], os.path.join(best_dir, "simulation_report.md"))
+
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(table.to_string(float_format=lambda value: f"{value:.3f}"))
+    print(f"\nBest configuration by {args.rank_by}: {best}")
+    print(f"Results saved to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
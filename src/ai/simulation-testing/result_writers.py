@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Streaming Result Writers
+
+This module writes simulation output incrementally instead of collecting
+everything into one indented JSON document:
+- Choice records are appended chunk by chunk (one ChoiceStore at a time) as
+  NDJSON lines or Parquet row groups, while the simulation runs
+- Users are written as NDJSON, one user per line
+- The analysis goes to its own small JSON file
+
+Choice records hold userId, date, attended and mealId; meal details are
+looked up in the meal catalog saved next to them. read_choices loads a
+choice file back as a DataFrame.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any, Iterable
+from choice_store import ChoiceStore
+
+# Choice file extension per output format
+OUTPUT_FORMATS = {
+    "ndjson": ".ndjson",
+    "parquet": ".parquet"
+}
+
+# Lines parsed at a time when reading NDJSON choice files
+READ_CHUNK_ROWS = 1_000_000
+
+
+class NdjsonChoiceWriter:
+    """
+    Append choice records to a newline-delimited JSON file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._file = open(path, 'w')
+
+    def write(self, store: ChoiceStore):
+        """Append the records of a store"""
+        self._file.writelines(
+            json.dumps(record, separators=(',', ':')) + "\n"
+            for record in store.records(details=False)
+        )
+        self.rows += len(store)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetChoiceWriter:
+    """
+    Append choice records to a Parquet file, one row group per store (needs pyarrow).
+    """
+
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.rows = 0
+        self._pa = pa
+        self._writer = pq.ParquetWriter(path, pa.schema([
+            ("userId", pa.int64()),
+            ("date", pa.string()),
+            ("attended", pa.bool_()),
+            ("mealId", pa.int64())
+        ]))
+
+    def write(self, store: ChoiceStore):
+        """Append the records of a store"""
+        pa = self._pa
+        attended = store.attended
+        meal_ids = np.array([meal["id"] for meal in store.meals] + [0], dtype=np.int64)
+        table = pa.table({
+            "userId": pa.array(np.asarray(store.user_ids, dtype=np.int64)[store.user_index]),
+            "date": pa.array(np.asarray(store.dates, dtype=object)[store.day_index]),
+            "attended": pa.array(attended),
+            "mealId": pa.array(meal_ids[store.meal_index], mask=~attended)
+        }, schema=self._writer.schema)
+        self._writer.write_table(table)
+        self.rows += len(store)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_choice_writer(path_prefix: str, output_format: str):
+    """
+    Open a streaming choice writer.
+
+    Args:
+        path_prefix: Output path without extension
+        output_format: "ndjson" or "parquet"
+
+    Returns:
+        NdjsonChoiceWriter or ParquetChoiceWriter
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    path = path_prefix + OUTPUT_FORMATS[output_format]
+    return ParquetChoiceWriter(path) if output_format == "parquet" else NdjsonChoiceWriter(path)
+
+
+def stream_choices(chunks: Iterable[ChoiceStore], path_prefix: str, output_format: str) -> int:
+    """
+    Write choice chunks as they are simulated.
+
+    Chunks are not kept after they are written; pass them through
+    ChoiceAnalytics.observe to analyze them on the way.
+
+    Args:
+        chunks: Choice stores of consecutive days (see simulate_choice_chunks)
+        path_prefix: Output path without extension
+        output_format: "ndjson" or "parquet"
+
+    Returns:
+        Number of choice records written
+    """
+    with open_choice_writer(path_prefix, output_format) as writer:
+        for store in chunks:
+            writer.write(store)
+        print(f"Wrote {writer.rows:,} choice records to {writer.path}")
+    return writer.rows
+
+
+def read_choices(path: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Read a choice file written by stream_choices.
+
+    Args:
+        path: simulation_choices.ndjson or .parquet
+        columns: Columns to keep (default all), e.g. to leave out mealId
+
+    Returns:
+        Choice records with userId, date (YYYY-MM-DD), attended and mealId
+    """
+    if path.endswith(OUTPUT_FORMATS["parquet"]):
+        return pd.read_parquet(path, columns=columns)
+    if not path.endswith(OUTPUT_FORMATS["ndjson"]):
+        raise ValueError(f"Unknown choice file format: {path}")
+
+    # Parse in chunks so only the requested columns are kept in memory
+    chunks = pd.read_json(path, lines=True, chunksize=READ_CHUNK_ROWS, convert_dates=False)
+    return pd.concat([chunk[columns] if columns else chunk for chunk in chunks], ignore_index=True)
+
+
+def write_users(path: str, users: List[Dict[str, Any]]):
+    """Write users as NDJSON, one user per line."""
+    with open(path, 'w') as f:
+        f.writelines(json.dumps(user, separators=(',', ':')) + "\n" for user in users)
+
+
+def write_analysis(path: str, analysis: Dict[str, Any]):
+    """Write the analysis as a small standalone JSON file."""
+    with open(path, 'w') as f:
+        json.dump(analysis, f, indent=2)
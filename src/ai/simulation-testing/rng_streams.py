@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Per-User Random Streams
+
+This module derives the random numbers of a simulation from a root seed and
+the user and day they belong to, instead of from one generator shared by
+the whole run:
+1. Every user gets a 64-bit key from the SeedSequence with spawn key
+   (stream, user ID), i.e. the child that spawning the root seed into
+   streams and each stream into users would give, addressed directly
+2. The key of a user on a day mixes the user key with the date ordinal
+3. The draws of a user on a day are a counter-based hash (SplitMix64) of
+   that key and the draw number
+
+A draw therefore depends only on the seed, user, date and draw number, not
+on which other users or days are simulated or in which order, so a run
+split across processes or shards is bit-identical to a single-process run.
+The NumPy and plain Python versions return the same numbers.
+"""
+
+import bisect
+import itertools
+import numpy as np
+from typing import List, Any
+
+# Stream IDs, so that different uses of the same seed are independent
+POPULATION_STREAM = 0  # generate_users
+CHOICE_STREAM = 1      # Attendance and meal choices
+
+# SplitMix64 constants
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+MIX_MULTIPLIERS = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+MASK64 = (1 << 64) - 1
+
+
+def user_seed(seed: int, user_id: int, stream: int = CHOICE_STREAM) -> int:
+    """Get the 64-bit key of a user (user IDs are non-negative integers)."""
+    return int(np.random.SeedSequence(seed, spawn_key=(stream, user_id)).generate_state(1, np.uint64)[0])
+
+
+def user_keys(seed: int, user_ids: List[Any], stream: int = CHOICE_STREAM) -> np.ndarray:
+    """Get the keys of users as a uint64 array."""
+    return np.array([user_seed(seed, user_id, stream) for user_id in user_ids], dtype=np.uint64)
+
+
+def _mix(z: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer on uint64 arrays (wrapping arithmetic)."""
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(MIX_MULTIPLIERS[0])
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(MIX_MULTIPLIERS[1])
+    return z ^ (z >> np.uint64(31))
+
+
+def day_keys(keys: np.ndarray, ordinals: np.ndarray) -> np.ndarray:
+    """Get the keys of users on days (broadcasts keys against ordinals)."""
+    keys, ordinals = np.asarray(keys, dtype=np.uint64), np.asarray(ordinals, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        return _mix(keys ^ _mix(ordinals * np.uint64(GOLDEN_GAMMA)))
+
+
+def uniforms(keys: np.ndarray, draws: np.ndarray) -> np.ndarray:
+    """
+    Get numbered draws of user-day keys as floats in (0, 1).
+
+    keys and draws are broadcast against each other, e.g. keys[:, np.newaxis]
+    with np.arange(n) gives n draws per key.
+    """
+    keys, draws = np.asarray(keys, dtype=np.uint64), np.asarray(draws, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        bits = _mix(keys + (draws + np.uint64(1)) * np.uint64(GOLDEN_GAMMA))
+    return ((bits >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+
+
+def _mix_int(z: int) -> int:
+    """SplitMix64 finalizer on a Python int."""
+    z = ((z ^ (z >> 30)) * MIX_MULTIPLIERS[0]) & MASK64
+    z = ((z ^ (z >> 27)) * MIX_MULTIPLIERS[1]) & MASK64
+    return z ^ (z >> 31)
+
+
+class UserDayRandom:
+    """
+    Draws of one user on one day with the random() and choices() interface
+    of the random module (same numbers as uniforms).
+    """
+
+    def __init__(self, key: int, ordinal: int):
+        self.key = _mix_int(key ^ _mix_int((ordinal * GOLDEN_GAMMA) & MASK64))
+        self.draw = 0
+
+    def random(self) -> float:
+        """Next float in (0, 1)"""
+        self.draw += 1
+        bits = _mix_int((self.key + self.draw * GOLDEN_GAMMA) & MASK64)
+        return ((bits >> 11) + 0.5) * 2.0 ** -53
+
+    def choices(self, population: List[Any], weights: List[float]) -> List[Any]:
+        """Pick one element with probability proportional to its weight (like random.choices)."""
+        cum_weights = list(itertools.accumulate(weights))
+        return [population[bisect.bisect(cum_weights, self.random() * cum_weights[-1], 0, len(population) - 1)]]
@@ -11,7 +11,7 @@ This script allows running simulations with different parameters to test various
 - Supplier restrictions
 
 Usage:
-python run_parametrized_simulation.py --config=config.json
+python run_parametrized_simulation.py --config=config.json [--engine=vectorized] [--replicates=50]
 
 Where config.json contains the simulation parameters.
 """
@@ -27,7 +27,12 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from typing import List, Dict, Any, Tuple
 from generate_yearly_menu import update_meal_data_file
-from simulate_user_choices import generate_users, simulate_user_choices, analyze_results
+from simulate_user_choices import (
+    ENGINES, OUTPUT_FORMATS, generate_users, simulate_choices, simulate_choice_chunks, analyze_results
+)
+from result_writers import stream_choices, write_users, write_analysis
+from choice_analytics import ChoiceAnalytics
+from monte_carlo import run_replicates
 
 # Default simulation parameters
 DEFAULT_PARAMS = {
@@ -252,6 +257,24 @@ def filter_meals_by_parameters(meals: List[Dict[str, Any]], params: Dict[str, An
     
     return filtered_meals
 
+def meal_meets_contract(meal: Dict[str, Any], customer_contract: Dict[str, Any]) -> bool:
+    """Check a meal against the price, CO2 and organic limits of a customer contract."""
+    ingredients = meal.get("ingredients", [])
+    organic_percentage = sum(1 for ing in ingredients if ing.get("isOrganic", False)) / len(ingredients) * 100 if ingredients else 0
+    return (meal.get("price", 0) <= customer_contract["max_price_per_meal"]
+            and meal.get("co2Footprint", 0) <= customer_contract["max_co2_per_meal"]
+            and organic_percentage >= customer_contract["min_organic_percentage"])
+
+def restrict_menu(yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Remove meals that are not in the catalog from the daily menus (and days left without meals)."""
+    meal_ids = {meal["id"] for meal in meals}
+    restricted = []
+    for day_menu in yearly_menu:
+        day_meals = [meal_id for meal_id in day_menu["meals"] if meal_id in meal_ids]
+        if day_meals:
+            restricted.append(dict(day_menu, meals=day_meals))
+    return restricted
+
 def adjust_user_profiles(params: Dict[str, Any]) -> List[Dict[str, Any]]:
     """Generate users with adjusted profiles based on parameters."""
     # Import user profiles
@@ -412,8 +435,16 @@ def adjust_user_profiles(params: Dict[str, Any]) -> List[Dict[str, Any]]:
     
     return users
 
-def run_parametrized_simulation(params: Dict[str, Any]) -> Dict[str, Any]:
-    """Run a simulation with the specified parameters."""
+def run_parametrized_simulation(params: Dict[str, Any], engine: str = "python",
+                                replicates: int = 1, processes: int = None,
+                                output_format: str = "json") -> Dict[str, Any]:
+    """
+    Run a simulation with the specified parameters (and optional Monte Carlo replicates).
+    
+    With the "ndjson" or "parquet" output format, choices are streamed to
+    simulation_choices.<ext> instead of being collected in simulation_results.json
+    (see run_simulation in simulate_user_choices).
+    """
     # Create output directory if it doesn't exist
     os.makedirs(params["output_dir"], exist_ok=True)
     
@@ -440,38 +471,56 @@ def run_parametrized_simulation(params: Dict[str, Any]) -> Dict[str, Any]:
         print(f"Warning: Only {len(filtered_meals)} meals meet the criteria. Using all meals instead.")
         filtered_meals = data["meals"]
     
-    # Update meal data with filtered meals
+    # Update meal data with filtered meals (and keep only those on the menus)
     data["meals"] = filtered_meals
-    
-    # Save filtered meal data
+    data["yearlyMenu"] = restrict_menu(data["yearlyMenu"], filtered_meals)
+
+    # Save filtered meal data (compact, it holds the whole catalog and menu)
     with open(os.path.join(params["output_dir"], "filtered_meal_data.json"), 'w') as f:
-        json.dump(data, f, indent=2)
+        json.dump(data, f, separators=(',', ':'))
     
     # Generate users with adjusted profiles
     users = adjust_user_profiles(params)
     
-    # Simulate user choices
-    user_choices = simulate_user_choices(users, data["yearlyMenu"], data["meals"])
-    
-    # Analyze results
-    analysis = analyze_results(user_choices, users, data["meals"])
-    
-    # Save simulation results
-    simulation_data = {
-        "parameters": params,
-        "users": users,
-        "userChoices": user_choices,
-        "analysis": analysis
-    }
+    if output_format == "json":
+        # Simulate user choices
+        choices = simulate_choices(users, data["yearlyMenu"], data["meals"], engine)
+        
+        # Analyze results
+        analysis = analyze_results(choices, users, data["meals"])
+        
+        # Save simulation results
+        simulation_data = {
+            "parameters": params,
+            "users": users,
+            "userChoices": list(choices.records()),
+            "analysis": analysis
+        }
+        
+        with open(os.path.join(params["output_dir"], "simulation_results.json"), 'w') as f:
+            json.dump(simulation_data, f, indent=2)
+    else:
+        # Simulate user choices, analyzing and writing them as they are produced
+        analytics = ChoiceAnalytics(users, data["meals"])
+        chunks = analytics.observe(simulate_choice_chunks(users, data["yearlyMenu"], data["meals"], engine))
+        stream_choices(chunks, os.path.join(params["output_dir"], "simulation_choices"), output_format)
+        analysis = analytics.result()
+        
+        write_users(os.path.join(params["output_dir"], "simulation_users.ndjson"), users)
+        write_analysis(os.path.join(params["output_dir"], "simulation_analysis.json"), analysis)
     
-    with open(os.path.join(params["output_dir"], "simulation_results.json"), 'w') as f:
-        json.dump(simulation_data, f, indent=2)
+    # Run independent replicates for uncertainty bands
+    bands = None
+    if replicates > 1:
+        bands = run_replicates(users, data["yearlyMenu"], data["meals"], replicates, engine, processes)
+        with open(os.path.join(params["output_dir"], "simulation_replicates.json"), 'w') as f:
+            json.dump(bands, f, indent=2)
     
     # Generate visualizations
     generate_visualizations(analysis, params["output_dir"])
     
     # Generate report
-    generate_report(analysis, params, os.path.join(params["output_dir"], "simulation_report.md"))
+    generate_report(analysis, params, os.path.join(params["output_dir"], "simulation_report.md"), bands)
     
     return analysis
 
@@ -587,8 +636,9 @@ def generate_visualizations(analysis: Dict[str, Any], output_dir: str):
         plt.savefig(os.path.join(output_dir, 'allergen_frequency.png'))
         plt.close()
 
-def generate_report(analysis: Dict[str, Any], params: Dict[str, Any], output_path: str):
-    """Generate a markdown report of the simulation results."""
+def generate_report(analysis: Dict[str, Any], params: Dict[str, Any], output_path: str,
+                    bands: Dict[str, Any] = None):
+    """Generate a markdown report of the simulation results (with replicate bands if given)."""
     summary = analysis["summary"]
     customer_contract = params["customer_contract"]
     
@@ -675,6 +725,19 @@ def generate_report(analysis: Dict[str, Any], params: Dict[str, Any], output_pat
     for profile, data in sorted(profile_attendance.items(), key=lambda x: x[1]["rate"], reverse=True):
         report += f"- **{profile}**: {data['rate']:.2%} attendance rate ({data['count']:,} visits out of {data['total']:,} possible)\n"
     
+    # Add uncertainty bands if replicates were run
+    if bands:
+        low, high = f"p{bands['percentiles'][0]:g}", f"p{bands['percentiles'][-1]:g}"
+        metrics = bands["metrics"]
+        report += f"""
+## Uncertainty ({bands["replicates"]} replicates, {low[1:]}th - {high[1:]}th percentile)
+"""
+        rate = metrics["summary"]["overall_attendance_rate"]
+        report += f"- **Overall Attendance Rate**: {rate['mean']:.2%} ({rate[low]:.2%} - {rate[high]:.2%})\n"
+        for category_id, data in sorted(metrics["category_popularity"].items()):
+            share = data["percentage"]
+            report += f"- **{data['name']}**: {share['mean']:.1f}% ({share[low]:.1f}% - {share[high]:.1f}%)\n"
+    
     # Add ingredient statistics if available
     if "ingredient_stats" in analysis and analysis["ingredient_stats"]:
         report += """
@@ -711,6 +774,11 @@ def main():
     """Main function to run the parametrized simulation."""
     parser = argparse.ArgumentParser(description='Run a parametrized simulation')
     parser.add_argument('--config', type=str, help='Path to configuration JSON file')
+    parser.add_argument('--engine', choices=ENGINES, default="python", help='Simulation engine')
+    parser.add_argument('--replicates', type=int, default=1, help='Independent replicates for uncertainty bands')
+    parser.add_argument('--processes', type=int, help='Worker processes for replicates (default: one per CPU)')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default="json",
+                        help='Single JSON document, or streamed NDJSON/Parquet choice records')
     args = parser.parse_args()
     
     # Change to the directory where this script is located
@@ -728,7 +796,8 @@ def main():
         print(f"  {key}: {value}")
     
     # Run simulation
-    analysis = run_parametrized_simulation(params)
+    analysis = run_parametrized_simulation(params, args.engine, args.replicates, args.processes,
+                                           args.output_format)
     
     print(f"\nSimulation completed successfully.")
     print(f"Results saved to {params['output_dir']}")
@@ -18,15 +18,29 @@ import json
 import random
 import datetime
 import os
+import argparse
 import numpy as np
-import pandas as pd
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Iterator
+from meal_compatibility import preference_factor_matrix
+from choice_store import ChoiceStore, meal_details
+from choice_analytics import ChoiceAnalytics
+from rng_streams import POPULATION_STREAM, UserDayRandom, user_seed
 
 # Constants
 YEAR = 2025
 NUM_USERS = 300
 WORKDAYS_PER_YEAR = 260  # Approximate
 
+# Available simulation engines (see simulate_choice_chunks)
+ENGINES = ["python", "vectorized"]
+
+# Output formats: one indented JSON document, or streamed choice records
+# (NDJSON or Parquet) with separate users and analysis files
+OUTPUT_FORMATS = ["json", "ndjson", "parquet"]
+
+# Per-day choice cache of incremental runs (see incremental_simulation)
+INCREMENTAL_CACHE_PATH = 'simulation_cache.pkl'
+
 # User preference profiles
 USER_PROFILES = [
     {"name": "Vegetarian", "veg_pref": 0.8, "organic_pref": 0.15, "quick_pref": 0.05, "attendance_rate": 0.7, "is_vegetarian": True, "organic_preference": 0.4, "eco_conscious": True},
@@ -74,18 +88,26 @@ SPECIAL_EVENTS = [
     {"date": "2025-12-15", "name": "Christmas Lunch Season", "attendance_mod": 1.3, "veg_mod": 0.8, "organic_mod": 1.5, "quick_mod": 0.7}
 ]
 
-def generate_users(num_users: int) -> List[Dict[str, Any]]:
-    """Generate a list of simulated users with preferences."""
+def generate_users(num_users: int, seed: int = None) -> List[Dict[str, Any]]:
+    """
+    Generate a list of simulated users with preferences.
+    
+    Without a seed the global random module is used; with a seed user i is
+    drawn from its own stream (see rng_streams), so any range of users can
+    be generated separately with the same result.
+    """
     users = []
     
     for i in range(1, num_users + 1):
+        rng = random.Random(user_seed(seed, i, POPULATION_STREAM)) if seed is not None else random
+        
         # Randomly assign a profile
-        profile = random.choice(USER_PROFILES)
+        profile = rng.choice(USER_PROFILES)
         
         # Add some randomness to the preferences
-        veg_pref = max(0, min(1, profile["veg_pref"] + random.uniform(-0.1, 0.1)))
-        organic_pref = max(0, min(1, profile["organic_pref"] + random.uniform(-0.1, 0.1)))
-        quick_pref = max(0, min(1, profile["quick_pref"] + random.uniform(-0.1, 0.1)))
+        veg_pref = max(0, min(1, profile["veg_pref"] + rng.uniform(-0.1, 0.1)))
+        organic_pref = max(0, min(1, profile["organic_pref"] + rng.uniform(-0.1, 0.1)))
+        quick_pref = max(0, min(1, profile["quick_pref"] + rng.uniform(-0.1, 0.1)))
         
         # Normalize preferences to sum to 1
         total = veg_pref + organic_pref + quick_pref
@@ -94,30 +116,30 @@ def generate_users(num_users: int) -> List[Dict[str, Any]]:
         quick_pref /= total
         
         # Add some randomness to attendance rate
-        attendance_rate = max(0.1, min(1, profile["attendance_rate"] + random.uniform(-0.1, 0.1)))
+        attendance_rate = max(0.1, min(1, profile["attendance_rate"] + rng.uniform(-0.1, 0.1)))
         
         # Generate weekday preferences (some users prefer certain days)
         weekday_prefs = {}
         for day in range(5):
-            weekday_prefs[day] = max(0.5, min(1.5, random.uniform(0.7, 1.3)))
+            weekday_prefs[day] = max(0.5, min(1.5, rng.uniform(0.7, 1.3)))
         
         # Generate some food allergies and preferences
         allergies = []
-        if random.random() < 0.15:  # 15% chance of having allergies
+        if rng.random() < 0.15:  # 15% chance of having allergies
             possible_allergies = ["gluten", "mælk", "nødder", "æg", "soja", "selleri", "sesam"]
-            num_allergies = random.choices([1, 2, 3], weights=[0.7, 0.2, 0.1])[0]
-            allergies = random.sample(possible_allergies, num_allergies)
+            num_allergies = rng.choices([1, 2, 3], weights=[0.7, 0.2, 0.1])[0]
+            allergies = rng.sample(possible_allergies, num_allergies)
         
         # Add dietary preferences
         is_vegetarian = profile.get("is_vegetarian", False)
-        if not is_vegetarian and random.random() < 0.05:  # 5% chance of being vegetarian regardless of profile
+        if not is_vegetarian and rng.random() < 0.05:  # 5% chance of being vegetarian regardless of profile
             is_vegetarian = True
         
-        organic_preference = profile.get("organic_preference", 0.3) + random.uniform(-0.1, 0.1)
+        organic_preference = profile.get("organic_preference", 0.3) + rng.uniform(-0.1, 0.1)
         organic_preference = max(0, min(1, organic_preference))
         
         eco_conscious = profile.get("eco_conscious", False)
-        if not eco_conscious and random.random() < 0.1:  # 10% chance of being eco-conscious regardless of profile
+        if not eco_conscious and rng.random() < 0.1:  # 10% chance of being eco-conscious regardless of profile
             eco_conscious = True
         
         users.append({
@@ -155,10 +177,163 @@ def get_special_event_modifiers(date_str: str) -> Tuple[float, Dict[str, float]]
     
     return attendance_mod, pref_mods
 
-def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Simulate user choices for each day in the yearly menu."""
+def meal_preference_factor(user: Dict[str, Any], meal: Dict[str, Any]) -> float:
+    """
+    Get the multiplier a user applies to a meal's category preference.
+    
+    The factor is 0 if the meal contains one of the user's allergens or
+    breaks a dietary preference or restriction, and is reduced for
+    non-organic meals (organic-minded users) and high-CO2 meals
+    (eco-conscious users). It does not depend on the day.
+    
+    This is the reference for one pair; the simulation engines use the
+    precompiled matrix from meal_compatibility.preference_factor_matrix.
+    """
+    category_id = meal["categoryId"]
+    factor = 1.0
+    
+    # Check for allergies and other preferences
+    has_allergen = False
+    is_compatible = True
+    
+    if "ingredients" in meal:
+        # Check for allergies
+        for ingredient in meal["ingredients"]:
+            if any(allergen in user["allergies"] for allergen in ingredient.get("allergens", [])):
+                has_allergen = True
+                break
+    
+    # Check for dietary preferences (if user has them)
+    if "dietary_preferences" in user:
+        # Check if vegetarian user is being offered a non-vegetarian meal
+        if user["dietary_preferences"].get("vegetarian", False) and category_id != 1:
+            is_compatible = False
+    
+        # Check if user prefers organic food
+        if user["dietary_preferences"].get("organic_preference", 0) > 0.7:
+            # Count organic ingredients
+            organic_count = sum(1 for ing in meal["ingredients"] if ing.get("isOrganic", False))
+            if organic_count < len(meal["ingredients"]) / 2:  # Less than half ingredients are organic
+                # Reduce preference but don't eliminate
+                factor *= 0.5
+    
+        # Check if user prefers low CO2 footprint
+        if user["dietary_preferences"].get("eco_conscious", False) and "co2Footprint" in meal:
+            if meal["co2Footprint"] > 5.0:  # High CO2 footprint
+                factor *= 0.7
+    
+    # Check for dietary restrictions (if user has them)
+    if "dietary_restrictions" in user:
+        # Check for vegan restriction
+        if user["dietary_restrictions"].get("vegan", False):
+            # Check if meal contains animal products
+            has_animal_products = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isAnimalProduct", False) or ingredient.get("isDairy", False) or ingredient.get("isEgg", False):
+                    has_animal_products = True
+                    break
+            if has_animal_products:
+                is_compatible = False
+    
+        # Check for pescatarian restriction
+        if user["dietary_restrictions"].get("pescatarian", False):
+            # Check if meal contains meat (but fish is allowed)
+            has_meat = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isMeat", False) and not ingredient.get("isFish", False):
+                    has_meat = True
+                    break
+            if has_meat:
+                is_compatible = False
+    
+        # Check for no fish restriction
+        if user["dietary_restrictions"].get("no_fish", False):
+            # Check if meal contains fish
+            has_fish = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isFish", False):
+                    has_fish = True
+                    break
+            if has_fish:
+                is_compatible = False
+    
+        # Check for no shellfish restriction
+        if user["dietary_restrictions"].get("no_shellfish", False):
+            # Check if meal contains shellfish
+            has_shellfish = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isShellfish", False):
+                    has_shellfish = True
+                    break
+            if has_shellfish:
+                is_compatible = False
+    
+        # Check for no pork restriction
+        if user["dietary_restrictions"].get("no_pork", False):
+            # Check if meal contains pork
+            has_pork = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isPork", False):
+                    has_pork = True
+                    break
+            if has_pork:
+                is_compatible = False
+    
+        # Check for no beef restriction
+        if user["dietary_restrictions"].get("no_beef", False):
+            # Check if meal contains beef
+            has_beef = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isBeef", False):
+                    has_beef = True
+                    break
+            if has_beef:
+                is_compatible = False
+    
+        # Check for no dairy restriction
+        if user["dietary_restrictions"].get("no_dairy", False):
+            # Check if meal contains dairy
+            has_dairy = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isDairy", False):
+                    has_dairy = True
+                    break
+            if has_dairy:
+                is_compatible = False
+    
+        # Check for no eggs restriction
+        if user["dietary_restrictions"].get("no_eggs", False):
+            # Check if meal contains eggs
+            has_eggs = False
+            for ingredient in meal["ingredients"]:
+                if ingredient.get("isEgg", False):
+                    has_eggs = True
+                    break
+            if has_eggs:
+                is_compatible = False
+    
+    # If user has allergy to this meal or it's incompatible with dietary preferences, set preference to 0
+    if has_allergen or not is_compatible:
+        return 0.0
+    
+    return factor
+
+def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                          seed: int = None) -> List[Dict[str, Any]]:
+    """
+    Simulate user choices for each day in the yearly menu.
+    
+    Without a seed the global random module is used; with a seed every user
+    and day draws from its own stream (see rng_streams), so the choices of a
+    user do not depend on the other users or on the order of simulation.
+    """
     # Create a lookup for meals by ID
     meal_lookup = {meal["id"]: meal for meal in meals}
+    meal_index = {meal["id"]: position for position, meal in enumerate(meals)}
+    
+    # Precompile allergy, dietary preference and restriction checks once
+    # (users × meals), so the daily loop only looks them up
+    factors = preference_factor_matrix(users, meals)
     
     # Create a mapping from category ID to preference key
     category_to_pref = {
@@ -167,6 +342,9 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
         3: "quick"
     }
     
+    # Random stream key of every user
+    keys = [user_seed(seed, user["id"]) for user in users] if seed is not None else [None] * len(users)
+    
     # Initialize results
     user_choices = []
     
@@ -185,9 +363,12 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
         
         # Get the meals for this day
         day_meals = [meal_lookup[meal_id] for meal_id in day_menu["meals"]]
+        day_positions = [meal_index[meal_id] for meal_id in day_menu["meals"]]
         
         # Process each user
-        for user in users:
+        for user, user_factors, key in zip(users, factors.tolist(), keys):
+            rng = UserDayRandom(key, date_obj.toordinal()) if key is not None else random
+            
             # Determine if user attends on this day
             base_probability = user["attendance_rate"]
             weekday_mod = WEEKDAY_MODIFIERS[weekday] * user["weekday_preferences"][weekday]
@@ -199,13 +380,13 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
             attendance_probability = min(1.0, attendance_probability)
             
             # Decide if user attends
-            attends = random.random() < attendance_probability
+            attends = rng.random() < attendance_probability
             
             if attends:
                 # Calculate meal preferences for this user on this day
                 meal_prefs = []
                 
-                for meal in day_meals:
+                for meal, position in zip(day_meals, day_positions):
                     category_id = meal["categoryId"]
                     pref_key = category_to_pref[category_id]
                     
@@ -215,129 +396,8 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
                     # Apply event modifier
                     modified_pref = base_pref * event_pref_mods[pref_key]
                     
-                    # Check for allergies and other preferences
-                    has_allergen = False
-                    is_compatible = True
-                    
-                    if "ingredients" in meal:
-                        # Check for allergies
-                        for ingredient in meal["ingredients"]:
-                            if any(allergen in user["allergies"] for allergen in ingredient.get("allergens", [])):
-                                has_allergen = True
-                                break
-                        
-                    # Check for dietary preferences (if user has them)
-                    if "dietary_preferences" in user:
-                        # Check if vegetarian user is being offered a non-vegetarian meal
-                        if user["dietary_preferences"].get("vegetarian", False) and category_id != 1:
-                            is_compatible = False
-                        
-                        # Check if user prefers organic food
-                        if user["dietary_preferences"].get("organic_preference", 0) > 0.7:
-                            # Count organic ingredients
-                            organic_count = sum(1 for ing in meal["ingredients"] if ing.get("isOrganic", False))
-                            if organic_count < len(meal["ingredients"]) / 2:  # Less than half ingredients are organic
-                                # Reduce preference but don't eliminate
-                                modified_pref *= 0.5
-                        
-                        # Check if user prefers low CO2 footprint
-                        if user["dietary_preferences"].get("eco_conscious", False) and "co2Footprint" in meal:
-                            if meal["co2Footprint"] > 5.0:  # High CO2 footprint
-                                modified_pref *= 0.7
-                    
-                    # Check for dietary restrictions (if user has them)
-                    if "dietary_restrictions" in user:
-                        # Check for vegan restriction
-                        if user["dietary_restrictions"].get("vegan", False):
-                            # Check if meal contains animal products
-                            has_animal_products = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isAnimalProduct", False) or ingredient.get("isDairy", False) or ingredient.get("isEgg", False):
-                                    has_animal_products = True
-                                    break
-                            if has_animal_products:
-                                is_compatible = False
-                        
-                        # Check for pescatarian restriction
-                        if user["dietary_restrictions"].get("pescatarian", False):
-                            # Check if meal contains meat (but fish is allowed)
-                            has_meat = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isMeat", False) and not ingredient.get("isFish", False):
-                                    has_meat = True
-                                    break
-                            if has_meat:
-                                is_compatible = False
-                        
-                        # Check for no fish restriction
-                        if user["dietary_restrictions"].get("no_fish", False):
-                            # Check if meal contains fish
-                            has_fish = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isFish", False):
-                                    has_fish = True
-                                    break
-                            if has_fish:
-                                is_compatible = False
-                        
-                        # Check for no shellfish restriction
-                        if user["dietary_restrictions"].get("no_shellfish", False):
-                            # Check if meal contains shellfish
-                            has_shellfish = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isShellfish", False):
-                                    has_shellfish = True
-                                    break
-                            if has_shellfish:
-                                is_compatible = False
-                        
-                        # Check for no pork restriction
-                        if user["dietary_restrictions"].get("no_pork", False):
-                            # Check if meal contains pork
-                            has_pork = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isPork", False):
-                                    has_pork = True
-                                    break
-                            if has_pork:
-                                is_compatible = False
-                        
-                        # Check for no beef restriction
-                        if user["dietary_restrictions"].get("no_beef", False):
-                            # Check if meal contains beef
-                            has_beef = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isBeef", False):
-                                    has_beef = True
-                                    break
-                            if has_beef:
-                                is_compatible = False
-                        
-                        # Check for no dairy restriction
-                        if user["dietary_restrictions"].get("no_dairy", False):
-                            # Check if meal contains dairy
-                            has_dairy = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isDairy", False):
-                                    has_dairy = True
-                                    break
-                            if has_dairy:
-                                is_compatible = False
-                        
-                        # Check for no eggs restriction
-                        if user["dietary_restrictions"].get("no_eggs", False):
-                            # Check if meal contains eggs
-                            has_eggs = False
-                            for ingredient in meal["ingredients"]:
-                                if ingredient.get("isEgg", False):
-                                    has_eggs = True
-                                    break
-                            if has_eggs:
-                                is_compatible = False
-                    
-                    # If user has allergy to this meal or it's incompatible with dietary preferences, set preference to 0
-                    if has_allergen or not is_compatible:
-                        modified_pref = 0
+                    # Apply allergies, dietary preferences and restrictions
+                    modified_pref *= user_factors[position]
                     
                     meal_prefs.append((meal["id"], modified_pref))
                 
@@ -356,7 +416,7 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
                     # Choose meal based on preferences
                     meal_ids = [meal_id for meal_id, _ in normalized_prefs]
                     weights = [pref for _, pref in normalized_prefs]
-                    chosen_meal_id = random.choices(meal_ids, weights=weights)[0]
+                    chosen_meal_id = rng.choices(meal_ids, weights=weights)[0]
                     
                     # Record the choice with detailed information
                     choice_data = {
@@ -367,48 +427,9 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
                     }
                     
                     # Add detailed meal information if available
-                    chosen_meal = meal_lookup[chosen_meal_id]
-                    if "ingredients" in chosen_meal:
-                        # Calculate nutritional totals
-                        total_calories = chosen_meal.get("nutritionalInfo", {}).get("calories", 0)
-                        total_protein = chosen_meal.get("nutritionalInfo", {}).get("protein", 0)
-                        total_carbs = chosen_meal.get("nutritionalInfo", {}).get("carbs", 0)
-                        total_fat = chosen_meal.get("nutritionalInfo", {}).get("fat", 0)
-                        
-                        # Calculate ingredient statistics
-                        organic_count = sum(1 for ing in chosen_meal["ingredients"] if ing.get("isOrganic", False))
-                        organic_percentage = organic_count / len(chosen_meal["ingredients"]) * 100
-                        
-                        # Get unique allergens
-                        all_allergens = []
-                        for ing in chosen_meal["ingredients"]:
-                            all_allergens.extend(ing.get("allergens", []))
-                        unique_allergens = list(set(all_allergens))
-                        
-                        # Get unique origins
-                        origins = [ing.get("origin", "Unknown") for ing in chosen_meal["ingredients"]]
-                        unique_origins = list(set(origins))
-                        
-                        # Add to choice data
-                        choice_data["mealDetails"] = {
-                            "name": chosen_meal["name"],
-                            "category": chosen_meal["categoryId"],
-                            "price": chosen_meal.get("price", 0),
-                            "co2Footprint": chosen_meal.get("co2Footprint", 0),
-                            "nutritionalInfo": {
-                                "calories": total_calories,
-                                "protein": total_protein,
-                                "carbs": total_carbs,
-                                "fat": total_fat
-                            },
-                            "ingredientStats": {
-                                "totalCount": len(chosen_meal["ingredients"]),
-                                "organicCount": organic_count,
-                                "organicPercentage": organic_percentage,
-                                "allergens": unique_allergens,
-                                "origins": unique_origins
-                            }
-                        }
+                    details = meal_details(meal_lookup[chosen_meal_id])
+                    if details is not None:
+                        choice_data["mealDetails"] = details
                     
                     user_choices.append(choice_data)
             else:
@@ -422,163 +443,59 @@ def simulate_user_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[st
     
     return user_choices
 
-def analyze_results(user_choices: List[Dict[str, Any]], users: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Analyze the simulation results to extract insights."""
-    # Create a DataFrame for easier analysis
-    df = pd.DataFrame(user_choices)
-    
-    # Create a lookup for meals by ID
-    meal_lookup = {meal["id"]: meal for meal in meals}
-    
-    # Basic statistics
-    total_days = len(df["date"].unique())
-    total_users = len(df["userId"].unique())
-    total_possible_visits = total_days * total_users
-    total_actual_visits = df["attended"].sum()
-    attendance_rate = total_actual_visits / total_possible_visits
-    
-    # Meal popularity
-    meal_counts = df[df["attended"]]["mealId"].value_counts().to_dict()
-    meal_popularity = {
-        meal_id: {
-            "count": count,
-            "percentage": count / total_actual_visits * 100,
-            "name": meal_lookup[meal_id]["name"] if meal_id in meal_lookup else "Unknown",
-            "category": meal_lookup[meal_id]["categoryId"] if meal_id in meal_lookup else "Unknown"
-        }
-        for meal_id, count in meal_counts.items()
-    }
-    
-    # Category popularity
-    category_counts = {
-        1: 0,  # Vegetarian
-        2: 0,  # Organic with meat
-        3: 0   # Quick
-    }
-    
-    for meal_id, count in meal_counts.items():
-        if meal_id in meal_lookup:
-            category = meal_lookup[meal_id]["categoryId"]
-            category_counts[category] += count
-    
-    category_popularity = {
-        category: {
-            "count": count,
-            "percentage": count / total_actual_visits * 100,
-            "name": {1: "Vegetarian", 2: "Organic with meat", 3: "Quick"}[category]
-        }
-        for category, count in category_counts.items()
-    }
-    
-    # Attendance by weekday
-    df["weekday"] = pd.to_datetime(df["date"]).dt.weekday
-    weekday_attendance = {str(k): float(v) for k, v in df.groupby("weekday")["attended"].mean().to_dict().items()}
-    
-    # Attendance by month
-    df["month"] = pd.to_datetime(df["date"]).dt.month
-    month_attendance = {str(k): float(v) for k, v in df.groupby("month")["attended"].mean().to_dict().items()}
-    
-    # User profile analysis
-    user_lookup = {user["id"]: user for user in users}
-    profile_attendance = {}
-    
-    for user_id in df["userId"].unique():
-        user = user_lookup[user_id]
-        profile = user["profile"]
-        
-        if profile not in profile_attendance:
-            profile_attendance[profile] = {"count": 0, "total": 0}
-        
-        user_df = df[df["userId"] == user_id]
-        profile_attendance[profile]["count"] += user_df["attended"].sum()
-        profile_attendance[profile]["total"] += len(user_df)
-    
-    for profile, data in profile_attendance.items():
-        data["rate"] = data["count"] / data["total"] if data["total"] > 0 else 0
-    
-    # Ingredient analysis (if detailed meal information is available)
-    ingredient_stats = {}
-    organic_percentage_avg = 0
-    co2_footprint_avg = 0
-    price_avg = 0
-    
-    # Filter choices with meal details
-    detailed_choices = [choice for choice in user_choices if choice.get("attended") and "mealDetails" in choice]
-    
-    if detailed_choices:
-        # Calculate averages
-        organic_percentage_avg = sum(choice["mealDetails"]["ingredientStats"]["organicPercentage"] for choice in detailed_choices) / len(detailed_choices)
-        co2_footprint_avg = sum(choice["mealDetails"]["co2Footprint"] for choice in detailed_choices) / len(detailed_choices)
-        price_avg = sum(choice["mealDetails"]["price"] for choice in detailed_choices) / len(detailed_choices)
-        
-        # Count origins
-        origin_counts = {}
-        for choice in detailed_choices:
-            for origin in choice["mealDetails"]["ingredientStats"]["origins"]:
-                origin_counts[origin] = origin_counts.get(origin, 0) + 1
-        
-        # Count allergens
-        allergen_counts = {}
-        for choice in detailed_choices:
-            for allergen in choice["mealDetails"]["ingredientStats"]["allergens"]:
-                allergen_counts[allergen] = allergen_counts.get(allergen, 0) + 1
-        
-        ingredient_stats = {
-            "organicPercentageAvg": organic_percentage_avg,
-            "co2FootprintAvg": co2_footprint_avg,
-            "priceAvg": price_avg,
-            "originCounts": origin_counts,
-            "allergenCounts": allergen_counts
-        }
-    
-    # Create a JSON-serializable result dictionary
-    # Convert any NumPy types to native Python types
-    return {
-        "summary": {
-            "total_days": int(total_days),
-            "total_users": int(total_users),
-            "total_possible_visits": int(total_possible_visits),
-            "total_actual_visits": int(total_actual_visits),
-            "overall_attendance_rate": float(attendance_rate)
-        },
-        "meal_popularity": {
-            str(meal_id): {
-                "count": int(data["count"]),
-                "percentage": float(data["percentage"]),
-                "name": str(data["name"]),
-                "category": int(data["category"]) if isinstance(data["category"], (int, np.integer)) else str(data["category"])
-            }
-            for meal_id, data in meal_popularity.items()
-        },
-        "category_popularity": {
-            str(category): {
-                "count": int(data["count"]),
-                "percentage": float(data["percentage"]),
-                "name": str(data["name"])
-            }
-            for category, data in category_popularity.items()
-        },
-        "weekday_attendance": weekday_attendance,
-        "month_attendance": month_attendance,
-        "profile_attendance": {
-            profile: {
-                "count": int(data["count"]),
-                "total": int(data["total"]),
-                "rate": float(data["rate"])
-            }
-            for profile, data in profile_attendance.items()
-        },
-        "ingredient_stats": {
-            "organicPercentageAvg": float(organic_percentage_avg),
-            "co2FootprintAvg": float(co2_footprint_avg),
-            "priceAvg": float(price_avg),
-            "originCounts": {str(origin): int(count) for origin, count in ingredient_stats.get("originCounts", {}).items()},
-            "allergenCounts": {str(allergen): int(count) for allergen, count in ingredient_stats.get("allergenCounts", {}).items()}
-        } if ingredient_stats else {}
-    }
+def simulate_choice_chunks(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                           engine: str = "python", seed: int = 42) -> Iterator[ChoiceStore]:
+    """
+    Simulate user choices with the selected engine, yielding them as they are ready.
+    
+    "python" is the reference loop in simulate_user_choices and yields the
+    whole run at once; "vectorized" samples the same model with NumPy arrays
+    (see vectorized_engine), is much faster for large populations and yields
+    blocks of consecutive days. Both draw from per-user, per-day streams of
+    the seed (see rng_streams), so simulating any subset of the users (e.g.
+    one shard) gives the same choices for them as simulating everyone.
+    """
+    if engine == "vectorized":
+        from vectorized_engine import iter_choice_stores
+        yield from iter_choice_stores(users, yearly_menu, meals, seed)
+        return
+    if engine != "python":
+        raise ValueError(f"Unknown simulation engine: {engine}")
+    user_choices = simulate_user_choices(users, yearly_menu, meals, seed)
+    yield ChoiceStore.from_records(user_choices, meals, [user["id"] for user in users])
 
-def run_simulation():
-    """Run the full simulation and save results."""
+def simulate_choices(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]], meals: List[Dict[str, Any]],
+                     engine: str = "python", seed: int = 42) -> ChoiceStore:
+    """Simulate user choices with the selected engine as one ChoiceStore (see simulate_choice_chunks)."""
+    return ChoiceStore.concat(list(simulate_choice_chunks(users, yearly_menu, meals, engine, seed)))
+
+def analyze_results(user_choices: Any, users: List[Dict[str, Any]], meals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Analyze the simulation results (a ChoiceStore or userChoices dicts) to extract insights.
+    
+    All metrics are computed in one pass over the records (see choice_analytics);
+    use ChoiceAnalytics directly to analyze choices while they are simulated.
+    """
+    store = user_choices if isinstance(user_choices, ChoiceStore) else ChoiceStore.from_records(user_choices, meals)
+    
+    analytics = ChoiceAnalytics(users, meals)
+    analytics.update(store)
+    return analytics.result()
+
+def run_simulation(engine: str = "python", replicates: int = 1, processes: int = None, output_format: str = "json",
+                   incremental: bool = False):
+    """
+    Run the full simulation and save results.
+    
+    The "json" output format writes everything to simulation_results.json;
+    "ndjson" and "parquet" stream the choices to simulation_choices.<ext>
+    while they are simulated and write simulation_users.ndjson and
+    simulation_analysis.json next to it (see result_writers).
+    
+    With incremental, the choices of every day are cached in
+    INCREMENTAL_CACHE_PATH and only days whose menu, meals or modifiers
+    changed since the last run are re-simulated (see incremental_simulation).
+    """
     # Load meal data
     with open('meal_data.json', 'r') as f:
         data = json.load(f)
@@ -586,25 +503,56 @@ def run_simulation():
     # Generate users
     users = generate_users(NUM_USERS)
     
-    # Simulate user choices
-    user_choices = simulate_user_choices(users, data["yearlyMenu"], data["meals"])
-    
-    # Analyze results
-    analysis = analyze_results(user_choices, users, data["meals"])
-    
-    # Save simulation results
-    simulation_data = {
-        "users": users,
-        "userChoices": user_choices,
-        "analysis": analysis
-    }
-    
-    with open('simulation_results.json', 'w') as f:
-        json.dump(simulation_data, f, indent=2)
+    if incremental:
+        from incremental_simulation import IncrementalSimulation
+        
+        # Re-simulate the changed days and patch the analysis
+        simulation = IncrementalSimulation.load(INCREMENTAL_CACHE_PATH, users, engine)
+        simulation.update(data["yearlyMenu"], data["meals"])
+        simulation.save(INCREMENTAL_CACHE_PATH)
+        analytics, chunks = simulation.analytics, simulation.day_stores()
+    else:
+        # Simulate user choices, analyzing them as they are produced
+        analytics = ChoiceAnalytics(users, data["meals"])
+        chunks = analytics.observe(simulate_choice_chunks(users, data["yearlyMenu"], data["meals"], engine))
+    
+    if output_format == "json":
+        choices = ChoiceStore.concat(list(chunks))
+        analysis = analytics.result()
+        records = len(choices)
+        
+        # Save simulation results
+        simulation_data = {
+            "users": users,
+            "userChoices": list(choices.records()),
+            "analysis": analysis
+        }
+        
+        with open('simulation_results.json', 'w') as f:
+            json.dump(simulation_data, f, indent=2)
+    else:
+        from result_writers import stream_choices, write_users, write_analysis
+        
+        # Write the choices as they are produced
+        records = stream_choices(chunks, 'simulation_choices', output_format)
+        analysis = analytics.result()
+        
+        write_users('simulation_users.ndjson', users)
+        write_analysis('simulation_analysis.json', analysis)
     
-    print(f"Simulation completed with {len(user_choices)} user choice records.")
+    print(f"Simulation completed with {records} user choice records.")
     print(f"Overall attendance rate: {analysis['summary']['overall_attendance_rate']:.2%}")
     
+    # Run independent replicates for uncertainty bands
+    if replicates > 1:
+        from monte_carlo import run_replicates
+        bands = run_replicates(users, data["yearlyMenu"], data["meals"], replicates, engine, processes)
+        with open('simulation_replicates.json', 'w') as f:
+            json.dump(bands, f, indent=2)
+        
+        rate = bands["metrics"]["summary"]["overall_attendance_rate"]
+        print(f"Attendance rate over {replicates} replicates: {rate['mean']:.2%} (90% band {rate['p5']:.2%} - {rate['p95']:.2%})")
+    
     # Print category popularity
     print("\nCategory Popularity:")
     for category_id, data in sorted(analysis["category_popularity"].items()):
@@ -634,6 +582,16 @@ def run_simulation():
             print(f"  {allergen}: {count} occurrences")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulate user choices for a full year')
+    parser.add_argument('--engine', choices=ENGINES, default="python", help='Simulation engine')
+    parser.add_argument('--replicates', type=int, default=1, help='Independent replicates for uncertainty bands')
+    parser.add_argument('--processes', type=int, help='Worker processes for replicates (default: one per CPU)')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default="json",
+                        help='Single JSON document, or streamed NDJSON/Parquet choice records')
+    parser.add_argument('--incremental', action='store_true',
+                        help=f'Only re-simulate days that changed since the last run (cached in {INCREMENTAL_CACHE_PATH})')
+    args = parser.parse_args()
+    
     # Change to the directory where this script is located
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     
@@ -641,4 +599,4 @@ if __name__ == "__main__":
     random.seed(42)
     np.random.seed(42)
     
-    run_simulation()
+    run_simulation(args.engine, args.replicates, args.processes, args.output_format, args.incremental)
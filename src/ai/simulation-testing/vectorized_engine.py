@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Vectorized Simulation Engine
+
+This module runs the user choice model of simulate_user_choices on NumPy
+arrays instead of looping over days × users × meals in Python:
+1. Attendance probabilities are computed as a users × days matrix from the
+   user attendance rates, WEEKDAY_MODIFIERS, SEASONAL_MODIFIERS and the
+   special event modifiers, and attendance is sampled in bulk
+2. Meal preferences are a users × meals matrix compiled once per run (see
+   meal_compatibility), and
+   each attending user picks one of the day's meals by Gumbel-max sampling
+   (argmax of log weight + Gumbel noise), which draws from the same
+   distribution as random.choices with those weights
+
+All draws come from the per-user, per-day streams of rng_streams, so the
+outcomes of a user on a day do not depend on the other users, the days
+simulated with it or DAYS_PER_BLOCK. The results follow the same
+distribution as simulate_user_choices, but not the same draws, so
+individual records differ for the same seed.
+"""
+
+import datetime
+import numpy as np
+from typing import List, Dict, Any, Iterator, Tuple
+from simulate_user_choices import (
+    WEEKDAY_MODIFIERS, SEASONAL_MODIFIERS, get_special_event_modifiers
+)
+from meal_compatibility import preference_factor_matrix
+from choice_store import ChoiceStore
+from rng_streams import user_keys, day_keys, uniforms
+
+# Preference key of each meal category, in category ID order (1, 2, 3)
+CATEGORY_PREFERENCES = ["vegetarian", "organic", "quick"]
+
+# Days sampled per block, which bounds the size of the per-day arrays
+DAYS_PER_BLOCK = 20
+
+
+def user_arrays(users: List[Dict[str, Any]], seed: int = 42) -> Dict[str, np.ndarray]:
+    """
+    Collect the random stream keys, attendance and category preference parameters of users.
+
+    Returns:
+        Dict with keys (users,), attendance_rate (users,), weekday_preferences
+        (users, 5) and category_preferences (users, 3)
+    """
+    return {
+        "keys": user_keys(seed, [user["id"] for user in users]),
+        "attendance_rate": np.array([user["attendance_rate"] for user in users], dtype=float),
+        "weekday_preferences": np.array([[user["weekday_preferences"][day] for day in range(5)] for user in users], dtype=float),
+        "category_preferences": np.array([[user["preferences"][key] for key in CATEGORY_PREFERENCES] for user in users], dtype=float)
+    }
+
+
+def menu_arrays(yearly_menu: List[Dict[str, Any]], meal_index: Dict[int, int],
+                meals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Collect the working days of a yearly menu as arrays.
+
+    Returns:
+        Dict with dates (list of str), ordinals, weekday, attendance_modifier (days,),
+        preference_modifier (days, 3), day_meals, day_categories and
+        day_offered (days, options; days with fewer meals are padded with
+        meals that are not offered)
+    """
+    days = []
+    for day_menu in yearly_menu:
+        date_obj = datetime.datetime.strptime(day_menu["date"], "%Y-%m-%d").date()
+        if date_obj.weekday() < 5:
+            days.append((day_menu, date_obj))
+
+    weekday = np.array([date_obj.weekday() for _, date_obj in days], dtype=int)
+    attendance_modifier = np.empty(len(days))
+    preference_modifier = np.empty((len(days), len(CATEGORY_PREFERENCES)))
+    for position, (day_menu, date_obj) in enumerate(days):
+        event_attendance_mod, event_pref_mods = get_special_event_modifiers(day_menu["date"])
+        attendance_modifier[position] = (
+            WEEKDAY_MODIFIERS[date_obj.weekday()] * SEASONAL_MODIFIERS[date_obj.month] * event_attendance_mod
+        )
+        preference_modifier[position] = [event_pref_mods[key] for key in CATEGORY_PREFERENCES]
+
+    options = max((len(day_menu["meals"]) for day_menu, _ in days), default=0)
+    day_meals = np.zeros((len(days), options), dtype=int)
+    day_offered = np.zeros((len(days), options), dtype=bool)
+    for position, (day_menu, _) in enumerate(days):
+        offered = [meal_index[meal_id] for meal_id in day_menu["meals"]]
+        day_meals[position, :len(offered)] = offered
+        day_offered[position, :len(offered)] = True
+    categories = np.array([meal["categoryId"] - 1 for meal in meals], dtype=int)
+    return {
+        "dates": [day_menu["date"] for day_menu, _ in days],
+        "ordinals": np.array([date_obj.toordinal() for _, date_obj in days], dtype=np.uint64),
+        "weekday": weekday,
+        "attendance_modifier": attendance_modifier,
+        "preference_modifier": preference_modifier,
+        "day_meals": day_meals,
+        "day_categories": categories[day_meals],
+        "day_offered": day_offered
+    }
+
+
+def sample_choice_blocks(users: Dict[str, np.ndarray], factors: np.ndarray,
+                         menu: Dict[str, Any]) -> Iterator[Tuple[slice, np.ndarray]]:
+    """
+    Sample attendance and meal choices for all users, DAYS_PER_BLOCK days at a time.
+
+    Args:
+        users: Parameters from user_arrays
+        factors: Meal preference factors (users × meals) from preference_factor_matrix
+        menu: Working days from menu_arrays
+
+    Yields:
+        The block of days and the outcome per user and day of the block
+        (users × days): the chosen meal position, -1 for non-attendance, or
+        -2 when the user wanted to attend but every meal of the day was
+        excluded (no record, as in simulate_user_choices)
+    """
+    n_users, n_days = len(users["attendance_rate"]), len(menu["dates"])
+
+    for start in range(0, n_days, DAYS_PER_BLOCK):
+        block = slice(start, min(start + DAYS_PER_BLOCK, n_days))
+        outcomes = np.full((n_users, block.stop - start), -1, dtype=np.int32)
+
+        # Random stream of every user on every day of the block
+        keys = day_keys(users["keys"][:, np.newaxis], menu["ordinals"][block])
+
+        # Attendance probability per user and day, capped at 1
+        probabilities = np.minimum(
+            1.0,
+            users["attendance_rate"][:, np.newaxis]
+            * users["weekday_preferences"][:, menu["weekday"][block]]
+            * menu["attendance_modifier"][block]
+        )
+        user_rows, block_columns = np.nonzero(uniforms(keys, 0) < probabilities)
+        day_columns = block_columns + start
+
+        # Weight of every offered meal for the attending users
+        day_meals = menu["day_meals"][day_columns]
+        day_categories = menu["day_categories"][day_columns]
+        weights = (
+            users["category_preferences"][user_rows[:, np.newaxis], day_categories]
+            * menu["preference_modifier"][day_columns[:, np.newaxis], day_categories]
+            * factors[user_rows[:, np.newaxis], day_meals]
+            * menu["day_offered"][day_columns]
+        )
+
+        # Gumbel-max: argmax of log weight + Gumbel noise samples ∝ weight
+        # (draw 0 was attendance, draws 1.. are the noise of each offered meal)
+        noise = uniforms(keys[user_rows, block_columns][:, np.newaxis], np.arange(1, weights.shape[1] + 1))
+        with np.errstate(divide="ignore"):
+            scores = np.log(weights) - np.log(-np.log(noise))
+        chosen = day_meals[np.arange(len(day_meals)), np.argmax(scores, axis=1)]
+        outcomes[user_rows, block_columns] = np.where(weights.any(axis=1), chosen, -2)
+
+        yield block, outcomes
+
+
+def sample_choices(users: Dict[str, np.ndarray], factors: np.ndarray, menu: Dict[str, Any]) -> np.ndarray:
+    """Sample the outcomes of all days at once (users × days, see sample_choice_blocks)."""
+    blocks = [outcomes for _, outcomes in sample_choice_blocks(users, factors, menu)]
+    return np.hstack(blocks) if blocks else np.full((len(users["attendance_rate"]), 0), -1, dtype=np.int32)
+
+
+def iter_choice_stores(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]],
+                       meals: List[Dict[str, Any]], seed: int = 42) -> Iterator[ChoiceStore]:
+    """
+    Simulate user choices with array operations, one block of days at a time.
+
+    Args:
+        users: Users from generate_users
+        yearly_menu: Daily menus with date and meal IDs
+        meals: Meal catalog
+        seed: Root seed of the per-user random streams
+
+    Yields:
+        Choices of DAYS_PER_BLOCK consecutive days, in the order of simulate_user_choices
+    """
+    meal_index = {meal["id"]: position for position, meal in enumerate(meals)}
+    menu = menu_arrays(yearly_menu, meal_index, meals)
+    user_ids = [user["id"] for user in users]
+    for block, outcomes in sample_choice_blocks(user_arrays(users, seed), preference_factor_matrix(users, meals), menu):
+        yield ChoiceStore.from_outcomes(outcomes, user_ids, menu["dates"][block], meals)
+
+
+def simulate_choice_store(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]],
+                          meals: List[Dict[str, Any]], seed: int = 42) -> ChoiceStore:
+    """Simulate user choices with array operations (all days in one ChoiceStore)."""
+    return ChoiceStore.concat(list(iter_choice_stores(users, yearly_menu, meals, seed)))
+
+
+def simulate_user_choices_vectorized(users: List[Dict[str, Any]], yearly_menu: List[Dict[str, Any]],
+                                     meals: List[Dict[str, Any]], seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Simulate user choices with array operations, returning userChoices dicts.
+
+    Takes the same inputs and returns records in the same format and order
+    as simulate_user_choices.
+    """
+    return list(simulate_choice_store(users, yearly_menu, meals, seed).records())